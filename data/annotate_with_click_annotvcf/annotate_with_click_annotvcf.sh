@@ -12,28 +12,38 @@ mkdir temp
 printf "${GREEN}→ Convert .txt to .vcf...${NO_COLOR}\n"
 
 INPUT_FILE="../raw/all_IMPACT_mutations_20181105.txt"
-OUTPUT_VCF="temp/all_IMPACT_mutations_20181105.vcf"
+OUTPUT_VCF="temp/all_IMPACT_mutations_20181105.vcf.gz"
+SHARD_SIZE=50000
 
-# custom Python script to convert impact from .txt to .vcf
-python3 convert_impact_to_vcf.py $INPUT_FILE $OUTPUT_VCF
+# persistent cache of the annotations, keyed on the normalized variants and on the annotation sources version (change the version
+# when a source is updated so that every variant is annotated again)
+ANNOTATION_CACHE="annotation_cache.sqlite"
+ANNOTATION_SOURCE="GRCH37D5|vagrent_75|ensembl_91|gnomAD_2.0.1|COSMIC_81"
+MISSING_VCF="temp/missing_IMPACT_mutations_20181105.vcf.gz"
+MANIFEST="temp/missing_IMPACT_mutations_20181105.manifest.tsv"
 
-# create the .vcf header
-sed -i '1s/^/##fileformat=VCFv4.2\n/' $OUTPUT_VCF
-sed -i '2s/^/##INFO=<ID=OLD_REF_ALT_POS,Number=1,Type=String,Description="Old REF\/ALT\/POS values">\n/' $OUTPUT_VCF
-sed -i '3s/^/#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\n/' $OUTPUT_VCF
+# custom Python script to convert impact from .txt to a coordinate-sorted and bgzip-compressed .vcf.gz, with its header and tabix index
+python3 convert_impact_to_vcf.py $INPUT_FILE $OUTPUT_VCF --chunksize 100000
+# variants not annotated yet, split in shards of at most $SHARD_SIZE variants listed in $MANIFEST, to be annotated in parallel
+python3 annotation_cache.py $ANNOTATION_CACHE "$ANNOTATION_SOURCE" split $OUTPUT_VCF $MISSING_VCF --shard-size $SHARD_SIZE
 
-head $OUTPUT_VCF
-cp $OUTPUT_VCF .
-gzip $OUTPUT_VCF
+zcat $OUTPUT_VCF | head
+cat $MANIFEST
+cp $OUTPUT_VCF $OUTPUT_VCF.tbi .
 
 
 ##############################################
 ## annotate.vcf with click_annotvcf ##########
 ##############################################
 printf "${GREEN}→ Annotate with click_annotvcf annotvcf (Juanes pipeline)...${NO_COLOR}\n"
+# annotate every shard of the manifest in parallel (the loop reads the manifest without a pipe so that wait sees the background jobs),
+# the script stopping if any shard fails so that the merge never runs on a missing or partial shard
+SHARD_PIDS=()
+while IFS=$'\t' read SHARD SHARD_PATH N_VARIANTS FIRST_CHROM FIRST_POS LAST_CHROM LAST_POS
+do
 click_annotvcf annotvcf \
---input_vcf $OUTPUT_VCF.gz \
---outdir temp \
+--input_vcf temp/$SHARD_PATH \
+--outdir temp/shard_$SHARD \
 --output_prefix annotvcf \
 --assembly GRCH37D5 \
 --reference /ifs/work/leukgen/ref/homo_sapiens/GRCh37d5/genome/gr37.fasta \
@@ -42,9 +52,21 @@ click_annotvcf annotvcf \
 --ensembl-version 91 \
 --custom /ifs/work/leukgen/home/leukbot/tests/vep/gnomad_genomes/gnomad.genomes.r2.0.1.sites.noVEP.vcf.gz gnomAD_genome AC_AFR,AC_AMR,AC_ASJ,AC_EAS,AC_FIN,AC_NFE,AC_OTH,AC_Male,AC_Female,AN_AFR,AN_AMR,AN_ASJ,AN_EAS,AN_FIN,AN_NFE,AN_OTH,AN_Male,AN_Female,AF_AFR,AF_AMR,AF_ASJ,AF_EAS,AF_FIN,AF_NFE,AF_OTH,AF_Male,AF_Female,Hom_HomR,Hom_AMR,Hom_ASJ,Hom_EAS,Hom_FIN,Hom_NFE,Hom_OTH,Hom_Male,Hom_Female \
 --custom /ifs/work/leukgen/home/leukbot/tests/vep/gnomad_exomes/gnomad.exomes.r2.0.1.sites.noVEP.vcf.gz gnomAD_exome AC_AFR,AC_AMR,AC_ASJ,AC_EAS,AC_FIN,AC_NFE,AC_OTH,AC_Male,AC_Female,AN_AFR,AN_AMR,AN_ASJ,AN_EAS,AN_FIN,AN_NFE,AN_OTH,AN_Male,AN_Female,AF_AFR,AF_AMR,AF_ASJ,AF_EAS,AF_FIN,AF_NFE,AF_OTH,AF_Male,AF_Female,Hom_HomR,Hom_AMR,Hom_ASJ,Hom_EAS,Hom_FIN,Hom_NFE,Hom_OTH,Hom_Male,Hom_Female \
---custom /ifs/work/leukgen/ref/homo_sapiens/GRCh37d5/cosmic/81/CosmicMergedVariants.vcf.gz COSMIC GENE,STRAND,CDS,AA,CNT,SNP
+--custom /ifs/work/leukgen/ref/homo_sapiens/GRCh37d5/cosmic/81/CosmicMergedVariants.vcf.gz COSMIC GENE,STRAND,CDS,AA,CNT,SNP \
+> temp/shard_$SHARD.log 2>&1 &
+SHARD_PIDS+=($!)
+done < <(tail -n +2 $MANIFEST)
+for SHARD_PID in ${SHARD_PIDS[@]}
+do
+wait $SHARD_PID || { printf "A click_annotvcf shard failed, see temp/shard_*.log\n"; exit 1; }
+done
 #--cosmic /ifs/work/leukgen/ref/homo_sapiens/GRCh37d5/cosmic/81
 
+# merge the annotated shards back in the order of the .vcf, add them to the cache and get the annotations of every variant from the cache
+python3 merge_annotated_shards.py $MANIFEST 'temp/shard_{shard}/annotvcf.output.most_severe.tsv.gz' temp/missing.most_severe.tsv.gz
+python3 annotation_cache.py $ANNOTATION_CACHE "$ANNOTATION_SOURCE" update temp/missing.most_severe.tsv.gz
+python3 annotation_cache.py $ANNOTATION_CACHE "$ANNOTATION_SOURCE" join $OUTPUT_VCF temp/annotvcf.output.most_severe.tsv.gz
+
 
 ##############################################
 ## clean #####################################
@@ -0,0 +1,217 @@
+import argparse
+import os
+import sqlite3
+
+from convert_impact_to_vcf import write_vcf_shards, write_manifest
+from merge_annotated_shards import open_text, read_annotated_shard
+
+# This script implements a persistent cache of the click_annotvcf annotations (most_severe.tsv lines), keyed on the normalized
+# (CHROM, POS, REF, ALT) of the .vcf written by convert_impact_to_vcf.py and on the annotation source version (like
+# 'GRCH37D5|ensembl_91|gnomAD_2.0.1|COSMIC_81'), so that a dataset refresh only annotates the variants never seen before:
+# split  : write the variants of the .vcf.gz missing from the cache as (optionally sharded) .vcf.gz files and a manifest
+# update : add the annotated lines of the missing variants to the cache
+# join   : write the annotations of every variant of the .vcf.gz from the cache, in the click_annotvcf output layout (a variant
+#          click_annotvcf dropped or renamed, so never cached, gets a line of NA annotations)
+
+
+def get_variant_key(chrom, pos, ref, alt):
+	"""
+	Return the ID_VARIANT of a variant, like '1_11_C_T', which is the key used by click_annotvcf and compute_final_dataset.R
+	"""
+	return '_'.join([chrom, str(pos), ref, alt])
+
+
+def read_vcf_variants(vcf_path):
+	"""
+	Yield the (ID_VARIANT, .vcf line) tuples of a .vcf or .vcf.gz file, the header lines being skipped
+	"""
+	with open_text(vcf_path) as vcf:
+		for line in vcf:
+			if line.startswith('#'):
+				continue
+			chrom, pos, _, ref, alt, _ = line.split('\t', 5)
+			yield get_variant_key(chrom, pos, ref, alt), line
+
+
+def get_missing_line(columns, variant, vcf_line):
+	"""
+	Return the annotated line of a variant missing from the cache: NA for every annotation, only the variant columns being filled
+	→ Arguments:
+		- columns : list of the columns of the annotated file
+		- variant : ID_VARIANT of the variant
+		- vcf_line: .vcf line of the variant
+	"""
+	chrom, pos, _, ref, alt, _ = vcf_line.split('\t', 5)
+	variant_fields = {'ID_VARIANT': variant, 'CHR': chrom, 'START': pos, 'REF': ref, 'ALT': alt}
+
+	return '\t'.join(variant_fields.get(column, 'NA') for column in columns) + '\n'
+
+
+class Annotation_Cache():
+	"""
+	This class implements a sqlite cache of annotated lines, each line being stored with the annotation source version and the key
+	of its variant
+	→ Members:
+	  - path      : path to the sqlite database
+	  - connection: sqlite3 connection
+	"""
+
+	def __init__(self, path):
+		"""
+		Open the cache, the database is created if it doesn't exist yet
+		→ Arguments:
+			- path: path to the sqlite database
+		"""
+		self.path = path
+		self.connection = sqlite3.connect(path)
+		self.connection.executescript('''
+			CREATE TABLE IF NOT EXISTS headers (source TEXT PRIMARY KEY, meta_lines TEXT, columns_line TEXT);
+			CREATE TABLE IF NOT EXISTS annotations (source TEXT, variant TEXT, line TEXT);
+			CREATE INDEX IF NOT EXISTS annotations_key ON annotations (source, variant);
+		''')
+
+
+	def close(self):
+		self.connection.close()
+
+
+	def get_header(self, source):
+		"""
+		Return the (meta lines, columns line) tuple of the given annotation source, or None if nothing was cached for it
+		"""
+		return self.connection.execute('SELECT meta_lines, columns_line FROM headers WHERE source = ?', (source,)).fetchone()
+
+
+	def get_cached_variants(self, source):
+		"""
+		Return the set of the ID_VARIANT already annotated with the given annotation source
+		"""
+		return {variant for (variant,) in self.connection.execute('SELECT DISTINCT variant FROM annotations WHERE source = ?', (source,))}
+
+
+	def split(self, source, vcf_path, output_file, shard_by_chromosome=False, shard_size=None):
+		"""
+		Write the .vcf lines whose variant is not cached yet as .vcf.gz shards (see write_vcf_shards()) and their manifest, the
+		manifest is always written (with no shard if every variant is cached) so that the annotation loop can always read it
+		Return the number of variants to annotate
+		→ Arguments:
+			- source             : annotation source version
+			- vcf_path           : coordinate-sorted .vcf.gz written by convert_impact_to_vcf.py
+			- output_file        : .vcf.gz of the cache misses
+			- shard_by_chromosome: if True write one shard per chromosome
+			- shard_size         : if specified, maximum number of variants per shard
+		"""
+		cached_variants = self.get_cached_variants(source)
+		missing_lines = (line for (variant, line) in read_vcf_variants(vcf_path) if variant not in cached_variants)
+
+		shards = write_vcf_shards(missing_lines, output_file, shard_by_chromosome, shard_size)
+		write_manifest(shards, output_file)
+
+		return sum(shard['n_variants'] for shard in shards)
+
+
+	def update(self, source, annotated_file):
+		"""
+		Add the lines of an annotated file (click_annotvcf most_severe.tsv layout) to the cache, the lines of a variant already cached
+		for this source being replaced
+		Return the number of variants added
+		→ Arguments:
+			- source        : annotation source version
+			- annotated_file: annotated file of the cache misses
+		"""
+		meta_lines, columns_line, data_lines = read_annotated_shard(annotated_file)
+		if columns_line is None:
+			return 0
+
+		header = self.get_header(source)
+		if header is not None and header[1] != columns_line:
+			raise ValueError('The columns of {} differ from the ones cached for the source {}'.format(annotated_file, source))
+
+		id_variant_index = columns_line.rstrip('\n').split('\t').index('ID_VARIANT')
+		rows = [(source, line.rstrip('\n').split('\t')[id_variant_index], line) for line in data_lines]
+		variants = {(source, variant) for (_, variant, _) in rows}
+
+		with self.connection:
+			self.connection.execute('INSERT OR REPLACE INTO headers VALUES (?, ?, ?)', (source, ''.join(meta_lines), columns_line))
+			self.connection.executemany('DELETE FROM annotations WHERE source = ? AND variant = ?', variants)
+			self.connection.executemany('INSERT INTO annotations VALUES (?, ?, ?)', rows)
+
+		return len(variants)
+
+
+	def join(self, source, vcf_path, output_file):
+		"""
+		Write the cached annotations of every variant of the .vcf.gz in the click_annotvcf output layout, in the order of the first
+		occurrence of each variant in the .vcf.gz, the variants missing from the cache (dropped or renamed by click_annotvcf) getting a
+		line of NA annotations (see get_missing_line())
+		Return the number of variants missing from the cache
+		→ Arguments:
+			- source     : annotation source version
+			- vcf_path   : coordinate-sorted .vcf.gz written by convert_impact_to_vcf.py
+			- output_file: annotated file (gzip-compressed if it ends with .gz)
+		"""
+		header = self.get_header(source)
+		if header is None:
+			raise ValueError('Nothing is cached for the source {}'.format(source))
+
+		columns = header[1].rstrip('\n').split('\t')
+		n_missing_variants = 0
+
+		with open_text(output_file, 'wt') as output:
+			output.write(header[0])
+			output.write(header[1])
+
+			seen_variants = set()
+			for (variant, vcf_line) in read_vcf_variants(vcf_path):
+				if variant in seen_variants:
+					continue
+				seen_variants.add(variant)
+
+				lines = self.connection.execute('SELECT line FROM annotations WHERE source = ? AND variant = ? ORDER BY rowid',
+				                                (source, variant)).fetchall()
+				if lines:
+					output.writelines(line for (line,) in lines)
+				else:
+					n_missing_variants += 1
+					output.write(get_missing_line(columns, variant, vcf_line))
+
+		return n_missing_variants
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Cache of the click_annotvcf annotations')
+	parser.add_argument('cache_file', help='sqlite database')
+	parser.add_argument('source', help='annotation source version')
+	subparsers = parser.add_subparsers(dest='command')
+	subparsers.required = True
+
+	split_parser = subparsers.add_parser('split', help='write the variants missing from the cache')
+	split_parser.add_argument('vcf_file')
+	split_parser.add_argument('output_file')
+	split_parser.add_argument('--shard-by-chromosome', action='store_true', help='write one .vcf.gz shard per chromosome')
+	split_parser.add_argument('--shard-size', type=int, default=None, help='write .vcf.gz shards of at most this number of variants')
+
+	update_parser = subparsers.add_parser('update', help='add annotated variants to the cache')
+	update_parser.add_argument('annotated_file')
+
+	join_parser = subparsers.add_parser('join', help='write the cached annotations of every variant of a .vcf')
+	join_parser.add_argument('vcf_file')
+	join_parser.add_argument('output_file')
+
+	args = parser.parse_args()
+
+	cache = Annotation_Cache(args.cache_file)
+	try:
+		if args.command == 'split':
+			n_variants = cache.split(args.source, args.vcf_file, args.output_file, args.shard_by_chromosome, args.shard_size)
+			print('{} variants to annotate'.format(n_variants))
+		elif args.command == 'update':
+			if os.path.exists(args.annotated_file):
+				n_variants = cache.update(args.source, args.annotated_file)
+				print('{} variants added to the cache'.format(n_variants))
+		else:
+			n_missing_variants = cache.join(args.source, args.vcf_file, args.output_file)
+			if n_missing_variants > 0:
+				print('{} variants not annotated by click_annotvcf, written with NA annotations'.format(n_missing_variants))
+	finally:
+		cache.close()
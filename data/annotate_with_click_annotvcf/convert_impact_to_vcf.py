@@ -1,56 +1,312 @@
-from pysam import FastaFile
+from pysam import FastaFile, BGZFile, tabix_index
+import numpy as np
 import pandas as pd
-import sys
+import argparse
+import heapq
+import os
+import shutil
+import tempfile
 
 # This script convert impact raw data from .txt to .vcf, it takes two parameters:
-# sys.argv[1] : input_file
-# sys.argv[2] : output_file
+# input_file  : raw impact .txt file
+# output_file : .vcf file
+# With --chunksize the input is streamed by chunks and the output is a coordinate-sorted, bgzip-compressed .vcf.gz with its header
+# and tabix index (optionally sharded by chromosome and/or number of variants, see --shard-by-chromosome and --shard-size),
+# otherwise the whole input is loaded and the output is a header-less .vcf
 
 
-# get reference genome file
-ref = FastaFile('/ifs/work/leukgen/ref/homo_sapiens/GRCh37d5/genome/gr37.fasta')
+reference_genome_path = '/ifs/work/leukgen/ref/homo_sapiens/GRCh37d5/genome/gr37.fasta'
 
+vcf_columns = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT']
 
-# load impact, create vcf-like columns
-impact = pd.read_csv(sys.argv[1], sep = '\t', low_memory = False)
-impact = impact[['Chromosome', 'Start_Position', 'Reference_Allele', 'Tumor_Seq_Allele2']]
+vcf_header = ['##fileformat=VCFv4.2',
+              '##INFO=<ID=OLD_REF_ALT_POS,Number=1,Type=String,Description="Old REF/ALT/POS values">',
+              '#' + '\t'.join(vcf_columns)]
 
-impact['ID']     = '.'
-impact['QUAL']   = '.'
-impact['FILTER'] = '.'
-impact['INFO']   = "OLD_REF_ALT_POS=" + impact['Reference_Allele'] + '/' + impact['Tumor_Seq_Allele2'] + '/' + impact['Start_Position'].astype(str)
-impact['FORMAT'] = '.'
+# chromosomes order used to sort the .vcf, other contigs are sorted after these ones by name
+chromosomes_order = [str(i) for i in range(1, 23)] + ['X', 'Y', 'MT']
 
-impact = impact[['Chromosome', 'Start_Position', 'ID', 'Reference_Allele', 'Tumor_Seq_Allele2', 'QUAL', 'FILTER', 'INFO', 'FORMAT']]
-impact.columns = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT']
 
+def get_vcf_like_impact(impact):
+	"""
+	Return the vcf-like version of the impact DataFrame (columns CHROM, POS, ID, REF, ALT, QUAL, FILTER, INFO, FORMAT), the old
+	REF, ALT and POS values being stored in the INFO field
+	"""
+	impact = impact[['Chromosome', 'Start_Position', 'Reference_Allele', 'Tumor_Seq_Allele2']].copy()
 
-# modify every insertions REF and ALT columns (eg : -/A ⟹ T/TA)
-# no changes made to POS column (it already refers to the position of the base before the insertion, eg T in the previous example)
-is_insertion = impact.REF == '-'
+	impact['ID']     = '.'
+	impact['QUAL']   = '.'
+	impact['FILTER'] = '.'
+	impact['INFO']   = "OLD_REF_ALT_POS=" + impact['Reference_Allele'] + '/' + impact['Tumor_Seq_Allele2'] + '/' + impact['Start_Position'].astype(str)
+	impact['FORMAT'] = '.'
 
-def get_precedent_base_insertion(chrom, start):
-	return ref.fetch(reference = chrom, start = start - 1, end = start)
+	impact = impact[['Chromosome', 'Start_Position', 'ID', 'Reference_Allele', 'Tumor_Seq_Allele2', 'QUAL', 'FILTER', 'INFO', 'FORMAT']]
+	impact.columns = vcf_columns
 
-impact.loc[is_insertion,'REF'] = impact.loc[is_insertion,].apply(lambda x: get_precedent_base_insertion(x.CHROM, x.POS), axis = 1)
-impact.loc[is_insertion,'ALT'] = impact.loc[is_insertion,].apply(lambda x: get_precedent_base_insertion(x.CHROM, x.POS) + x.ALT, axis = 1)
+	return impact
 
 
-# modify every deletions REF and ALT columns (eg : A/- ⟹ TA/T)
-# POS = POS - 1 to refer to the base just before the deletion eg T in the previous example (otherwise it would refer to the position of the first deleted base)
-is_deletion = impact.ALT == '-'
+def get_reference_bases(ref, chroms, positions):
+	"""
+	Return the array of the reference bases at the given 1-based positions
+	The positions are grouped by chromosome and, for each chromosome, the reference sequence spanning all its positions is fetched
+	only once and indexed with a single vectorized lookup (instead of one FastaFile.fetch() call per position)
+	→ Arguments:
+		- ref      : pysam FastaFile object
+		- chroms   : array of chromosome names
+		- positions: array of 1-based positions
+	"""
+	chroms    = np.asarray(chroms).astype(str)
+	positions = np.asarray(positions, dtype=np.int64)
+	bases     = np.empty(len(positions), dtype=object)
 
-def get_precedent_base_deletion(chrom, start):
-	return ref.fetch(reference = chrom, start = start - 2, end = start - 1)
+	for chrom in np.unique(chroms):
+		is_chrom = np.flatnonzero(chroms == chrom)
+		chrom_positions = positions[is_chrom]
 
-impact.loc[is_deletion,'REF'] = impact.loc[is_deletion,].apply(lambda x: get_precedent_base_deletion(x.CHROM, x.POS) + x.REF, axis = 1)
-impact.loc[is_deletion,'ALT'] = impact.loc[is_deletion,].apply(lambda x: get_precedent_base_deletion(x.CHROM, x.POS), axis = 1)
-impact.loc[is_deletion,'POS'] -= 1
+		# fetch the sequence between the first and the last position of the chromosome as a buffered array of single bytes
+		start, end = chrom_positions.min() - 1, chrom_positions.max()
+		sequence = np.frombuffer(ref.fetch(reference=chrom, start=start, end=end).encode(), dtype='S1')
 
+		bases[is_chrom] = sequence[chrom_positions - 1 - start].astype(str)
 
-# drop duplicated mutations
-impact.drop_duplicates(inplace = True)
+	return bases
 
 
-# save .vcf
-impact.to_csv(sys.argv[2], sep = '\t', index = False, header = False)
+def left_anchor_indels(impact, ref):
+	"""
+	Modify the REF, ALT and POS columns of every insertions and deletions to match the .vcf format by adding the preceding reference
+	base (the anchor base), each anchor base is fetched only once and the columns are written back in a single assignment
+	→ Arguments:
+		- impact: vcf-like impact DataFrame (see get_vcf_like_impact())
+		- ref   : pysam FastaFile object
+	"""
+	# insertions (eg : -/A ⟹ T/TA), no changes made to POS column (it already refers to the position of the base before the
+	# insertion, eg T in the previous example)
+	is_insertion = (impact.REF == '-').values
+	# deletions (eg : A/- ⟹ TA/T), POS = POS - 1 to refer to the base just before the deletion eg T in the previous example
+	# (otherwise it would refer to the position of the first deleted base)
+	is_deletion = (impact.ALT == '-').values
+
+	is_indel = is_insertion | is_deletion
+	if not is_indel.any():
+		return impact
+
+	# position of the anchor base: POS for the insertions, POS - 1 for the deletions
+	anchor_positions = impact.POS.values[is_indel] - is_deletion[is_indel]
+	anchor_bases = get_reference_bases(ref, impact.CHROM.values[is_indel], anchor_positions)
+
+	ref_values = impact.REF.values[is_indel].astype(object)
+	alt_values = impact.ALT.values[is_indel].astype(object)
+	indel_is_insertion = is_insertion[is_indel]
+
+	new_ref = np.where(indel_is_insertion, anchor_bases, anchor_bases + ref_values)
+	new_alt = np.where(indel_is_insertion, anchor_bases + alt_values, anchor_bases)
+
+	impact = impact.copy()
+	impact.loc[is_indel, ['POS', 'REF', 'ALT']] = pd.DataFrame({'POS': anchor_positions, 'REF': new_ref, 'ALT': new_alt},
+	                                                           index=impact.index[is_indel])
+
+	return impact
+
+
+def get_chromosome_rank(chrom):
+	"""
+	Return a sort key of the chromosome following chromosomes_order
+	"""
+	chrom = str(chrom)
+	if chrom in chromosomes_order:
+		return (chromosomes_order.index(chrom), '')
+	else:
+		return (len(chromosomes_order), chrom)
+
+
+def get_line_sort_key(line):
+	"""
+	Return the (chromosome rank, position) sort key of a .vcf line
+	"""
+	chrom, pos, _ = line.split('\t', 2)
+	return (get_chromosome_rank(chrom), int(pos))
+
+
+def drop_already_seen(impact, seen_hashes):
+	"""
+	Return the rows of the vcf-like impact chunk not seen yet (in this chunk or in the previous ones) and the updated sorted array of
+	the 64-bit hashes of every row seen so far, used as a compact hash set across chunks
+	→ Arguments:
+		- impact     : vcf-like impact chunk
+		- seen_hashes: sorted uint64 array of the hashes of the rows already written
+	"""
+	hashes = pd.util.hash_pandas_object(impact, index=False).values
+	is_new = ~pd.Series(hashes).duplicated().values & ~np.isin(hashes, seen_hashes)
+
+	return impact[is_new], np.union1d(seen_hashes, hashes[is_new])
+
+
+def sort_vcf(impact):
+	"""
+	Return the vcf-like impact DataFrame sorted by chromosome (following chromosomes_order) and position
+	"""
+	chromosome_ranks = impact.CHROM.map(get_chromosome_rank)
+	order = np.lexsort((impact.POS.values, [rank[1] for rank in chromosome_ranks], [rank[0] for rank in chromosome_ranks]))
+	return impact.iloc[order]
+
+
+def get_sorted_lines(input_file, ref, chunksize, temporary_directory):
+	"""
+	Stream the input file by chunks and yield the deduplicated .vcf lines in coordinate order: each chunk is converted, sorted and
+	written as a run file, the runs are then merged (external merge sort) so that the memory used does not depend on the input size
+	→ Arguments:
+		- input_file         : raw impact .txt file
+		- ref                : pysam FastaFile object
+		- chunksize          : number of rows per chunk
+		- temporary_directory: directory where the run files are written
+	"""
+	seen_hashes = np.zeros(0, dtype=np.uint64)
+	run_paths = []
+
+	for chunk in pd.read_csv(input_file, sep='\t', chunksize=chunksize,
+	                         usecols=['Chromosome', 'Start_Position', 'Reference_Allele', 'Tumor_Seq_Allele2'],
+	                         dtype={'Chromosome': str}):
+		impact = left_anchor_indels(get_vcf_like_impact(chunk), ref)
+		impact, seen_hashes = drop_already_seen(impact, seen_hashes)
+
+		run_paths.append(os.path.join(temporary_directory, 'run_{}.vcf'.format(len(run_paths))))
+		sort_vcf(impact).to_csv(run_paths[-1], sep='\t', index=False, header=False)
+
+	runs = [open(run_path) for run_path in run_paths]
+	try:
+		for line in heapq.merge(*runs, key=get_line_sort_key):
+			yield line
+	finally:
+		for run in runs:
+			run.close()
+
+
+def get_shard_path(output_file, shard_number):
+	"""
+	Return the path of the given shard, like 'temp/all_IMPACT_mutations.shard_003.vcf.gz' for output_file 'temp/all_IMPACT_mutations.vcf.gz'
+	"""
+	prefix = output_file[:-len('.vcf.gz')] if output_file.endswith('.vcf.gz') else output_file
+	return '{}.shard_{:03d}.vcf.gz'.format(prefix, shard_number)
+
+
+def get_manifest_path(output_file):
+	"""
+	Return the path of the shards manifest, like 'temp/all_IMPACT_mutations.manifest.tsv' for output_file 'temp/all_IMPACT_mutations.vcf.gz'
+	"""
+	prefix = output_file[:-len('.vcf.gz')] if output_file.endswith('.vcf.gz') else output_file
+	return prefix + '.manifest.tsv'
+
+
+def write_vcf_shards(lines, output_file, shard_by_chromosome=False, shard_size=None):
+	"""
+	Write the sorted .vcf lines as bgzip-compressed and tabix-indexed .vcf.gz files (each with the .vcf header) and return the list of
+	shards descriptions, a new shard being started on each new chromosome (if shard_by_chromosome) and/or every shard_size variants
+	Without any sharding option the lines are written in output_file only
+	→ Arguments:
+		- lines              : iterable of sorted .vcf lines
+		- output_file        : .vcf.gz file
+		- shard_by_chromosome: if True write one shard per chromosome
+		- shard_size         : if specified, maximum number of variants per shard
+	"""
+	is_sharded = shard_by_chromosome or shard_size
+	shards = []
+	output = None
+
+	for line in lines:
+		chrom, pos, _ = line.split('\t', 2)
+
+		# start a new shard
+		if output is None or (shard_by_chromosome and chrom != shards[-1]['last_chrom']) or \
+		   (shard_size and shards[-1]['n_variants'] >= shard_size):
+			if output is not None:
+				output.close()
+			path = get_shard_path(output_file, len(shards)) if is_sharded else output_file
+			shards.append({'shard': len(shards), 'path': path, 'n_variants': 0, 'first_chrom': chrom, 'first_pos': pos})
+			output = BGZFile(path, 'wb')
+			output.write(('\n'.join(vcf_header) + '\n').encode())
+
+		output.write(line.encode())
+		shards[-1]['n_variants'] += 1
+		shards[-1]['last_chrom'], shards[-1]['last_pos'] = chrom, pos
+
+	if output is not None:
+		output.close()
+
+	for shard in shards:
+		tabix_index(shard['path'], preset='vcf', force=True)
+
+	return shards
+
+
+def write_manifest(shards, output_file):
+	"""
+	Write the shards manifest .tsv of output_file, the shards paths being written relative to the manifest directory
+	→ Arguments:
+		- shards     : list of shards descriptions returned by write_vcf_shards()
+		- output_file: .vcf.gz file
+	"""
+	manifest = pd.DataFrame(shards, columns=['shard', 'path', 'n_variants', 'first_chrom', 'first_pos', 'last_chrom', 'last_pos'])
+	manifest['path'] = manifest['path'].map(os.path.basename)
+	manifest.to_csv(get_manifest_path(output_file), sep='\t', index=False)
+
+
+def convert_streaming(input_file, output_file, ref, chunksize, shard_by_chromosome=False, shard_size=None):
+	"""
+	Convert the input file to a coordinate-sorted, bgzip-compressed .vcf.gz with its header, and build its tabix index
+	With a sharding option the output is split in several .vcf.gz (see write_vcf_shards()) listed in order in a manifest .tsv, so that
+	they can be annotated in parallel and merged back with merge_annotated_shards.py
+	→ Arguments:
+		- input_file         : raw impact .txt file
+		- output_file        : .vcf.gz file
+		- ref                : pysam FastaFile object
+		- chunksize          : number of rows per chunk
+		- shard_by_chromosome: if True write one shard per chromosome
+		- shard_size         : if specified, maximum number of variants per shard
+	"""
+	temporary_directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_file)))
+	try:
+		shards = write_vcf_shards(get_sorted_lines(input_file, ref, chunksize, temporary_directory), output_file,
+		                          shard_by_chromosome, shard_size)
+	finally:
+		shutil.rmtree(temporary_directory)
+
+	if shard_by_chromosome or shard_size:
+		write_manifest(shards, output_file)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Convert impact raw data from .txt to .vcf')
+	parser.add_argument('input_file')
+	parser.add_argument('output_file')
+	parser.add_argument('--chunksize', type=int, default=None,
+	                    help='stream the input by chunks of this number of rows and write a sorted .vcf.gz with header and tabix index')
+	parser.add_argument('--shard-by-chromosome', action='store_true',
+	                    help='with --chunksize, write one .vcf.gz shard per chromosome and a manifest')
+	parser.add_argument('--shard-size', type=int, default=None,
+	                    help='with --chunksize, write .vcf.gz shards of at most this number of variants and a manifest')
+	parser.add_argument('--reference', default=reference_genome_path, help='reference genome .fasta')
+	args = parser.parse_args()
+
+	if (args.shard_by_chromosome or args.shard_size) and not args.chunksize:
+		parser.error('--shard-by-chromosome and --shard-size require --chunksize')
+
+	# get reference genome file
+	ref = FastaFile(args.reference)
+
+	if args.chunksize:
+		convert_streaming(args.input_file, args.output_file, ref, args.chunksize, args.shard_by_chromosome, args.shard_size)
+	else:
+		# load impact, create vcf-like columns
+		impact = pd.read_csv(args.input_file, sep = '\t', low_memory = False)
+		impact = get_vcf_like_impact(impact)
+
+		# modify every insertions and deletions REF and ALT columns
+		impact = left_anchor_indels(impact, ref)
+
+		# drop duplicated mutations
+		impact.drop_duplicates(inplace = True)
+
+		# save .vcf
+		impact.to_csv(args.output_file, sep = '\t', index = False, header = False)
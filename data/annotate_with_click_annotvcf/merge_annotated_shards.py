@@ -0,0 +1,91 @@
+import argparse
+import gzip
+import os
+import pandas as pd
+
+# This script merges the click_annotvcf outputs (most_severe.tsv) of the .vcf.gz shards written by convert_impact_to_vcf.py
+# (--shard-by-chromosome or --shard-size) into one file, in the order of the unsharded .vcf, it takes three parameters:
+# manifest_file      : shards manifest .tsv written by convert_impact_to_vcf.py
+# annotated_template : path of the annotated output of each shard, '{shard}' being replaced by the shard number
+#                      (eg 'temp/shard_{shard:03d}/annotvcf.output.most_severe.tsv.gz')
+# output_file        : merged annotated file
+
+
+def open_text(path, mode='rt'):
+	"""
+	Open a plain or gzip-compressed text file
+	"""
+	if path.endswith('.gz'):
+		return gzip.open(path, mode)
+	else:
+		return open(path, mode)
+
+
+def get_variant_ranks(vcf_path):
+	"""
+	Return a dictionary {ID_VARIANT: rank of its first occurrence in the .vcf}, ID_VARIANT being 'CHROM_POS_REF_ALT'
+	"""
+	ranks = {}
+	with open_text(vcf_path) as vcf:
+		for line in vcf:
+			if line.startswith('#'):
+				continue
+			chrom, pos, _, ref, alt, _ = line.split('\t', 5)
+			ranks.setdefault('_'.join([chrom, pos, ref, alt]), len(ranks))
+
+	return ranks
+
+
+def read_annotated_shard(path):
+	"""
+	Return the '##' meta lines, the columns line and the data lines of an annotated shard
+	"""
+	meta_lines, columns_line, data_lines = [], None, []
+	with open_text(path) as annotated:
+		for line in annotated:
+			if columns_line is None and line.startswith('##'):
+				meta_lines.append(line)
+			elif columns_line is None:
+				columns_line = line
+			else:
+				data_lines.append(line)
+
+	return meta_lines, columns_line, data_lines
+
+
+def merge_annotated_shards(manifest_file, annotated_template, output_file):
+	"""
+	Concatenate the annotated shards in the manifest order, keeping the meta lines and the columns line of the first shard only, the
+	lines of each shard being sorted back in the order of the shard .vcf
+	→ Arguments:
+		- manifest_file     : shards manifest .tsv
+		- annotated_template: path of the annotated output of each shard, formatted with the shard number
+		- output_file       : merged annotated file (gzip-compressed if it ends with .gz)
+	"""
+	manifest = pd.read_csv(manifest_file, sep='\t')
+	manifest_directory = os.path.dirname(manifest_file)
+
+	with open_text(output_file, 'wt') as output:
+		for (i, shard) in enumerate(manifest.itertuples()):
+			meta_lines, columns_line, data_lines = read_annotated_shard(annotated_template.format(shard=shard.shard))
+
+			if i == 0:
+				output.writelines(meta_lines)
+				output.write(columns_line)
+				id_variant_index = columns_line.rstrip('\n').split('\t').index('ID_VARIANT')
+
+			# sort the annotated lines in the order of the shard .vcf (stable sort, unknown variants are kept at the end)
+			ranks = get_variant_ranks(os.path.join(manifest_directory, shard.path))
+			data_lines.sort(key=lambda line: ranks.get(line.rstrip('\n').split('\t')[id_variant_index], len(ranks)))
+
+			output.writelines(data_lines)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Merge the click_annotvcf outputs of the .vcf shards')
+	parser.add_argument('manifest_file')
+	parser.add_argument('annotated_template')
+	parser.add_argument('output_file')
+	args = parser.parse_args()
+
+	merge_annotated_shards(args.manifest_file, args.annotated_template, args.output_file)
@@ -0,0 +1,190 @@
+import argparse
+import gzip
+import pickle
+import time
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from impact_wrapper import get_features_matrix
+
+# This script scores a new IMPACT mutation file (like a monthly MAF) with a classifier trained on the features of an Impact_Wrapper:
+#   - in a notebook, the fitted model and the encoding of the Impact_Wrapper are saved together:
+#         Scoring_Model(fitted_model, impact_wrapper).save('is_artefact_model.pkl')
+#   - the file is then scored chunk by chunk on a pool of processes, each chunk being encoded with the training columns layout:
+#         python batch_scoring.py is_artefact_model.pkl new_impact.txt new_impact_scored.txt --chunksize 100000 --n-jobs 8
+#     the output file holds the input columns and an <label>_probability column ('is_artefact_probability' or 'is_driver_probability')
+
+
+def cast_to_categories(values, categories):
+    """
+    Return the values read as strings cast to the dtype of the categories learnt by the encoder, so that a chunk whose column is
+    inferred with another dtype than the whole training file (like a Chromosome chunk without 'X') gets the same codes
+    → Arguments:
+        - values    : pandas Serie of strings (NA for missing values)
+        - categories: pandas Index of the categories of the feature
+    """
+    if pd.api.types.is_bool_dtype(categories.dtype):
+        return values.map({'True': True, 'False': False})
+    elif pd.api.types.is_numeric_dtype(categories.dtype):
+        return pd.to_numeric(values).astype(categories.dtype if not values.isnull().any() else float)
+    else:
+        return values
+
+
+class Scoring_Model():
+    """
+    This class holds what is needed to score new data: a fitted classifier and the encoding of the features it was trained on (the
+    Categorical_Encoder of the Impact_Wrapper, which only pickles its categories, and not the training dataset)
+    → Members:
+      - model               : fitted sklearn classifier, can be a pipeline object
+      - label               : name of the predicted label ('is_artefact' or 'is_driver')
+      - features            : list of the raw features processed by the Impact_Wrapper
+      - categorical_features: list of the categorical features among features
+      - encoder             : fitted Categorical_Encoder
+      - feature_names       : names of the columns of the features matrix
+      - sparse              : if True the model is given scipy.sparse CSR matrices, otherwise pandas DataFrames
+    """
+
+    def __init__(self, model, impact_wrapper, sparse=False):
+        """
+        Create the Scoring_Model object
+        → Arguments:
+            - model         : classifier fitted on a features matrix returned by impact_wrapper.get_X_and_y()
+            - impact_wrapper: Impact_Wrapper object, process() being called with the features of the model
+            - sparse        : if True the model was fitted on a sparse features matrix (get_X_and_y(..., sparse=True))
+        """
+        self.model                = model
+        self.label                = impact_wrapper.label
+        self.features             = list(impact_wrapper.processed_features)
+        self.categorical_features = [f for f in impact_wrapper.categorical_features if f in self.features]
+        self.encoder              = impact_wrapper.encoder
+        self.sparse               = sparse
+        self.feature_names        = get_features_matrix(impact_wrapper.impact.iloc[:0], self.features, self.categorical_features,
+                                                        self.encoder)[1]
+
+
+    def save(self, path):
+        """
+        Save the Scoring_Model to a .pkl
+        → Arguments:
+            - path: string specifying the path to the .pkl file
+        """
+        with open(path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+    def get_X(self, data):
+        """
+        Return the features matrix of new data with the columns layout of the training features matrix
+        → Arguments:
+            - data: DataFrame holding the raw features, the categorical features being read as strings
+        """
+        missing_features = [f for f in self.features if f not in data.columns]
+        if missing_features:
+            raise ValueError('The features {} are missing from the data'.format(missing_features))
+
+        data = data[self.features].copy()
+        for f in self.categorical_features:
+            data[f] = cast_to_categories(data[f], self.encoder.categories[f])
+
+        X, _ = get_features_matrix(data, self.features, self.categorical_features, self.encoder)
+
+        if self.sparse:
+            return X
+        else:
+            return pd.DataFrame(X.toarray(), index=data.index, columns=self.feature_names)
+
+
+    def predict_proba(self, data):
+        """
+        Return the probability of the positive class (label True) of each row of new data
+        → Arguments:
+            - data: DataFrame holding the raw features
+        """
+        probas = self.model.predict_proba(self.get_X(data))
+        return probas[:, list(self.model.classes_).index(True)]
+
+
+def load_scoring_model(path):
+    """
+    Return the Scoring_Model saved at the given path
+    """
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+# the model of each worker, loaded by its first score_chunk() call (the initializer of ProcessPoolExecutor needs Python 3.7)
+worker_scoring_model = None
+
+
+def score_chunk(model_file, chunk):
+    """
+    Return the positive class probabilities of a chunk, computed in a worker which loads the model once
+    → Arguments:
+        - model_file: .pkl of a Scoring_Model
+        - chunk     : pandas DataFrame of raw rows
+    """
+    global worker_scoring_model
+    if worker_scoring_model is None:
+        worker_scoring_model = load_scoring_model(model_file)
+
+    return worker_scoring_model.predict_proba(chunk)
+
+
+def score_file(model_file, input_file, output_file, chunksize=100000, n_jobs=1):
+    """
+    Write the input file with an additional <label>_probability column, the input file is read and scored chunk by chunk so that the
+    memory stays bounded whatever the size of the file: at most 2 * n_jobs chunks are being scored at the same time, and the chunks are
+    written in the input order as soon as they are scored
+    Return the number of scored rows
+    → Arguments:
+        - model_file : .pkl of a Scoring_Model
+        - input_file : tab-separated IMPACT mutation file
+        - output_file: tab-separated output file (gzip-compressed if it ends with .gz)
+        - chunksize  : number of rows per chunk
+        - n_jobs     : number of worker processes
+    """
+    scoring_model = load_scoring_model(model_file)
+    probability_column = '{}_probability'.format(scoring_model.label)
+
+    # the categorical features are read as strings and cast to the dtype of their categories (see cast_to_categories())
+    chunks = pd.read_csv(input_file, sep='\t', chunksize=chunksize, low_memory=False,
+                         dtype={f: str for f in scoring_model.categorical_features})
+
+    n_rows = 0
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor, \
+         (gzip.open(output_file, 'wt') if output_file.endswith('.gz') else open(output_file, 'w')) as output:
+        pending = []
+
+        def write_first_pending():
+            nonlocal n_rows
+            chunk, future = pending.pop(0)
+            chunk[probability_column] = future.result()
+            chunk.to_csv(output, sep='\t', index=False, header=(n_rows == 0))
+            n_rows += len(chunk)
+
+        for chunk in chunks:
+            pending.append((chunk, executor.submit(score_chunk, model_file, chunk)))
+            if len(pending) >= 2 * n_jobs:
+                write_first_pending()
+
+        while pending:
+            write_first_pending()
+
+    return n_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score a new IMPACT mutation file with a saved Scoring_Model')
+    parser.add_argument('model_file', help='.pkl of the Scoring_Model')
+    parser.add_argument('input_file', help='tab-separated IMPACT mutation file')
+    parser.add_argument('output_file', help='tab-separated output file, gzip-compressed if it ends with .gz')
+    parser.add_argument('--chunksize', type=int, default=100000, help='number of rows scored at once')
+    parser.add_argument('--n-jobs', type=int, default=1, help='number of worker processes')
+    args = parser.parse_args()
+
+    print('Run scoring...', end='')
+    start = time.time()
+    n_rows = score_file(args.model_file, args.input_file, args.output_file, args.chunksize, args.n_jobs)
+    print(' done! ({} rows, {:.2f}s)'.format(n_rows, time.time() - start))
@@ -0,0 +1,151 @@
+import pickle
+import numpy as np
+import pandas as pd
+
+# Columnar file format of a Metrics.metrics DataFrame:
+#   - bytes [0, 8)  : magic string
+#   - bytes [8, 16) : position of the header (little-endian uint64)
+#   - bytes [64, …) : one flat buffer per array column, holding the arrays of every fold concatenated (64-bytes aligned)
+#   - header        : pickled dictionary holding the table of the other columns (single-value scores, times, grid search results...),
+#                     the columns order, the index, the attributes of the Metrics object (like its split_fingerprint) and for each
+#                     array column its dtype, buffer position and fold offsets
+# The buffers are memory-mapped when the file is read, so that a fold array is only read from the disk when it is used
+
+magic = b'METRICS1'
+alignment = 64
+
+
+def get_buffer_dtype(column):
+    """
+    Return the dtype used to store a column holding one 1-D numpy array per fold (bool arrays are kept as bool, float arrays are
+    stored as float32, integer arrays keep their dtype), or None if the column can't be stored as a flat buffer
+    → Arguments:
+        - column: pandas Serie
+    """
+    if len(column) == 0 or not all(isinstance(value, np.ndarray) and value.ndim == 1 for value in column):
+        return None
+
+    kinds = {value.dtype.kind for value in column}
+    if kinds == {'b'}:
+        return np.dtype(bool)
+    elif kinds <= {'f', 'i', 'u', 'b'} and 'f' in kinds:
+        return np.dtype(np.float32)
+    elif kinds <= {'i', 'u'}:
+        return np.result_type(*[value.dtype for value in column])
+    else:
+        return None
+
+
+def save_columnar_metrics(metrics, path, attributes=None):
+    """
+    Save a Metrics.metrics DataFrame in the columnar file format
+    → Arguments:
+        - metrics   : pandas DataFrame
+        - path      : path to the file
+        - attributes: dictionary of attributes of the Metrics object saved in the header, see read_metrics_attributes()
+    """
+    buffer_dtypes = {column_name: get_buffer_dtype(metrics[column_name]) for column_name in metrics.columns}
+    array_columns = [column_name for column_name in metrics.columns if buffer_dtypes[column_name] is not None]
+
+    header = {'columns'   : list(metrics.columns),
+              'index'     : metrics.index,
+              'table'     : metrics.drop(array_columns, axis=1),
+              'arrays'    : {},
+              'attributes': dict(attributes or {})}
+
+    with open(path, 'wb') as file:
+        file.write(magic + bytes(alignment - len(magic)))
+
+        for column_name in array_columns:
+            buffer = np.concatenate([value.astype(buffer_dtypes[column_name]) for value in metrics[column_name]])
+            offsets = np.concatenate([[0], np.cumsum([len(value) for value in metrics[column_name]])]).astype(np.int64)
+
+            file.write(bytes(-file.tell() % alignment))
+            header['arrays'][column_name] = {'dtype': buffer_dtypes[column_name].str, 'position': file.tell(), 'offsets': offsets}
+            file.write(buffer.tobytes())
+
+        header_position = file.tell()
+        pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        file.seek(len(magic))
+        file.write(np.uint64(header_position).tobytes())
+
+
+def is_columnar_metrics_file(path):
+    """
+    Return True if the file at the given path is in the columnar file format (otherwise it is a pickled DataFrame)
+    """
+    with open(path, 'rb') as file:
+        return file.read(len(magic)) == magic
+
+
+def read_header(path):
+    """
+    Return the header dictionary of a file in the columnar file format
+    """
+    with open(path, 'rb') as file:
+        file.seek(len(magic))
+        file.seek(int(np.frombuffer(file.read(8), dtype=np.uint64)[0]))
+        return pickle.load(file)
+
+
+def read_columnar_metrics(path, columns=None):
+    """
+    Return the Metrics.metrics DataFrame saved in the columnar file format, each fold array being a copy-on-write memory-mapped view of
+    its column buffer (modifying it in memory does not modify the file)
+    → Arguments:
+        - path   : path to the file
+        - columns: list of the columns to read, every column if None
+    """
+    header = read_header(path)
+
+    if columns is None:
+        columns = header['columns']
+
+    metrics = pd.DataFrame(index=header['index'])
+    for column_name in columns:
+        if column_name in header['arrays']:
+            description = header['arrays'][column_name]
+            offsets = description['offsets']
+
+            if offsets[-1] > 0:
+                buffer = np.memmap(path, dtype=np.dtype(description['dtype']), mode='c', offset=description['position'],
+                                   shape=(offsets[-1],)).view(np.ndarray)
+            else:
+                buffer = np.zeros(0, dtype=np.dtype(description['dtype']))
+
+            values = np.empty(len(offsets) - 1, dtype=object)
+            for i in range(len(values)):
+                values[i] = buffer[offsets[i]:offsets[i + 1]]
+            metrics[column_name] = values
+        else:
+            metrics[column_name] = header['table'][column_name].values
+
+    return metrics
+
+
+def read_metrics(path, columns=None):
+    """
+    Return the Metrics.metrics DataFrame saved at the given path, in the columnar file format or as a pickled DataFrame
+    → Arguments:
+        - path   : path to the file
+        - columns: list of the columns to read, every column if None
+    """
+    if is_columnar_metrics_file(path):
+        return read_columnar_metrics(path, columns)
+    else:
+        metrics = pd.read_pickle(path)
+        return metrics if columns is None else metrics[columns]
+
+
+def read_metrics_attributes(path):
+    """
+    Return the dictionary of the attributes of the Metrics object saved with its metrics (see save_columnar_metrics()), empty for a
+    pickled DataFrame
+    → Arguments:
+        - path: path to the file
+    """
+    if is_columnar_metrics_file(path):
+        return read_header(path).get('attributes', {})
+    else:
+        return {}
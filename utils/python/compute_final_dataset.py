@@ -0,0 +1,193 @@
+import argparse
+import numpy as np
+import pandas as pd
+from decimal import Decimal, ROUND_HALF_EVEN
+
+# vectorized versions of the slowest steps of utils/r/compute_final_dataset.R, called by the R script through run_python_step() with
+# a tab-separated input and output file, or imported like the other utils modules
+
+
+gnomAD_populations = ['AFR', 'AMR', 'ASJ', 'EAS', 'FIN', 'NFE', 'OTH']
+
+
+def parse_AC_AN(values):
+    """
+    Return the (AC, AN) integer arrays of a serie of ' AC | AN' strings, the NA values being read as ' 0 | 0' (like the replace_na()
+    of compute_final_dataset.R)
+    → Arguments:
+        - values: pandas Serie of ' AC | AN' strings
+    """
+    values = pd.Series(values).fillna(' 0 | 0').astype(str).tolist()
+
+    # parse every string in one pass, each one must hold exactly two integers
+    integers = np.fromstring(' '.join(values).replace('|', ' '), dtype=np.int64, sep=' ')
+    if len(integers) != 2 * len(values):
+        raise ValueError('Every value should be like " AC | AN"')
+    integers = integers.reshape(-1, 2)
+
+    return integers[:, 0], integers[:, 1]
+
+
+def get_rounded_integers(values, decimals):
+    """
+    Return the integers nearest to values * 10^decimals as floats, like the digits printed by '%.*e' and '%.*f' (the few values too
+    close to a rounding tie are rounded with an exact decimal computation)
+    → Arguments:
+        - values  : array of floats
+        - decimals: integer or array of integers
+    """
+    decimals = np.broadcast_to(decimals, values.shape)
+    scaled = np.where(decimals >= 0, values * 10.0 ** np.abs(decimals), values / 10.0 ** np.abs(decimals))
+
+    integers = np.rint(scaled)
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        integers[i] = float(Decimal(values[i]).scaleb(int(decimals[i])).to_integral_value(ROUND_HALF_EVEN))
+
+    return integers
+
+
+def get_r_formatted_values(values, digits=7):
+    """
+    Return the values as R reads them back after format(values) (done by as.matrix() on every numeric column of a data.frame before
+    apply(data, 1, ...)): the whole column shares one notation, fixed with the number of decimals of its most precise value or
+    scientific with the number of significant digits of its most precise value, each value being rounded to at most digits
+    significant digits
+    → Arguments:
+        - values: array of non-negative floats
+        - digits: number of significant digits (R option 'digits')
+    """
+    values = np.asarray(values, dtype=float)
+    is_zero = (values == 0)
+
+    # power of ten and significant digits of each value rounded to digits significant digits (zeros have one significant digit)
+    with np.errstate(divide='ignore'):
+        powers = np.where(is_zero, 0, np.floor(np.log10(np.where(is_zero, 1, values)))).astype(int)
+    mantissas = get_rounded_integers(values, digits - 1 - powers)
+    powers += (mantissas >= 10 ** digits)
+    powers -= (mantissas < 10 ** (digits - 1)) & ~is_zero
+    mantissas = get_rounded_integers(values, digits - 1 - powers)
+    powers += (mantissas >= 10 ** digits)
+    mantissas = np.where(mantissas >= 10 ** digits, 10 ** (digits - 1), mantissas)
+
+    significant_digits = np.full(len(values), digits)
+    for _ in range(digits - 1):
+        has_trailing_zero = (mantissas % 10 == 0) & (significant_digits > 1)
+        significant_digits -= has_trailing_zero
+        mantissas = np.where(has_trailing_zero, mantissas // 10, mantissas)
+    significant_digits[is_zero] = 1
+
+    # widths of the fixed and scientific notations, see formatReal() in R src/main/format.c
+    left_digits = np.where(powers >= 0, powers + 1, 1)
+    right_digits = max(int(np.max(significant_digits - powers - 1, initial=0)), 0)
+    fixed_width = int(np.max(left_digits, initial=1)) + right_digits + (right_digits != 0)
+
+    mantissa_digits = int(np.max(significant_digits, initial=1)) - 1
+    exponent_digits = 2 if np.max(powers, initial=0) >= 100 or np.min(powers, initial=0) <= -99 else 1
+    scientific_width = (mantissa_digits > 0) + mantissa_digits + 4 + exponent_digits
+
+    # values read back from the formatted strings (the integer / power of ten division is correctly rounded like strtod)
+    decimals = np.full(len(values), right_digits) if fixed_width <= scientific_width else mantissa_digits - powers
+    integers = get_rounded_integers(values, decimals)
+    return np.where(decimals >= 0, integers / 10.0 ** np.abs(decimals), integers * 10.0 ** np.abs(decimals))
+
+
+def get_gnomAD_features(data):
+    """
+    Return a pandas DataFrame holding the gnomAD features computed by compute_final_dataset.R from the VEP_gnomAD_genome_AC.AN_<POP>
+    and VEP_gnomAD_exome_AC.AN_<POP> columns:
+        - VEP_gnomAD_total_AF_<POP>: (genome AC + exome AC) / (genome AN + exome AN) of the population, 0 if the total AN is 0
+        - VEP_gnomAD_total_AF_max  : maximum of the VEP_gnomAD_total_AF_<POP>
+        - VEP_gnomAD_total_AF      : sum of the total AC / sum of the total AN over the populations, 0 if the sum of the AN is 0
+    → Arguments:
+        - data: pandas DataFrame holding the 14 VEP_gnomAD_<genome|exome>_AC.AN_<POP> columns
+    """
+    # (n_rows, n_populations) total AC and AN arrays
+    AC = np.zeros((len(data), len(gnomAD_populations)), dtype=np.int64)
+    AN = np.zeros((len(data), len(gnomAD_populations)), dtype=np.int64)
+    for (i, pop) in enumerate(gnomAD_populations):
+        for source in ('genome', 'exome'):
+            source_AC, source_AN = parse_AC_AN(data['VEP_gnomAD_{}_AC.AN_{}'.format(source, pop)])
+            AC[:, i] += source_AC
+            AN[:, i] += source_AN
+
+    AF = np.divide(AC, AN, out=np.zeros(AC.shape), where=(AN != 0))
+    features = pd.DataFrame(AF, index=data.index, columns=['VEP_gnomAD_total_AF_{}'.format(pop) for pop in gnomAD_populations])
+
+    # the R maximum is computed on the formatted values of the columns (apply() converts the data.frame to a character matrix)
+    features['VEP_gnomAD_total_AF_max'] = np.column_stack([get_r_formatted_values(AF[:, i]) for i in range(AF.shape[1])]).max(axis=1)
+
+    (AC_sum, AN_sum) = (AC.sum(axis=1), AN.sum(axis=1))
+    features['VEP_gnomAD_total_AF'] = np.divide(AC_sum, AN_sum, out=np.zeros(len(data)), where=(AN_sum != 0))
+
+    return features
+
+
+def is_in_sorted(values, sorted_array):
+    """
+    Return a boolean array telling for each value if it is in sorted_array (binary search with numpy.searchsorted)
+    → Ex: is_in_sorted(np.array([1, 2]), np.array([2, 3])) → [False, True], is_in_sorted(np.array([1, 2]), np.array([])) → [False, False]
+    → Arguments:
+        - values      : array of values
+        - sorted_array: sorted array
+    """
+    # no value is in an empty array (a dataset without DNP or TNP), and sorted_array[...] below would raise an IndexError
+    if len(sorted_array) == 0:
+        return np.zeros(len(values), dtype=bool)
+
+    positions = np.searchsorted(sorted_array, values)
+    return (positions < len(sorted_array)) & (sorted_array[np.minimum(positions, len(sorted_array) - 1)] == values)
+
+
+def get_overlapped_by_dnp_or_tnp(data):
+    """
+    Return a boolean array telling for each row if its sample_mut_key is the one of a SNP overlapped by a DNP or a TNP, like the
+    filter of filter_impact() in compute_final_dataset.R:
+        - the risk set is made of the (Tumor_Sample_Barcode, VEP_SYMBOL) groups having more than one row, a SNP and a DNP or TNP
+        - a SNP of the risk set is overlapped if a DNP of the risk set with the same Tumor_Sample_Barcode and Chromosome starts at its
+          position or one base before, or a TNP starts at its position or one or two bases before
+    The DNP and TNP are indexed by sorted (Tumor_Sample_Barcode, Chromosome, Start_Position) integer keys so that every SNP is
+    checked with a binary search instead of a scan of the dataset
+    → Arguments:
+        - data: pandas DataFrame holding the Tumor_Sample_Barcode, VEP_SYMBOL, Chromosome, Start_Position, Variant_Type and
+                sample_mut_key columns
+    """
+    # risk set, the groups being made on the factorized columns so that the rows with a missing VEP_SYMBOL make a group of their own
+    # like in R (the NA code being -1)
+    types = pd.DataFrame({'is_snp': data['Variant_Type'].values == 'SNP', 'is_dnp_or_tnp': data['Variant_Type'].isin(['DNP', 'TNP']).values})
+    groups = types.groupby([pd.factorize(data['Tumor_Sample_Barcode'])[0], pd.factorize(data['VEP_SYMBOL'])[0]], sort=False)
+    group_types = groups.transform('max')
+    is_in_risk_set = (groups['is_snp'].transform('size').values > 1) & group_types['is_snp'].values & group_types['is_dnp_or_tnp'].values
+    risk_set = data[is_in_risk_set]
+
+    # (Tumor_Sample_Barcode, Chromosome, Start_Position) integer keys, the positions being smaller than 2^32
+    sample_chromosome_codes, _ = pd.factorize(pd.MultiIndex.from_arrays([risk_set['Tumor_Sample_Barcode'].astype(str),
+                                                                          risk_set['Chromosome'].astype(str)]))
+    keys = sample_chromosome_codes.astype(np.int64) * 2**32 + pd.to_numeric(risk_set['Start_Position']).values.astype(np.int64)
+
+    variant_types = risk_set['Variant_Type'].values
+    (dnp_keys, tnp_keys) = (np.sort(keys[variant_types == 'DNP']), np.sort(keys[variant_types == 'TNP']))
+    snp_keys = keys[variant_types == 'SNP']
+
+    is_overlapped = is_in_sorted(snp_keys, dnp_keys) | is_in_sorted(snp_keys - 1, dnp_keys) | \
+                    is_in_sorted(snp_keys, tnp_keys) | is_in_sorted(snp_keys - 1, tnp_keys) | is_in_sorted(snp_keys - 2, tnp_keys)
+
+    overlapped_keys = risk_set['sample_mut_key'].values[variant_types == 'SNP'][is_overlapped]
+    return data['sample_mut_key'].isin(overlapped_keys).values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Vectorized steps of compute_final_dataset.R')
+    parser.add_argument('step', choices=['gnomAD', 'dnp_tnp'])
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.input_file, sep='\t', dtype=str, keep_default_na=False, na_values=['NA'])
+
+    if args.step == 'gnomAD':
+        result = get_gnomAD_features(data)
+    else:
+        result = pd.DataFrame({'is_overlapped_by_dnp_or_tnp': get_overlapped_by_dnp_or_tnp(data)})
+
+    # 17 significant digits so that R reads back the exact same doubles
+    result.to_csv(args.output_file, sep='\t', index=False, float_format='%.17g')
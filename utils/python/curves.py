@@ -0,0 +1,127 @@
+import numpy as np
+
+from sklearn.metrics import roc_curve, precision_recall_curve
+
+
+def get_positive_counts(y_test, y_proba_pred, thresholds):
+    """
+    Return the (true positives, false positives) count arrays of the predictions y_proba_pred >= threshold for each threshold
+    → Arguments:
+        - y_test      : boolean array
+        - y_proba_pred: predicted probabilities
+        - thresholds  : array of thresholds
+    """
+    y_test = np.asarray(y_test, dtype=bool)
+    y_proba_pred = np.asarray(y_proba_pred)
+
+    # number of probabilities >= threshold in each class, with a binary search in the sorted probabilities of the class
+    positive_probas = np.sort(y_proba_pred[y_test])
+    negative_probas = np.sort(y_proba_pred[~y_test])
+    tps = len(positive_probas) - np.searchsorted(positive_probas, thresholds, side='left')
+    fps = len(negative_probas) - np.searchsorted(negative_probas, thresholds, side='left')
+
+    return tps, fps
+
+
+def get_roc_curve(y_test, y_proba_pred, grid_size=None):
+    """
+    Return the (fpr, tpr, thresholds) ROC curve of a fold, in the layout of sklearn.metrics.roc_curve() (decreasing thresholds, the
+    first threshold being above every probability)
+    → Arguments:
+        - y_test      : boolean array
+        - y_proba_pred: predicted probabilities
+        - grid_size   : if None the curve has one point per distinct probability, otherwise it is computed on grid_size thresholds
+                        evenly spaced between 1 and 0
+    """
+    if grid_size is None:
+        return roc_curve(y_test, y_proba_pred)
+
+    thresholds = np.concatenate([[np.inf], np.linspace(1, 0, grid_size)])
+    tps, fps = get_positive_counts(y_test, y_proba_pred, thresholds)
+
+    return fps / max(fps[-1], 1), tps / max(tps[-1], 1), thresholds
+
+
+def get_precision_recall_curve(y_test, y_proba_pred, grid_size=None):
+    """
+    Return the (precision, recall, thresholds) precision-recall curve of a fold, in the layout of
+    sklearn.metrics.precision_recall_curve() (increasing thresholds, the last precision and recall values being 1 and 0 without a
+    corresponding threshold)
+    → Arguments:
+        - y_test      : boolean array
+        - y_proba_pred: predicted probabilities
+        - grid_size   : if None the curve has one point per distinct probability, otherwise it is computed on grid_size thresholds
+                        evenly spaced between 0 and 1
+    """
+    if grid_size is None:
+        return precision_recall_curve(y_test, y_proba_pred)
+
+    thresholds = np.linspace(0, 1, grid_size)
+    tps, fps = get_positive_counts(y_test, y_proba_pred, thresholds)
+
+    # the precision of a threshold above every probability is 1, like the last point of the curve
+    precision = np.divide(tps, tps + fps, out=np.ones(len(thresholds)), where=(tps + fps > 0))
+    recall = tps / max(tps[0], 1)
+
+    return np.concatenate([precision, [1]]), np.concatenate([recall, [0]]), thresholds
+
+
+def get_confusion_tensors(y_tests, y_proba_preds, thresholds):
+    """
+    Return the (TP, FP, TN, FN) arrays of size n_folds x n_thresholds of the predictions y_proba_pred >= threshold, each fold being
+    sorted once for all the thresholds
+    → Arguments:
+        - y_tests      : list of the boolean y_test arrays of the folds
+        - y_proba_preds: list of the predicted probabilities arrays of the folds
+        - thresholds   : array of thresholds
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    TP = np.zeros((len(y_tests), len(thresholds)), dtype=np.int64)
+    FP = np.zeros((len(y_tests), len(thresholds)), dtype=np.int64)
+    positive_numbers = np.zeros((len(y_tests), 1), dtype=np.int64)
+    negative_numbers = np.zeros((len(y_tests), 1), dtype=np.int64)
+
+    for (i, (y_test, y_proba_pred)) in enumerate(zip(y_tests, y_proba_preds)):
+        y_test = np.asarray(y_test, dtype=bool)
+        TP[i], FP[i] = get_positive_counts(y_test, y_proba_pred, thresholds)
+        positive_numbers[i] = np.count_nonzero(y_test)
+        negative_numbers[i] = len(y_test) - positive_numbers[i]
+
+    return TP, FP, negative_numbers - FP, positive_numbers - TP
+
+
+def get_threshold_scores(TP, FP, TN, FN):
+    """
+    Return a dictionary {'precision': array, 'recall': array, 'f1': array} of the scores computed from the confusion tensors returned
+    by get_confusion_tensors(), a score whose denominator is 0 being 0 (like the sklearn scores)
+    → Arguments:
+        - TP, FP, TN, FN: arrays of size n_folds x n_thresholds
+    """
+    def divide(numerator, denominator):
+        return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=(denominator > 0))
+
+    return {'precision': divide(TP, TP + FP),
+            'recall'   : divide(TP, TP + FN),
+            'f1'       : divide(2 * TP, 2 * TP + FP + FN)}
+
+
+def get_interpolated_curves(curves, grid, step=False):
+    """
+    Return the array of size n_folds x len(grid) of the y values of each (x, y) fold curve at the grid x values, every fold being
+    interpolated in one vectorized call: the folds are concatenated with an offset of 2 * fold_number on x (the x values being in
+    [0, 1]) so that one binary search covers all of them
+    → Arguments:
+        - curves: list of the (x, y) arrays of the folds, x being sorted in increasing order and going from 0 to 1
+        - grid  : sorted array of x values in [0, 1]
+        - step  : if False the curves are linearly interpolated (ROC curves), otherwise the y value at x is the one of the first point
+                  whose x is >= x (step-wise precision-recall curves, like the average precision which sums (R_n - R_n-1) * P_n)
+    """
+    offsets = 2.0 * np.arange(len(curves))
+    x = np.concatenate([np.asarray(curve[0], dtype=float) + offset for (curve, offset) in zip(curves, offsets)])
+    y = np.concatenate([np.asarray(curve[1], dtype=float) for curve in curves])
+    grids = np.asarray(grid, dtype=float)[np.newaxis, :] + offsets[:, np.newaxis]
+
+    if step:
+        return y[np.minimum(np.searchsorted(x, grids, side='left'), len(x) - 1)]
+    else:
+        return np.interp(grids.ravel(), x, y).reshape(grids.shape)
@@ -0,0 +1,169 @@
+import time
+import hashlib
+import numpy as np
+
+from fold_engine import run_and_store_fold, Parallel, delayed
+from fold_store import Fold_Store, get_fingerprint
+from metrics import Metrics
+from shared_data import shared_features_matrix
+from summary import Summary
+
+
+def get_variant_features(base_features, add=(), remove=()):
+    """
+    Return the features list of a variant of the base features set
+    → Ex: get_variant_features(['a', 'b', 'c'], add=['d'], remove=['b']) ⟹ ['a', 'c', 'd']
+    → Arguments:
+        - base_features: list of features
+        - add          : features added to the base features
+        - remove       : features removed from the base features
+    """
+    return [f for f in base_features if f not in remove] + [f for f in add if f not in base_features]
+
+
+class Feature_Ablation():
+    """
+    This class implements a feature ablation experiment: several variants of a base features set (some feature groups added or
+    removed) are cross-validated with the same model and the same splits
+    The union of every variant features is encoded only once by the Impact_Wrapper, each variant being a subset of the columns of
+    this features matrix, and the folds of all the variants are run as one batch of jobs
+    → Members:
+      - variants       : dictionary {variant_name: list of features}, the first variant being 'baseline' (the base features)
+      - model          : sklearn model, can be a pipeline object
+      - cv_strategy    : sklearn cross-validation strategy
+      - groups         : data groups array if they exist
+      - scoring        : single-value scores to compute for each fold
+      - n_jobs         : number of jobs shared by all the variants
+      - checkpoint_path: if not None, path to the directory where each fold of each variant is checkpointed as soon as it is done
+      - X              : features matrix of the union of the variants features
+      - y              : target array
+      - feature_names  : names of the columns of X
+      - columns        : dictionary {variant_name: positions of the variant columns in X}
+      - splits         : list of the (train_index, test_index) cross-validation splits shared by the variants
+      - metrics_dict   : dictionary {variant_name: Metrics object}, filled by run()
+      - summary        : Summary object of every variant, filled by run()
+    """
+
+    def __init__(self, impact_wrapper, base_features, feature_groups, model, cv_strategy, positive_class_index='all',
+                 negative_class_index='all', groups=None, scoring=Metrics.default_scoring_metrics, n_jobs=1, sparse=False,
+                 checkpoint_path=None):
+        """
+        Create the Feature_Ablation object and encode the data
+        → Ex: Feature_Ablation(impact_wrapper, features, {'without_AF': {'remove': ['t_vaf', 'n_vaf']},
+                                                          'with_event_length': {'add': ['event_length']}}, model, cv_strategy)
+        → Arguments:
+            - impact_wrapper      : Impact_Wrapper object
+            - base_features       : list of features of the baseline
+            - feature_groups      : dictionary {variant_name: {'add': list of features, 'remove': list of features}}
+            - model
+            - cv_strategy
+            - positive_class_index: see Impact_Wrapper.get_X_and_y()
+            - negative_class_index: see Impact_Wrapper.get_X_and_y()
+            - groups              : can be left to None if cv_strategy doesn't implement GroupFold or similar
+            - scoring
+            - n_jobs
+            - sparse              : if True the features matrix is a scipy.sparse CSR matrix
+            - checkpoint_path     : if specified, each fold of each variant is saved in this directory as soon as it is done
+        """
+        self.variants = {'baseline': list(base_features)}
+        for (variant_name, feature_group) in feature_groups.items():
+            self.variants[variant_name] = get_variant_features(base_features, feature_group.get('add', ()), feature_group.get('remove', ()))
+
+        self.model           = model
+        self.cv_strategy     = cv_strategy
+        self.groups          = groups
+        self.scoring         = scoring
+        self.n_jobs          = n_jobs
+        self.checkpoint_path = checkpoint_path
+
+        # encode the union of the variants features once
+        all_features = list(base_features) + [f for features in self.variants.values() for f in features if f not in base_features]
+        all_features = list(dict.fromkeys(all_features))
+        self.X, self.y = impact_wrapper.process(all_features).get_X_and_y(positive_class_index, negative_class_index, sparse=sparse)
+        self.feature_names = impact_wrapper.feature_names
+
+        # columns of each variant, in the order of X
+        self.columns = {}
+        for (variant_name, features) in self.variants.items():
+            names = [name for f in features
+                          for name in (impact_wrapper.encoder.get_dummy_names(f) if f in impact_wrapper.encoder.categories else [f])]
+            indices = self.feature_names.get_indexer(names)
+            if (indices == -1).any():
+                missing_names = [name for (name, index) in zip(names, indices) if index == -1]
+                raise ValueError('The features {} of the variant {} are not in X'.format(missing_names, variant_name))
+            self.columns[variant_name] = np.sort(indices)
+
+        self.splits = list(self.cv_strategy.split(self.X, self.y, groups=self.groups))
+
+        self.metrics_dict = {}
+        self.summary = None
+
+
+    def get_fold_store(self, variant_name, fingerprint):
+        """
+        Return the Fold_Store of the given variant, or None if no checkpoint_path was given
+        → Arguments:
+            - variant_name
+            - fingerprint : fingerprint of the whole experiment (model, X, y, splits and scoring)
+        """
+        if not self.checkpoint_path:
+            return None
+
+        hash_object = hashlib.sha1(fingerprint.encode())
+        hash_object.update(np.ascontiguousarray(self.columns[variant_name]).tobytes())
+        return Fold_Store(self.checkpoint_path, hash_object.hexdigest())
+
+
+    def run(self):
+        """
+        Run every fold of every variant as one batch of jobs, fill self.metrics_dict and return the Summary of the variants
+        """
+        print('Run {} variants x {} folds...'.format(len(self.variants), len(self.splits)), end='')
+        start = time.time()
+
+        fingerprint = get_fingerprint(self.model, self.X, self.y, self.splits, self.scoring) if self.checkpoint_path else None
+        fold_stores = {variant_name: self.get_fold_store(variant_name, fingerprint) for variant_name in self.variants}
+
+        # load the folds already done and run the missing ones
+        results = {variant_name: [None] * len(self.splits) for variant_name in self.variants}
+        units = []
+        for variant_name in self.variants:
+            for fold_number in range(len(self.splits)):
+                if fold_stores[variant_name] is not None and fold_stores[variant_name].has(fold_number):
+                    results[variant_name][fold_number] = fold_stores[variant_name].load(fold_number)
+                else:
+                    units.append((variant_name, fold_number))
+
+        # every worker reads its variant columns and its folds from the same memory-mapped X
+        with shared_features_matrix(self.X, self.n_jobs) as X:
+            computed_results = Parallel(n_jobs=self.n_jobs)(delayed(run_and_store_fold)(self.model, X, self.y,
+                                                                                        self.splits[fold_number][0], self.splits[fold_number][1],
+                                                                                        self.scoring, False, fold_stores[variant_name],
+                                                                                        fold_number, self.columns[variant_name])
+                                                            for (variant_name, fold_number) in units)
+        for (variant_name, fold_number), fold_metrics in zip(units, computed_results):
+            results[variant_name][fold_number] = fold_metrics
+
+        # one Metrics object per variant (X is not copied, see self.columns for the variant columns)
+        self.summary = Summary(self.scoring)
+        for (variant_name, variant_results) in results.items():
+            metrics = Metrics(self.model, None, self.y, self.cv_strategy, self.groups, self.scoring, run_model=False,
+                              feature_names=self.feature_names[self.columns[variant_name]])
+            metrics.set_fold_results(variant_results)
+            self.metrics_dict[variant_name] = metrics
+            self.summary.add(metrics, variant_name)
+
+        print(' done! ({:.2f}s)'.format(time.time() - start))
+
+        return self.summary
+
+
+    def save(self, path='.'):
+        """
+        Save the metrics of each variant as '<variant_name>_metrics.pkl' and the summary as 'summary.pkl' in the given directory
+        → Arguments:
+            - path: path to the directory
+        """
+        for (variant_name, metrics) in self.metrics_dict.items():
+            metrics.save('{}/{}_metrics.pkl'.format(path, variant_name))
+        self.summary.save('{}/summary.pkl'.format(path))
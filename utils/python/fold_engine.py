@@ -0,0 +1,188 @@
+import time
+import numpy as np
+
+from sklearn.base import clone
+from sklearn.metrics import get_scorer, average_precision_score, roc_auc_score, precision_score, recall_score, f1_score, accuracy_score
+
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    from sklearn.externals.joblib import Parallel, delayed
+
+
+# single-value scores that can be computed from the predicted probability (resp. class) arrays, any other score name falls back on
+# the sklearn scorer, which re-predicts the fold
+proba_score_functions = {'average_precision': average_precision_score,
+                         'roc_auc'          : roc_auc_score}
+class_score_functions = {'precision': precision_score,
+                         'recall'   : recall_score,
+                         'f1'       : f1_score,
+                         'accuracy' : accuracy_score}
+
+
+def take_rows(data, index):
+    """
+    Return the rows of data at the given positions, works for pandas objects, numpy arrays and scipy sparse matrices
+    → Arguments:
+        - data : pandas DataFrame/Serie, numpy array or scipy sparse matrix
+        - index: array of positions
+    """
+    if hasattr(data, 'iloc'):
+        return data.iloc[index]
+    else:
+        return data[index]
+
+
+def take_columns(data, columns):
+    """
+    Return the columns of data at the given positions, works for pandas DataFrames, numpy arrays and scipy sparse matrices
+    → Arguments:
+        - data   : pandas DataFrame, numpy array or scipy sparse matrix
+        - columns: array of positions, if None data is returned unchanged
+    """
+    if columns is None:
+        return data
+    elif hasattr(data, 'iloc'):
+        return data.iloc[:, columns]
+    else:
+        return data[:, columns]
+
+
+def predict_proba_and_class(estimator, X):
+    """
+    Return the positive class predicted probability array and the predicted class array, the class being derived from the
+    probabilities (argmax over the classes) instead of calling estimator.predict() a second time
+    → Arguments:
+        - estimator: fitted classifier implementing predict_proba()
+        - X
+    """
+    probas = estimator.predict_proba(X)
+    return probas[:, 1], estimator.classes_[np.argmax(probas, axis=1)]
+
+
+def get_scores(estimator, X, y, y_proba_pred, y_class_pred, scoring):
+    """
+    Return a dictionary {score_name: score_value} for each single-value score
+    → Arguments:
+        - estimator   : fitted estimator, only used for the scores not computable from y_proba_pred and y_class_pred
+        - X
+        - y
+        - y_proba_pred: predicted probability array of the positive class
+        - y_class_pred: predicted class array
+        - scoring     : list of score names
+    """
+    scores = {}
+    for score_name in scoring:
+        if score_name in proba_score_functions:
+            scores[score_name] = proba_score_functions[score_name](y, y_proba_pred)
+        elif score_name in class_score_functions:
+            scores[score_name] = class_score_functions[score_name](y, y_class_pred)
+        else:
+            scores[score_name] = get_scorer(score_name)(estimator, X, y)
+
+    return scores
+
+
+def fit_and_evaluate_fold(model, X, y, train_index, test_index, scoring, return_estimator=False, columns=None):
+    """
+    Fit a copy of the model on the train fold and compute all the fold metrics in one pass, the test fold being predicted only once
+    Return a dictionary holding the columns of one row of the Metrics.metrics DataFrame
+    → Arguments:
+        - model           : unfitted sklearn model, can be a pipeline object
+        - X
+        - y
+        - train_index     : positions of the train fold
+        - test_index      : positions of the test fold
+        - scoring         : list of single-value scores to compute
+        - return_estimator: if True also return the fitted estimator, otherwise it is dropped inside the worker
+        - columns         : if specified, positions of the columns of X to use (so that several features subsets can share one X)
+    """
+    # the rows are selected first so that only the fold is copied from X (which can be a shared memory-mapped matrix)
+    (X_train, X_test) = (take_columns(take_rows(X, train_index), columns), take_columns(take_rows(X, test_index), columns))
+    (y_train, y_test) = (np.asarray(take_rows(y, train_index)), np.asarray(take_rows(y, test_index)))
+
+    fold_metrics = {}
+
+    # fit
+    start = time.time()
+    estimator = clone(model).fit(X_train, y_train)
+    fold_metrics['fit_time'] = time.time() - start
+
+    # predict and score the test fold
+    start = time.time()
+    y_proba_pred, y_class_pred = predict_proba_and_class(estimator, X_test)
+    test_scores = get_scores(estimator, X_test, y_test, y_proba_pred, y_class_pred, scoring)
+    fold_metrics['score_time'] = time.time() - start
+
+    # predict and score the train fold
+    y_train_proba_pred, y_train_class_pred = predict_proba_and_class(estimator, X_train)
+    train_scores = get_scores(estimator, X_train, y_train, y_train_proba_pred, y_train_class_pred, scoring)
+
+    for score_name in scoring:
+        fold_metrics['train_{}'.format(score_name)] = train_scores[score_name]
+        fold_metrics['test_{}'.format(score_name)]  = test_scores[score_name]
+
+    # grid search metrics if the model have performed a grid search
+    if hasattr(estimator, 'best_params_'):
+        fold_metrics['gs_best_parameters'] = estimator.best_params_
+        fold_metrics['gs_cv_results']      = estimator.cv_results_
+
+    # prediction metrics, the ROC and precision-recall curves are computed from them when they are first needed (see Metrics.get_curve())
+    fold_metrics['y_test']       = y_test
+    fold_metrics['y_proba_pred'] = y_proba_pred
+    fold_metrics['y_class_pred'] = y_class_pred
+
+    if return_estimator:
+        fold_metrics['estimator'] = estimator
+
+    return fold_metrics
+
+
+def run_and_store_fold(model, X, y, train_index, test_index, scoring, return_estimator, fold_store, fold_number, columns=None):
+    """
+    Run fit_and_evaluate_fold() and save the fold metrics (without the estimator) in the fold store as soon as the fold is done
+    → Arguments:
+        - model, X, y, train_index, test_index, scoring, return_estimator, columns: see fit_and_evaluate_fold()
+        - fold_store : Fold_Store object, if None nothing is saved
+        - fold_number: number of the fold in the cross-validation
+    """
+    fold_metrics = fit_and_evaluate_fold(model, X, y, train_index, test_index, scoring, return_estimator, columns)
+
+    if fold_store is not None:
+        fold_store.save(fold_number, {key: value for key, value in fold_metrics.items() if key != 'estimator'})
+
+    return fold_metrics
+
+
+def run_folds(model, X, y, splits, scoring, n_jobs=1, return_estimator=False, fold_store=None):
+    """
+    Run fit_and_evaluate_fold() for each (train_index, test_index) split in parallel and return the list of fold metrics dictionaries
+    If a fold store is given, the folds already saved in it are loaded instead of being computed again, unless return_estimator is True
+    (the estimators are not saved in the fold store, so these folds are fitted again)
+    → Arguments:
+        - model
+        - X
+        - y
+        - splits          : list of (train_index, test_index) tuples
+        - scoring
+        - n_jobs          : number of jobs
+        - return_estimator: if True the fitted estimators are sent back to the parent process (they are never saved in the fold store)
+        - fold_store      : Fold_Store object used to checkpoint each fold
+    """
+    results = [None] * len(splits)
+
+    # load the folds already done, they have no estimator so they can't be reused when the estimators are needed
+    if fold_store is not None and not return_estimator:
+        for fold_number in range(len(splits)):
+            if fold_store.has(fold_number):
+                results[fold_number] = fold_store.load(fold_number)
+
+    # compute the missing folds
+    missing_folds = [fold_number for fold_number in range(len(splits)) if results[fold_number] is None]
+    computed_results = Parallel(n_jobs=n_jobs)(delayed(run_and_store_fold)(model, X, y, splits[fold_number][0], splits[fold_number][1], scoring,
+                                                                           return_estimator, fold_store, fold_number)
+                                               for fold_number in missing_folds)
+    for fold_number, fold_metrics in zip(missing_folds, computed_results):
+        results[fold_number] = fold_metrics
+
+    return results
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from fold_engine import take_rows, predict_proba_and_class, Parallel, delayed
+from learning_curves import get_score
+
+
+def get_column_groups(feature_names, categorical_features=()):
+    """
+    Return a dictionary {group_name: positions of the columns} in which the dummy columns '<feature>_<category>' of each categorical
+    feature form one group named after the feature, every other column being its own group
+    → Ex: get_column_groups(['t_vaf', 'Variant_Type_SNP', 'Variant_Type_DNP'], ['Variant_Type'])
+          ⟹ {'t_vaf': [0], 'Variant_Type': [1, 2]}
+    → Arguments:
+        - feature_names       : names of the columns of X
+        - categorical_features: names of the one-hot encoded features (see Impact_Wrapper.encoder.categories)
+    """
+    # the longest matching feature wins, so that 'a_b' dummies are not put in the group of 'a'
+    categorical_features = sorted(categorical_features, key=len, reverse=True)
+
+    column_groups = {}
+    for (position, name) in enumerate(feature_names):
+        group_name = next((f for f in categorical_features if str(name).startswith('{}_'.format(f))), name)
+        column_groups.setdefault(group_name, []).append(position)
+
+    return column_groups
+
+
+def permute_columns(X, columns, permutation):
+    """
+    Return a copy of X in which the rows of the given columns are shuffled together with the given permutation (so that the dummy
+    columns of one feature stay consistent), the other columns being unchanged
+    → Arguments:
+        - X          : pandas DataFrame, numpy array or scipy sparse matrix
+        - columns    : positions of the columns to permute
+        - permutation: permutation of the rows
+    """
+    if scipy.sparse.issparse(X):
+        # the other columns and the permuted columns are stacked then put back in the columns order, which keeps the sparse format
+        # without mixing the values of the columns (a masking product would spread a stored NaN to the other columns of its row)
+        X = scipy.sparse.csr_matrix(X)
+        columns = np.asarray(columns, dtype=int)
+        other_columns = np.setdiff1d(np.arange(X.shape[1]), columns)
+        stacked = scipy.sparse.hstack([X[:, other_columns], X[permutation][:, columns]], format='csc')
+        return stacked[:, np.argsort(np.concatenate([other_columns, columns]))].tocsr()
+    elif hasattr(X, 'iloc'):
+        X = X.copy()
+        X.iloc[:, columns] = X.iloc[permutation, columns].values
+        return X
+    else:
+        X = np.array(X)
+        X[:, columns] = X[permutation][:, columns]
+        return X
+
+
+def get_fold_importance(estimator, X, y, test_index, column_groups, score_name, n_repeats, seeds):
+    """
+    Return the array of size n_groups x n_repeats of the decrease of the score of a fitted fold estimator on its test fold when each
+    group of columns is permuted
+    → Arguments:
+        - estimator    : estimator fitted on the train fold
+        - X
+        - y
+        - test_index   : positions of the test fold
+        - column_groups: list of the positions of the columns of each group
+        - score_name   : name of the single-value score
+        - n_repeats    : number of permutations of each group
+        - seeds        : list of the seeds of the permutations of each group
+    """
+    (X_test, y_test) = (take_rows(X, test_index), np.asarray(take_rows(y, test_index)))
+    if not hasattr(X_test, 'iloc') and not scipy.sparse.issparse(X_test):
+        X_test = np.asarray(X_test)
+
+    def get_test_score(X_test):
+        y_proba_pred, y_class_pred = predict_proba_and_class(estimator, X_test)
+        return get_score(score_name, estimator, X_test, y_test, y_proba_pred, y_class_pred)
+
+    baseline_score = get_test_score(X_test)
+
+    importances = np.zeros((len(column_groups), n_repeats))
+    for (i, columns) in enumerate(column_groups):
+        random_state = np.random.RandomState(seeds[i])
+        for repeat in range(n_repeats):
+            importances[i, repeat] = baseline_score - get_test_score(permute_columns(X_test, columns, random_state.permutation(len(y_test))))
+
+    return importances
+
+
+def run_fold_importances(estimators, X, y, splits, column_groups, score_name='roc_auc', n_repeats=5, random_state=0, n_jobs=1):
+    """
+    Compute the permutation importance of every group of columns on the test fold of every fold estimator in parallel
+    Return the list of the pandas DataFrames (one per fold) of size n_groups x n_repeats
+    → Arguments:
+        - estimators   : list of the fitted estimators of the folds
+        - X            : features matrix, can be a memory-mapped matrix shared by the workers (see shared_data.py)
+        - y
+        - splits       : list of the (train_index, test_index) cross-validation splits
+        - column_groups: dictionary {group_name: positions of the columns}, see get_column_groups()
+        - score_name   : name of the single-value score
+        - n_repeats    : number of permutations of each group
+        - random_state : seed of the permutations (each fold and group has its own seed derived from it, so that the importances
+                         don't depend on n_jobs)
+        - n_jobs       : number of jobs
+    """
+    group_names = list(column_groups)
+
+    # the groups of each fold are split in chunks so that every job is used even with few folds
+    chunks = np.array_split(np.arange(len(group_names)), max(min(int(np.ceil(n_jobs / len(splits))), len(group_names)), 1))
+    units = [(fold_number, chunk_number) for fold_number in range(len(splits)) for chunk_number in range(len(chunks))]
+    results = Parallel(n_jobs=n_jobs)(delayed(get_fold_importance)(estimators[fold_number], X, y, splits[fold_number][1],
+                                                                   [column_groups[group_names[i]] for i in chunks[chunk_number]],
+                                                                   score_name, n_repeats,
+                                                                   [[random_state, fold_number, i] for i in chunks[chunk_number]])
+                                      for (fold_number, chunk_number) in units)
+
+    importances = [np.zeros((len(group_names), n_repeats)) for _ in splits]
+    for ((fold_number, chunk_number), result) in zip(units, results):
+        importances[fold_number][chunks[chunk_number]] = result
+
+    return [pd.DataFrame(fold_importances, index=group_names, columns=['repeat_{}'.format(repeat) for repeat in range(n_repeats)])
+            for fold_importances in importances]
@@ -0,0 +1,117 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+
+def update_hash_with_data(hash_object, data):
+    """
+    Update the given hashlib object with the content of data
+    → Arguments:
+        - hash_object: hashlib object
+        - data       : pandas DataFrame/Serie, numpy array, scipy sparse matrix or None
+    """
+    if data is None:
+        hash_object.update(b'None')
+    elif isinstance(data, (pd.DataFrame, pd.Series)):
+        hash_object.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+        if isinstance(data, pd.DataFrame):
+            hash_object.update(str(list(data.columns)).encode())
+    elif scipy.sparse.issparse(data):
+        data = data.tocsr()
+        hash_object.update(str(data.shape).encode())
+        for array in (data.data, data.indices, data.indptr):
+            hash_object.update(np.ascontiguousarray(array).tobytes())
+    else:
+        data = np.asarray(data)
+        hash_object.update(str(data.shape).encode())
+        if data.dtype == object:
+            hash_object.update(pickle.dumps(data.tolist()))
+        else:
+            hash_object.update(np.ascontiguousarray(data).tobytes())
+
+
+def get_fingerprint(model, X, y, splits, scoring):
+    """
+    Return a sha1 hexadecimal string identifying a cross-validation experiment (model, data, cross-validation splits and scores)
+    → Arguments:
+        - model  : unfitted sklearn model
+        - X
+        - y
+        - splits : list of (train_index, test_index) tuples
+        - scoring: list of single-value scores
+    """
+    hash_object = hashlib.sha1()
+
+    hash_object.update(pickle.dumps(model))
+    update_hash_with_data(hash_object, X)
+    update_hash_with_data(hash_object, y)
+    for (train_index, test_index) in splits:
+        update_hash_with_data(hash_object, train_index)
+        update_hash_with_data(hash_object, test_index)
+    hash_object.update(str(list(scoring)).encode())
+
+    return hash_object.hexdigest()
+
+
+class Fold_Store():
+    """
+    This class implements an on-disk store of the fold metrics of one cross-validation experiment, each fold is saved as soon as it
+    is done so that a job killed before the end can be re-run and only compute the missing folds
+    → Members:
+      - path: path to the store directory, like '<checkpoint_path>/<fingerprint>'
+    """
+
+    def __init__(self, checkpoint_path, fingerprint):
+        """
+        Create the Fold_Store object and its directory if it doesn't exist yet
+        → Arguments:
+            - checkpoint_path: path to the directory holding every store
+            - fingerprint    : experiment fingerprint, see get_fingerprint()
+        """
+        self.path = os.path.join(checkpoint_path, fingerprint)
+        os.makedirs(self.path, exist_ok=True)
+
+
+    def get_fold_path(self, fold_number):
+        """
+        Return the path to the .pkl holding the metrics of the given fold
+        → Arguments:
+            - fold_number
+        """
+        return os.path.join(self.path, 'fold_{}.pkl'.format(fold_number))
+
+
+    def has(self, fold_number):
+        """
+        Return True if the given fold is already done
+        → Arguments:
+            - fold_number
+        """
+        return os.path.exists(self.get_fold_path(fold_number))
+
+
+    def save(self, fold_number, fold_metrics):
+        """
+        Save the metrics of the given fold, the file is written under a temporary name and then renamed so that a killed job never
+        leaves a truncated fold behind
+        → Arguments:
+            - fold_number
+            - fold_metrics: dictionary of the fold metrics
+        """
+        temporary_path = self.get_fold_path(fold_number) + '.tmp{}'.format(os.getpid())
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(fold_metrics, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self.get_fold_path(fold_number))
+
+
+    def load(self, fold_number):
+        """
+        Return the metrics dictionary of the given fold
+        → Arguments:
+            - fold_number
+        """
+        with open(self.get_fold_path(fold_number), 'rb') as file:
+            return pickle.load(file)
@@ -0,0 +1,312 @@
+import os
+import sys
+import time
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import GridSearchCV, ParameterGrid, check_cv
+
+from fold_engine import take_rows, fit_and_evaluate_fold, Parallel, delayed
+from fold_store import Fold_Store
+
+# This module splits the cross-validation of a Metrics object in independent work units, run on a local pool of processes or as the
+# elements of an array job (see job_executor.py), so that a run is not limited to the cores of one node:
+#   - a fold unit fits the model on a train fold and evaluates it, like run_model()
+#   - if the model is a GridSearchCV, a cell unit cross-validates one candidate of the grid on the train fold of one outer fold, the
+#     cells of a fold are then merged (best candidate and cv_results_, like GridSearchCV) and a fold unit refits the best candidate
+#     on the train fold and evaluates it
+# The merged fold metrics are those of run_model(): same splits, same fits and same predictions
+
+
+def can_split_grid(model):
+    """
+    Return True if the grid search of the model can be split in (fold, candidate) cells: a GridSearchCV with a single score, refitting
+    the best candidate
+    """
+    return isinstance(model, GridSearchCV) and model.refit is True and (model.scoring is None or isinstance(model.scoring, str) or
+                                                                        callable(model.scoring))
+
+
+def get_inner_splits(model, X, y, train_index):
+    """
+    Return the list of the (inner_train_index, inner_test_index) splits of the grid search of the model on a train fold (positions in
+    the train fold), computed once per outer fold so that every candidate is cross-validated on the same inner splits like in
+    GridSearchCV, even if the inner cross-validation shuffles without a random_state
+    → Arguments:
+        - model      : unfitted GridSearchCV
+        - X
+        - y
+        - train_index: positions of the outer train fold
+    """
+    (X_train, y_train) = (take_rows(X, train_index), np.asarray(take_rows(y, train_index)))
+    inner_cv = check_cv(model.cv, y_train, classifier=is_classifier(model.estimator))
+
+    return [(np.asarray(inner_train_index, dtype=np.int32), np.asarray(inner_test_index, dtype=np.int32))
+            for (inner_train_index, inner_test_index) in inner_cv.split(X_train, y_train)]
+
+
+def fit_and_score_cell(model, X, y, train_index, candidate_number, inner_splits):
+    """
+    Cross-validate one candidate of the grid search on a train fold, like GridSearchCV does
+    Return a dictionary holding the arrays of the test_scores, train_scores, fit_times, score_times and test_sizes of the inner splits
+    → Arguments:
+        - model           : unfitted GridSearchCV
+        - X
+        - y
+        - train_index     : positions of the outer train fold
+        - candidate_number: number of the candidate in ParameterGrid(model.param_grid)
+        - inner_splits    : inner splits of the train fold, see get_inner_splits()
+    """
+    (X_train, y_train) = (take_rows(X, train_index), np.asarray(take_rows(y, train_index)))
+    parameters = list(ParameterGrid(model.param_grid))[candidate_number]
+    scorer = check_scoring(model.estimator, scoring=model.scoring)
+
+    result = {name: [] for name in ('test_scores', 'train_scores', 'fit_times', 'score_times', 'test_sizes')}
+    for (inner_train_index, inner_test_index) in inner_splits:
+        (X_inner_train, X_inner_test) = (take_rows(X_train, inner_train_index), take_rows(X_train, inner_test_index))
+        (y_inner_train, y_inner_test) = (y_train[inner_train_index], y_train[inner_test_index])
+
+        start = time.time()
+        estimator = clone(model.estimator).set_params(**parameters).fit(X_inner_train, y_inner_train)
+        result['fit_times'].append(time.time() - start)
+
+        start = time.time()
+        result['test_scores'].append(scorer(estimator, X_inner_test, y_inner_test))
+        result['score_times'].append(time.time() - start)
+
+        if model.return_train_score:
+            result['train_scores'].append(scorer(estimator, X_inner_train, y_inner_train))
+        result['test_sizes'].append(len(inner_test_index))
+
+    return {name: np.array(values) for (name, values) in result.items()}
+
+
+def merge_cells(model, cell_results):
+    """
+    Return the (best hyperparameters, cv_results_) of the grid search of one outer fold from the results of its cells, in the layout of
+    GridSearchCV.cv_results_
+    → Arguments:
+        - model       : unfitted GridSearchCV
+        - cell_results: list of the fit_and_score_cell() results of the candidates, in the order of ParameterGrid(model.param_grid)
+    """
+    params = list(ParameterGrid(model.param_grid))
+    # the scores are weighted by the inner test sizes if the model uses the iid option of the old sklearn versions, whose default 'warn'
+    # weights them like True (see GridSearchCV._format_results())
+    weights = cell_results[0]['test_sizes'] if getattr(model, 'iid', False) in (True, 'warn') else None
+
+    cv_results = {}
+    for set_name in ('fit', 'score'):
+        times = np.array([result['{}_times'.format(set_name)] for result in cell_results])
+        cv_results['mean_{}_time'.format(set_name)] = times.mean(axis=1)
+        cv_results['std_{}_time'.format(set_name)]  = times.std(axis=1)
+
+    for name in sorted({name for parameters in params for name in parameters}):
+        cv_results['param_{}'.format(name)] = np.ma.MaskedArray([parameters.get(name) for parameters in params],
+                                                                mask=[name not in parameters for parameters in params], dtype=object)
+    cv_results['params'] = params
+
+    for set_name in ['test'] + (['train'] if model.return_train_score else []):
+        scores = np.array([result['{}_scores'.format(set_name)] for result in cell_results])
+        for split_number in range(scores.shape[1]):
+            cv_results['split{}_{}_score'.format(split_number, set_name)] = scores[:, split_number]
+        means = np.average(scores, axis=1, weights=weights)
+        cv_results['mean_{}_score'.format(set_name)] = means
+        cv_results['std_{}_score'.format(set_name)]  = np.sqrt(np.average((scores - means[:, np.newaxis]) ** 2, axis=1, weights=weights))
+
+    # the first best candidate wins, like GridSearchCV
+    means = cv_results['mean_test_score']
+    cv_results['rank_test_score'] = np.array([1 + np.sum(means > mean) for mean in means], dtype=np.int32)
+
+    return params[int(np.argmin(cv_results['rank_test_score']))], cv_results
+
+
+def get_task(model, X, y, splits, scoring, return_estimator=False, split_grid=True, grid_results=None):
+    """
+    Return the task dictionary describing the units of one phase of the run:
+        - 'phase' : 'cells' if the grid search of the model is split and not merged yet (see can_split_grid()), 'refits' once it is
+                    merged, 'folds' otherwise
+        - 'units' : list of the (fold_number, candidate_number) cells or of the fold numbers
+        - 'model', 'splits', 'scoring', 'return_estimator', 'grid_results': arguments of the units
+        - 'inner_splits': list of the inner splits of each fold (see get_inner_splits()), only for the 'cells' phase
+    → Arguments:
+        - model, X, y, splits, scoring, return_estimator: see fit_and_evaluate_fold()
+        - split_grid  : if True and the model is a GridSearchCV, its grid search is split in (fold, candidate) cells
+        - grid_results: list of the merged (best hyperparameters, cv_results_) of the folds, see merge_cells()
+    """
+    task = {'model': model, 'scoring': scoring, 'return_estimator': return_estimator, 'grid_results': grid_results,
+            # the positions are stored as int32 as they are shipped with every task
+            'splits': [(np.asarray(train_index, dtype=np.int32), np.asarray(test_index, dtype=np.int32)) for (train_index, test_index) in splits]}
+
+    if split_grid and grid_results is None and can_split_grid(model):
+        n_candidates = len(ParameterGrid(model.param_grid))
+        task.update(phase='cells', units=[(fold_number, candidate_number) for fold_number in range(len(splits))
+                                                                          for candidate_number in range(n_candidates)],
+                    inner_splits=[get_inner_splits(model, X, y, train_index) for (train_index, _) in task['splits']])
+    else:
+        task.update(phase='folds' if grid_results is None else 'refits', units=list(range(len(splits))))
+
+    return task
+
+
+def run_unit(task, X, y, unit_number):
+    """
+    Run one unit of a task and return its result: the fit_and_score_cell() dictionary of a cell, the fold metrics dictionary of a fold
+    → Arguments:
+        - task       : see get_task()
+        - X
+        - y
+        - unit_number: position of the unit in task['units']
+    """
+    unit = task['units'][unit_number]
+
+    if task['phase'] == 'cells':
+        (fold_number, candidate_number) = unit
+        return fit_and_score_cell(task['model'], X, y, task['splits'][fold_number][0], candidate_number,
+                                  task['inner_splits'][fold_number])
+
+    (train_index, test_index) = task['splits'][unit]
+    if task['phase'] == 'folds':
+        return fit_and_evaluate_fold(task['model'], X, y, train_index, test_index, task['scoring'], task['return_estimator'])
+
+    # refit the best candidate of the merged grid search, like GridSearchCV(refit=True)
+    (best_parameters, cv_results) = task['grid_results'][unit]
+    fold_metrics = fit_and_evaluate_fold(clone(task['model'].estimator).set_params(**best_parameters), X, y, train_index, test_index,
+                                         task['scoring'], task['return_estimator'])
+    fold_metrics['gs_best_parameters'] = best_parameters
+    fold_metrics['gs_cv_results']      = cv_results
+
+    return fold_metrics
+
+
+def run_job_unit(job_directory, unit_number):
+    """
+    Run one unit of the task saved in a job directory (task.pkl, X.pkl and y.pkl) and save its result in the units/ fold store of the
+    directory, a unit already done being skipped so that a failed array job can simply be submitted again
+    → Arguments:
+        - job_directory
+        - unit_number  : position of the unit in task['units']
+    """
+    fold_store = Fold_Store(job_directory, 'units')
+    if fold_store.has(unit_number):
+        return
+
+    with open(os.path.join(job_directory, 'task.pkl'), 'rb') as file:
+        task = pickle.load(file)
+    X = pd.read_pickle(os.path.join(job_directory, 'X.pkl'))
+    y = pd.read_pickle(os.path.join(job_directory, 'y.pkl'))
+
+    fold_store.save(unit_number, run_unit(task, X, y, unit_number))
+
+
+class Array_Job_Runner():
+    """
+    This class runs the units of a task as the elements of an array job of an executor (see job_executor.py): the task, X and y are
+    saved in a local job directory, staged by the executor (X and y being uploaded once, see Job_Executor.upload_data()) and each
+    element runs 'python fold_units.py <index>' in the job directory; the runner waits for the job with batched status queries and
+    fetches the unit results
+    → Members:
+      - executor       : Job_Executor object
+      - job_name       : prefix of the job names, a job <job_name>_<fingerprint>_<phase> being submitted per phase
+      - local_jobs_path: local directory where the job directories are created, by default the jobs_path of the executor (for the
+                         Local_Executor and Fake_Lsf_Executor)
+      - code_path      : path to the utils/python/ directory on the machine running the jobs, by default the path relative to the
+                         local job directory (valid if local_jobs_path is the ssh_remote_jobs/ directory of the cloned repository)
+      - poll_interval  : number of seconds between two status queries
+      - submit_options : options of Job_Executor.submit() for each element, like {'n_jobs': 1, 'short_job': True, 'memory': 8}
+    """
+
+    def __init__(self, executor, job_name='units', local_jobs_path=None, code_path=None, poll_interval=30, **submit_options):
+        self.executor        = executor
+        self.job_name        = job_name
+        self.local_jobs_path = local_jobs_path if local_jobs_path is not None else executor.jobs_path
+        self.code_path       = code_path
+        self.poll_interval   = poll_interval
+        self.submit_options  = submit_options
+
+
+    def run(self, task, X, y, fingerprint):
+        """
+        Run the units of the task as an array job and return the list of their results
+        → Arguments:
+            - task       : see get_task()
+            - X
+            - y
+            - fingerprint: fingerprint of the experiment (see get_fingerprint()), so that the same run reuses its job directory and the
+                           units already done
+        """
+        job_name = '{}_{}_{}'.format(self.job_name, fingerprint[:12], task['phase'])
+        local_job_directory = os.path.join(self.local_jobs_path, 'job_{}'.format(job_name))
+        os.makedirs(local_job_directory, exist_ok=True)
+
+        with open(os.path.join(local_job_directory, 'task.pkl'), 'wb') as file:
+            pickle.dump(task, file, protocol=pickle.HIGHEST_PROTOCOL)
+        for (name, data) in (('X.pkl', X), ('y.pkl', y)):
+            if not os.path.exists(os.path.join(local_job_directory, name)):
+                pd.to_pickle(data, os.path.join(local_job_directory, name))
+
+        code_path = self.code_path or os.path.relpath(os.path.dirname(os.path.abspath(__file__)), local_job_directory)
+        self.executor.submit(job_name, local_job_directory, command='python {}/fold_units.py $LSB_JOBINDEX'.format(code_path),
+                             array_size=len(task['units']), **self.submit_options)
+
+        while self.executor.get_statuses([job_name], result_file=None)[job_name] in ('PEND', 'RUN'):
+            time.sleep(self.poll_interval)
+
+        # fetch the results of the units
+        file_names = ['units/fold_{}.pkl'.format(unit_number) for unit_number in range(len(task['units']))]
+        existing_files = self.executor.get_existing_files(job_name, file_names)
+        if len(existing_files) < len(file_names):
+            missing_units = [unit_number + 1 for (unit_number, name) in enumerate(file_names) if name not in existing_files]
+            raise RuntimeError('The elements {} of the job {} failed, see their job_output_<index>.txt, submitting the job again only runs '
+                               'them'.format(missing_units, job_name))
+
+        fold_store = Fold_Store(local_job_directory, 'units')
+        self.executor.fetch(job_name, file_names, fold_store.path)
+
+        return [fold_store.load(unit_number) for unit_number in range(len(task['units']))]
+
+
+def run_units(task, X, y, n_jobs=1, runner=None, fingerprint=None):
+    """
+    Run the units of a task on a local pool of n_jobs processes, or with the given runner, and return the list of their results
+    """
+    if runner is None:
+        return Parallel(n_jobs=n_jobs)(delayed(run_unit)(task, X, y, unit_number) for unit_number in range(len(task['units'])))
+    else:
+        return runner.run(task, X, y, fingerprint)
+
+
+def run_fold_units(model, X, y, splits, scoring, split_grid=True, return_estimator=False, n_jobs=1, runner=None, fingerprint=None):
+    """
+    Run the cross-validation in work units and return the list of the fold metrics dictionaries, like run_folds()
+    → Arguments:
+        - model, X, y, splits, scoring, return_estimator: see fit_and_evaluate_fold()
+        - split_grid : if True and the model is a GridSearchCV, its grid search is split in (fold, candidate) cells
+        - n_jobs     : number of processes of the local pool
+        - runner     : if specified, Array_Job_Runner object running the units as array jobs instead of the local pool
+        - fingerprint: fingerprint of the experiment, needed by the runner
+    """
+    # the options changing the results of the units are part of the fingerprint, so that the runner never reuses the units of a run
+    # made with other options (like fold units without estimators for a run keeping them)
+    if fingerprint is not None:
+        fingerprint = hashlib.sha1('{}|split_grid={}|return_estimator={}'.format(fingerprint, bool(split_grid),
+                                                                                 bool(return_estimator)).encode()).hexdigest()
+
+    task = get_task(model, X, y, splits, scoring, return_estimator, split_grid)
+
+    if task['phase'] == 'cells':
+        cell_results = run_units(task, X, y, n_jobs, runner, fingerprint)
+        n_candidates = len(cell_results) // len(splits)
+        grid_results = [merge_cells(model, cell_results[fold_number * n_candidates:(fold_number + 1) * n_candidates])
+                        for fold_number in range(len(splits))]
+        task = get_task(model, X, y, splits, scoring, return_estimator, split_grid, grid_results)
+
+    return run_units(task, X, y, n_jobs, runner, fingerprint)
+
+
+if __name__ == '__main__':
+    # element of an array job, run in the job directory: python fold_units.py <index from 1>
+    run_job_unit('.', int(sys.argv[1]) - 1)
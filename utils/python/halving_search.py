@@ -0,0 +1,215 @@
+import math
+import time
+import numpy as np
+
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
+from sklearn.model_selection import ParameterGrid, check_cv
+
+from fold_engine import take_rows, predict_proba_and_class, Parallel, delayed
+from learning_curves import get_score
+
+
+def get_stratified_order(y, random_state):
+    """
+    Return a random permutation of the positions of y whose every prefix is a stratified subsample of y: the examples of each class are
+    shuffled and spread evenly along the permutation (the first examples holding one example of each class), so that the subsamples
+    made of the first n_resources positions are nested and keep the classes proportions
+    → Arguments:
+        - y           : array of the labels
+        - random_state: seed of the permutation
+    """
+    permutation = np.random.RandomState(random_state).permutation(len(y))
+    _, classes = np.unique(np.asarray(y)[permutation], return_inverse=True)
+
+    # relative rank of each example within its class, in [0, 1)
+    relative_ranks = np.empty(len(y))
+    for class_number in range(classes.max() + 1 if len(y) > 0 else 0):
+        is_in_class = (classes == class_number)
+        relative_ranks[is_in_class] = np.arange(is_in_class.sum()) / is_in_class.sum()
+
+    return permutation[np.argsort(relative_ranks, kind='mergesort')]
+
+
+def fit_and_score_budget(estimator, X, y, train_index, test_index, parameters, resource, n_resources, scoring, random_state):
+    """
+    Fit a copy of the estimator with the given hyperparameters and budget on the train fold and return a dictionary holding the
+    fit_time and the test_score
+    → Arguments:
+        - estimator   : unfitted sklearn model, can be a pipeline object
+        - X
+        - y
+        - train_index : positions of the train fold
+        - test_index  : positions of the test fold
+        - parameters  : dictionary of hyperparameters
+        - resource    : 'n_samples' to fit on a subsample of n_resources examples of the train fold, otherwise name of the
+                        hyperparameter (like 'randomforestclassifier__n_estimators' or 'svc__max_iter') set to n_resources
+        - n_resources : budget
+        - scoring     : name of the single-value score
+        - random_state: seed of the subsample of the train fold
+    """
+    if resource == 'n_samples':
+        # the subsamples of the successive iterations are nested and stratified, so that a small budget never holds a single class
+        train_index = np.asarray(train_index)
+        train_index = train_index[get_stratified_order(np.asarray(take_rows(y, train_index)), random_state)[:n_resources]]
+    else:
+        parameters = dict(parameters, **{resource: n_resources})
+
+    (X_train, X_test) = (take_rows(X, train_index), take_rows(X, test_index))
+    (y_train, y_test) = (np.asarray(take_rows(y, train_index)), np.asarray(take_rows(y, test_index)))
+
+    start = time.time()
+    estimator = clone(estimator).set_params(**parameters).fit(X_train, y_train)
+    fit_time = time.time() - start
+
+    y_proba_pred, y_class_pred = predict_proba_and_class(estimator, X_test)
+    return {'fit_time': fit_time, 'test_score': get_score(scoring, estimator, X_test, y_test, y_proba_pred, y_class_pred)}
+
+
+class Halving_Grid_Search_CV(BaseEstimator, ClassifierMixin):
+    """
+    This class implements a successive halving grid search: every candidate of the grid is first cross-validated with a small budget
+    (number of training examples or value of an iteration hyperparameter), then only the best 1 / factor of the candidates are kept
+    and cross-validated with a factor times larger budget, until the last iteration which uses the whole budget
+    It can be used as the model of a Metrics object like GridSearchCV: best_params_ and cv_results_ (one row per candidate and
+    iteration, with the 'iter' and 'n_resources' keys like sklearn's HalvingGridSearchCV) are stored in the gs_best_parameters and
+    gs_cv_results columns, Metrics.plot_grid_search_results() showing the last iteration of each candidate
+    → Members:
+      - estimator    : unfitted sklearn model, can be a pipeline object
+      - param_grid   : dictionary or list of dictionaries {hyperparameter name: list of values}, like GridSearchCV
+      - resource     : 'n_samples' or name of the iteration hyperparameter used as budget
+      - max_resources: budget of the last iteration, by default the size of the smallest train fold if resource is 'n_samples'
+      - min_resources: budget of the first iteration, by default chosen so that the last iteration uses max_resources
+      - factor       : proportion of candidates dropped and budget increase at each iteration
+      - cv           : cross-validation strategy or number of folds
+      - scoring      : name of the single-value score
+      - refit        : if True refit the best hyperparameters on the whole data (with the whole budget)
+      - n_jobs       : number of jobs
+      - random_state : seed of the subsamples if resource is 'n_samples' (stratified subsamples, see get_stratified_order())
+      - cv_results_, best_index_, best_params_, best_score_, best_estimator_, n_resources_, n_candidates_: set by fit()
+    """
+
+    def __init__(self, estimator, param_grid, resource='n_samples', max_resources=None, min_resources=None, factor=3, cv=3,
+                 scoring='roc_auc', refit=True, n_jobs=1, random_state=None):
+        self.estimator     = estimator
+        self.param_grid    = param_grid
+        self.resource      = resource
+        self.max_resources = max_resources
+        self.min_resources = min_resources
+        self.factor        = factor
+        self.cv            = cv
+        self.scoring       = scoring
+        self.refit         = refit
+        self.n_jobs        = n_jobs
+        self.random_state  = random_state
+
+
+    def get_budgets(self, n_candidates, max_resources, smallest_budget=1):
+        """
+        Return the list of the budgets of the iterations, the last one being max_resources
+        → Arguments:
+            - n_candidates   : number of candidates of the grid
+            - max_resources  : budget of the last iteration
+            - smallest_budget: lower bound of the default budget of the first iteration
+        """
+        n_iterations = 1 + int(math.floor(math.log(n_candidates) / math.log(self.factor)))
+        min_resources = self.min_resources or min(max(max_resources // self.factor ** (n_iterations - 1), smallest_budget), max_resources)
+
+        # fewer iterations if the budget can't be divided that much
+        n_iterations = min(n_iterations, 1 + int(math.floor(math.log(max_resources / min_resources) / math.log(self.factor))))
+        return [min(min_resources * self.factor ** i, max_resources) for i in range(n_iterations - 1)] + [max_resources]
+
+
+    def fit(self, X, y, groups=None):
+        """
+        Run the successive halving search and refit the best hyperparameters
+        → Arguments:
+            - X
+            - y
+            - groups: can be left to None if cv doesn't implement GroupFold or similar
+        """
+        candidates = list(ParameterGrid(self.param_grid))
+        splits = list(check_cv(self.cv, y, classifier=True).split(X, y, groups))
+
+        if self.max_resources is not None:
+            max_resources = self.max_resources
+        elif self.resource == 'n_samples':
+            max_resources = min(len(train_index) for (train_index, _) in splits)
+        else:
+            raise ValueError('max_resources should be specified if the resource is a hyperparameter')
+        # a subsample needs at least one example of each class
+        budgets = self.get_budgets(len(candidates), max_resources, len(np.unique(y)) if self.resource == 'n_samples' else 1)
+
+        rows = []
+        remaining = list(range(len(candidates)))
+        self.n_resources_, self.n_candidates_ = [], []
+        for (iteration, n_resources) in enumerate(budgets):
+            units = [(candidate_number, fold_number) for candidate_number in remaining for fold_number in range(len(splits))]
+            results = Parallel(n_jobs=self.n_jobs)(delayed(fit_and_score_budget)(self.estimator, X, y, splits[fold_number][0],
+                                                                                 splits[fold_number][1], candidates[candidate_number],
+                                                                                 self.resource, n_resources, self.scoring,
+                                                                                 self.random_state)
+                                                   for (candidate_number, fold_number) in units)
+            results = {unit: result for (unit, result) in zip(units, results)}
+
+            for candidate_number in remaining:
+                fold_results = [results[(candidate_number, fold_number)] for fold_number in range(len(splits))]
+                rows.append({'iter': iteration, 'n_resources': n_resources, 'candidate': candidate_number,
+                             'test_scores': [result['test_score'] for result in fold_results],
+                             'fit_times': [result['fit_time'] for result in fold_results]})
+            self.n_resources_.append(n_resources)
+            self.n_candidates_.append(len(remaining))
+
+            # keep the best 1 / factor of the candidates for the next iteration
+            if iteration < len(budgets) - 1:
+                mean_scores = {row['candidate']: np.mean(row['test_scores']) for row in rows if row['iter'] == iteration}
+                n_kept = max(int(math.ceil(len(remaining) / self.factor)), 1)
+                remaining = sorted(remaining, key=lambda candidate_number: -mean_scores[candidate_number])[:n_kept]
+
+        self.set_cv_results(candidates, rows, len(splits))
+
+        if self.refit:
+            parameters = self.best_params_ if self.resource == 'n_samples' else dict(self.best_params_, **{self.resource: max_resources})
+            self.best_estimator_ = clone(self.estimator).set_params(**parameters).fit(X, y)
+            self.classes_ = self.best_estimator_.classes_
+
+        return self
+
+
+    def set_cv_results(self, candidates, rows, n_splits):
+        """
+        Set cv_results_ (one entry per evaluated (candidate, iteration) in the layout of GridSearchCV.cv_results_) and the best candidate
+        of the last iteration
+        """
+        test_scores = np.array([row['test_scores'] for row in rows])
+        fit_times = np.array([row['fit_times'] for row in rows])
+        params = [candidates[row['candidate']] for row in rows]
+
+        self.cv_results_ = {'params': params,
+                            'iter': np.array([row['iter'] for row in rows]),
+                            'n_resources': np.array([row['n_resources'] for row in rows])}
+        for name in sorted({name for parameters in params for name in parameters}):
+            self.cv_results_['param_{}'.format(name)] = np.ma.MaskedArray([parameters.get(name) for parameters in params],
+                                                                          mask=[name not in parameters for parameters in params],
+                                                                          dtype=object)
+        self.cv_results_['mean_fit_time'] = fit_times.mean(axis=1)
+        self.cv_results_['std_fit_time']  = fit_times.std(axis=1)
+        for fold_number in range(n_splits):
+            self.cv_results_['split{}_test_score'.format(fold_number)] = test_scores[:, fold_number]
+        self.cv_results_['mean_test_score'] = test_scores.mean(axis=1)
+        self.cv_results_['std_test_score']  = test_scores.std(axis=1)
+
+        # the candidates of later iterations rank first, then by score within an iteration
+        order = np.lexsort((-self.cv_results_['mean_test_score'], -self.cv_results_['iter']))
+        self.cv_results_['rank_test_score'] = np.argsort(order) + 1
+
+        self.best_index_  = int(order[0])
+        self.best_params_ = params[self.best_index_]
+        self.best_score_  = self.cv_results_['mean_test_score'][self.best_index_]
+
+
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)
+
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
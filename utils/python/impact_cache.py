@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def get_file_key(path, sample_size=2**20):
+    """
+    Return a sha1 hexadecimal string identifying the content of a file from its size, its modification time and a md5 of its first
+    and last sample_size bytes (hashing the whole file would cost almost as much as parsing it)
+    → Arguments:
+        - path       : path to the file
+        - sample_size: number of bytes hashed at the beginning and at the end of the file
+    """
+    stat = os.stat(path)
+
+    content_hash = hashlib.md5()
+    with open(path, 'rb') as file:
+        content_hash.update(file.read(sample_size))
+        file.seek(max(stat.st_size - sample_size, 0))
+        content_hash.update(file.read(sample_size))
+
+    return hashlib.sha1('{}|{}|{}'.format(stat.st_size, stat.st_mtime_ns, content_hash.hexdigest()).encode()).hexdigest()
+
+
+class Impact_Cache():
+    """
+    This class implements a typed columnar cache of a tab-separated file (like annotated_final_IMPACT_mutations_20181105.txt): the
+    file is parsed once, each column is saved as a .npy file, the string columns being dictionary-encoded (integer codes + categories),
+    and later loads memory-map only the requested columns
+    → Members:
+      - source_path : path to the tab-separated file
+      - path        : path to the cache directory of the current version of the file, like '<cache_directory>/<file_name>.<key>'
+      - columns     : dictionary {column_name: column description}, a column description being a dictionary like
+                      {'name': 'Hugo_Symbol', 'file': '3', 'kind': 'numeric' or 'categorical'}
+      - column_names: list of the columns names in the file order
+      - n_rows      : number of rows
+    """
+
+    def __init__(self, source_path, cache_directory=None):
+        """
+        Create the Impact_Cache object, the cache is built if it doesn't exist yet for the current version of the file
+        → Arguments:
+            - source_path    : path to the tab-separated file
+            - cache_directory: directory holding the caches, by default a '.impact_cache' directory next to the file
+        """
+        if cache_directory is None:
+            cache_directory = os.path.join(os.path.dirname(os.path.abspath(source_path)), '.impact_cache')
+
+        self.source_path = source_path
+        self.path = os.path.join(cache_directory, '{}.{}'.format(os.path.basename(source_path), get_file_key(source_path)))
+
+        if not os.path.exists(self.path):
+            self._build()
+
+        with open(os.path.join(self.path, 'columns.json')) as file:
+            description = json.load(file)
+        self.columns = {column['name']: column for column in description['columns']}
+        self.column_names = [column['name'] for column in description['columns']]
+        self.n_rows = description['n_rows']
+
+
+    def _build(self):
+        """
+        Parse the source file and save every column in a temporary directory renamed to self.path once complete
+        """
+        print('Build the columnar cache of {}...'.format(self.source_path), end='')
+
+        data = pd.read_csv(self.source_path, sep='\t', low_memory=False)
+
+        temporary_path = self.path + '.tmp{}'.format(os.getpid())
+        os.makedirs(temporary_path)
+
+        columns = []
+        for (column_number, column_name) in enumerate(data.columns):
+            column = {'name': column_name, 'file': str(column_number)}
+
+            if not pd.api.types.is_numeric_dtype(data[column_name].dtype):
+                # dictionary-encode the string columns
+                categorical = pd.Categorical(data[column_name])
+                np.save(os.path.join(temporary_path, column['file'] + '.npy'), np.asarray(categorical.codes))
+                pd.to_pickle(categorical.categories, os.path.join(temporary_path, column['file'] + '.categories.pkl'))
+                column['kind'] = 'categorical'
+            else:
+                np.save(os.path.join(temporary_path, column['file'] + '.npy'), np.asarray(data[column_name].values))
+                column['kind'] = 'numeric'
+
+            columns.append(column)
+
+        with open(os.path.join(temporary_path, 'columns.json'), 'w') as file:
+            json.dump({'source_path': os.path.abspath(self.source_path), 'n_rows': len(data), 'columns': columns}, file)
+
+        # another process may have built the same cache in the meantime
+        try:
+            os.rename(temporary_path, self.path)
+        except OSError:
+            shutil.rmtree(temporary_path)
+
+        print(' done!')
+
+
+    def read_column(self, column_name):
+        """
+        Return the values of a column as a numpy array or a pandas Categorical, the underlying arrays being memory-mapped
+        → Arguments:
+            - column_name
+        """
+        column = self.columns[column_name]
+        values = np.load(os.path.join(self.path, column['file'] + '.npy'), mmap_mode='r')
+
+        if column['kind'] == 'categorical':
+            categories = pd.read_pickle(os.path.join(self.path, column['file'] + '.categories.pkl'))
+            return pd.Categorical.from_codes(values, categories)
+        else:
+            return values
+
+
+    def read(self, columns=None, rows=None):
+        """
+        Return a pandas DataFrame holding the requested columns, the string columns being categorical
+        → Arguments:
+            - columns: list of columns to read, every column if None
+            - rows   : positions of the rows to read, every row if None
+        """
+        if columns is None:
+            columns = self.column_names
+
+        data = {}
+        for column_name in columns:
+            values = self.read_column(column_name)
+            data[column_name] = values if rows is None else values[rows]
+
+        return pd.DataFrame(data, columns=columns)
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
-from custom_tools import get_table
+import scipy.sparse
+from custom_tools import get_table, unlist
+from impact_cache import Impact_Cache
 
 # work in progress...
 class Impact_Wrapper():
@@ -13,9 +15,14 @@ class Impact_Wrapper():
       - impact_processed     : impact dataset after features selection and processing
       - positive_class_number: number of positive sample
       - negative_class_number: number of negative sample
-      - impact_selected      : impact dataset after sample selection
+      - impact_selected      : impact dataset after sample selection (not computed if get_X_and_y() is called with sparse=True)
       - selected_indexes     : index selected during the sample selection
       - second_permutation   : the permutation applied to the samples selected
+      - feature_names        : pandas Index of the columns names of the last features matrix X returned by get_X_and_y()
+      - encoder              : Categorical_Encoder fitted on the categorical features of self.impact, reused by every process() call
+      - processed_features   : list of features selected by the last process() call
+      - impact_cache         : Impact_Cache object if the dataset is read from the columnar cache, None otherwise
+      - rows                 : positions in the raw file of the rows of self.impact, used to load new columns from the cache
     """
 
     original_categorical_features = ['Hugo_Symbol', 'Chromosome', 'Consequence', 'Variant_Type', 'Reference_Allele', 'Tumor_Seq_Allele2',
@@ -27,16 +34,29 @@ class Impact_Wrapper():
                                      'is_a_hotspot', 'is_a_3d_hotspot', 'oncogenic', 'gene_type', 'variant_caller_cv']
 
 
-    def __init__(self, path, label, shuffle=True):
+    def __init__(self, path, label, shuffle=True, min_frequency=None, use_cache=False, columns=None):
         """
         Create the Impact_Wrapper object
         → Arguments:
-            - path   : path to impact dataset
-            - label  : name of the label to predict
-            - shuffle: if True shuffle the raw dataset
+            - path         : path to impact dataset
+            - label        : name of the label to predict
+            - shuffle      : if True shuffle the raw dataset
+            - min_frequency: categories seen less than min_frequency times are merged in an 'other' category, can be an int or a
+                             dictionary {feature_name: int} (see Categorical_Encoder)
+            - use_cache    : if True read the dataset from its columnar cache (built on the first call, see Impact_Cache), the string
+                             columns are then categorical
+            - columns      : if specified only read these columns, with use_cache=True the other columns are read when first processed
         """
+        if columns is not None:
+            columns = list(columns) + [c for c in ['confidence_class', 'oncogenic'] if c not in columns]
 
-        self.impact = pd.read_csv(path, sep='\t', low_memory=False)
+        if use_cache:
+            self.impact_cache = Impact_Cache(path)
+            self.impact = self.impact_cache.read(columns)
+        else:
+            self.impact_cache = None
+            self.impact = pd.read_csv(path, sep='\t', low_memory=False, usecols=columns)
+        self.rows = np.arange(len(self.impact))
         self.label = label
 
         # shuffle data
@@ -45,6 +65,7 @@ class Impact_Wrapper():
             rng = np.random.RandomState(42)
             self.first_permutation = rng.permutation(len(self.impact))
             self.impact = self.impact.iloc[self.first_permutation]
+            self.rows = self.rows[self.first_permutation]
             # reset the index to [0, 1, ...]
             self.impact.reset_index(drop=True, inplace=True)
 
@@ -55,12 +76,16 @@ class Impact_Wrapper():
         self.impact['is_driver'] = (self.impact['oncogenic'].isin(['Likely Oncogenic', 'Oncogenic', 'Predicted Oncogenic']))
 
         if label == 'is_driver':
+            self.rows = self.rows[~self.impact['is_artefact'].values]
             self.impact = self.impact[~self.impact['is_artefact']]
             self.impact.reset_index(drop=True, inplace=True)
 
         # default categorical features
         self.categorical_features = Impact_Wrapper.original_categorical_features
 
+        # the categories of each categorical feature are learnt only once, when the feature is first processed
+        self.encoder = Categorical_Encoder(min_frequency)
+
 
     def add_features(self, feature_name, feature_values, is_categorical):
         """
@@ -71,22 +96,41 @@ class Impact_Wrapper():
             - is_categorical: if True the feature will be processed as categorical
         """
         self.impact[feature_name] = feature_values
+        self.encoder.forget(feature_name)
         if is_categorical:
             self.categorical_features.append(feature_name)
 
 
+    def load_features(self, features):
+        """
+        Read from the columnar cache the given features not loaded yet in self.impact (only if the dataset is read from the cache)
+        → Arguments:
+            - features: list of features
+        """
+        if self.impact_cache is not None:
+            for feature_name in features:
+                if feature_name not in self.impact.columns and feature_name in self.impact_cache.columns:
+                    self.impact[feature_name] = self.impact_cache.read_column(feature_name)[self.rows]
+
+
     def process(self, features):
         """
         Select and process the features
         → Arguments:
             - features: list of selected features
         """
-        # copy self.impact and keep only selected features
-        self.impact_processed = self.impact.copy()[features + [self.label]]
+        self.processed_features = features
+        self.load_features(features)
 
-        # transform categorical features to dummy features
+        # encode the categorical features not encoded yet, the other ones are read from the encoder cache
         categorical_features = [f for f in self.categorical_features if f in features]
-        self.impact_processed = pd.get_dummies(self.impact_processed, columns=categorical_features, sparse=True)
+        self.encoder.fit(self.impact, categorical_features)
+
+        # keep only selected features and transform categorical features to dummy features, with the same columns layout as
+        # pd.get_dummies(self.impact[features + [self.label]], columns=categorical_features, sparse=True)
+        other_features = [f for f in features + [self.label] if f not in categorical_features]
+        self.impact_processed = pd.concat([self.impact[other_features]] +
+                                          [self.encoder.get_dummies(f, self.impact.index) for f in categorical_features], axis=1)
 
         # compute some metrics
         self.positive_class_number = self.impact_processed[ self.impact_processed[self.label]].shape[0]
@@ -95,14 +139,19 @@ class Impact_Wrapper():
         return self
 
 
-    def get_X_and_y(self, positive_class_index, negative_class_index, shuffle=True):
+    def get_X_and_y(self, positive_class_index, negative_class_index, shuffle=True, sparse=False):
         """
         Return the ready-for-classification features matrix X and target array y
         → Arguments:
             - positive_class_index: index to select in the positive class, if 'all' the whole positive class is selected
             - negative_class_index: index to select in the negative class, if 'all' the whole negative class is selected
             - shuffle: if True shuffle the dataset between positive and negative after selection
+            - sparse : if True X is returned as a scipy.sparse CSR matrix built without ever densifying the dummy features, the
+                       columns names are then given by self.feature_names
         """
+        if sparse:
+            return self._get_sparse_X_and_y(positive_class_index, negative_class_index, shuffle)
+
         # get selected dataset
         if positive_class_index == 'all':
             positive_class_index = range(self.positive_class_number)
@@ -126,9 +175,69 @@ class Impact_Wrapper():
         X = X.astype(float)
         y = self.impact_selected[self.label]
 
+        self.feature_names = X.columns
+
+        return X, y
+
+
+    def _get_sparse_X_and_y(self, positive_class_index, negative_class_index, shuffle):
+        """
+        Sparse version of get_X_and_y(), the rows are selected by position on a CSR matrix instead of concatenating DataFrames
+        → Arguments: see get_X_and_y()
+        """
+        # get the positions of the selected rows, in the same order as the dense version
+        label = np.asarray(self.impact_processed[self.label], dtype=bool)
+        if positive_class_index == 'all':
+            positive_class_index = range(self.positive_class_number)
+        if negative_class_index == 'all':
+            negative_class_index = range(self.negative_class_number)
+        positions = np.concatenate([np.flatnonzero( label)[np.asarray(positive_class_index, dtype=int)],
+                                    np.flatnonzero(~label)[np.asarray(negative_class_index, dtype=int)]])
+        self.selected_indexes = self.impact_processed.index[positions]
+
+        # shuffle
+        if shuffle:
+            rng = np.random.RandomState(42)
+            permutation = rng.permutation(len(positions))
+            positions = positions[permutation]
+            self.second_permutation = permutation
+
+        # get features matrix X (n_samples x n_features) and target array y (n_samples)
+        X, self.feature_names = self._get_sparse_features_matrix(self.impact)
+        X = X[positions]
+        y = self.impact_processed[self.label].iloc[positions].astype(bool)
+
         return X, y
 
 
+    def _get_sparse_features_matrix(self, data, encode=False):
+        """
+        Return the scipy.sparse CSR features matrix of the features selected by the last process() call and its columns names
+        → Arguments:
+            - data  : DataFrame holding the raw features
+            - encode: if False data is self.impact and the encoder cached blocks are used, otherwise data is encoded with the encoder
+        """
+        categorical_features = [f for f in self.categorical_features if f in self.processed_features]
+        return get_features_matrix(data, self.processed_features, categorical_features, self.encoder, encode)
+
+
+    def get_X(self, data, sparse=False):
+        """
+        Return the features matrix of new data (like a new IMPACT mutation file) with exactly the same columns layout as the features
+        matrices returned by get_X_and_y(), the categories are encoded with the fitted encoder (unknown categories go to the 'other'
+        category if it exists, otherwise all their dummy features are 0)
+        → Arguments:
+            - data  : DataFrame holding the raw features selected by the last process() call
+            - sparse: if True return a scipy.sparse CSR matrix, otherwise a pandas DataFrame
+        """
+        X, feature_names = self._get_sparse_features_matrix(data, encode=True)
+
+        if sparse:
+            return X
+        else:
+            return pd.DataFrame(X.toarray(), index=data.index, columns=feature_names)
+
+
     def get_original_impact(self):
         """
         Return the impact rows corresponding to the rows selected by get_X_and_y() in the same order
@@ -145,3 +254,203 @@ class Impact_Wrapper():
         """
         print('X: {} | y: {}'.format(X.shape, y.shape))
         display(get_table(y))
+
+
+class Categorical_Encoder():
+    """
+    This class implements a fitted one-hot encoder: the categories of each feature are learnt once, the data is converted once to
+    integer codes, and the dummy features of any subset of features are then built from the cached codes
+    → Members:
+      - min_frequency: categories seen less than min_frequency times are merged in the 'other' category, int or dictionary
+                       {feature_name: int}, None to keep every category
+      - categories   : dictionary {feature_name: pandas Index of the categories}, the 'other' category being the last one if it exists
+      - codes        : dictionary {feature_name: int32 array of the codes of the fitted data}, -1 for missing values
+      - blocks       : dictionary {feature_name: scipy.sparse CSR dummy features of the fitted data}, filled on demand
+      - dummies      : dictionary {feature_name: pandas sparse DataFrame of dummy features of the fitted data}, filled on demand
+    Only min_frequency and categories are pickled, so that a saved encoder stays small and can encode new data
+    """
+
+    other_category = 'other'
+
+    def __init__(self, min_frequency=None):
+        """
+        Create the Categorical_Encoder object
+        → Arguments:
+            - min_frequency
+        """
+        self.min_frequency = min_frequency
+        self.categories = {}
+        self.codes = {}
+        self.blocks = {}
+        self.dummies = {}
+
+
+    def __getstate__(self):
+        return {'min_frequency': self.min_frequency, 'categories': self.categories}
+
+
+    def __setstate__(self, state):
+        self.__init__(state['min_frequency'])
+        self.categories = state['categories']
+
+
+    def get_min_frequency(self, feature_name):
+        """
+        Return the min_frequency value for the given feature
+        → Arguments:
+            - feature_name
+        """
+        if isinstance(self.min_frequency, dict):
+            return self.min_frequency.get(feature_name)
+        else:
+            return self.min_frequency
+
+
+    def fit(self, data, features):
+        """
+        Learn the categories and compute the codes of each given feature not fitted yet
+        → Arguments:
+            - data    : pandas DataFrame
+            - features: list of categorical features to fit
+        """
+        for feature_name in features:
+            if feature_name in self.codes:
+                continue
+
+            categorical = pd.Categorical(data[feature_name]).remove_unused_categories()
+            categories = categorical.categories
+            codes = np.asarray(categorical.codes, dtype=np.int32)
+
+            # merge the rare categories in the 'other' category
+            min_frequency = self.get_min_frequency(feature_name)
+            if min_frequency:
+                is_kept = np.bincount(codes[codes >= 0], minlength=len(categories)) >= min_frequency
+                if not is_kept.all():
+                    new_codes = np.where(is_kept, np.cumsum(is_kept) - 1, is_kept.sum()).astype(np.int32)
+                    categories = categories[is_kept].append(pd.Index([Categorical_Encoder.other_category]))
+                    codes = np.where(codes >= 0, new_codes[codes], -1).astype(np.int32)
+
+            self.categories[feature_name] = categories
+            self.codes[feature_name] = codes
+
+        return self
+
+
+    def forget(self, feature_name):
+        """
+        Remove everything learnt on the given feature, it will be fitted again on the next fit() call
+        → Arguments:
+            - feature_name
+        """
+        for attribute in (self.categories, self.codes, self.blocks, self.dummies):
+            attribute.pop(feature_name, None)
+
+
+    def transform(self, values, feature_name):
+        """
+        Return the int32 codes of new values of a fitted feature, unknown categories get the 'other' category code if it exists,
+        -1 otherwise (as missing values)
+        → Arguments:
+            - values      : array-like of the feature values
+            - feature_name
+        """
+        categories = self.categories[feature_name]
+        codes = np.asarray(pd.Categorical(values, categories=categories).codes, dtype=np.int32)
+
+        if len(categories) > 0 and categories[-1] == Categorical_Encoder.other_category:
+            codes[(codes == -1) & np.asarray(pd.notnull(values))] = len(categories) - 1
+
+        return codes
+
+
+    def get_dummy_names(self, feature_name):
+        """
+        Return the list of the dummy features names of the given feature, named like pd.get_dummies() does ('<feature>_<category>')
+        → Arguments:
+            - feature_name
+        """
+        return ['{}_{}'.format(feature_name, category) for category in self.categories[feature_name]]
+
+
+    def get_sparse_block(self, feature_name, codes=None):
+        """
+        Return the dummy features of the given feature as a scipy.sparse CSR matrix
+        → Arguments:
+            - feature_name
+            - codes       : codes to one-hot encode, if None the (cached) block of the fitted data is returned
+        """
+        if codes is None:
+            if feature_name not in self.blocks:
+                self.blocks[feature_name] = self.get_sparse_block(feature_name, self.codes[feature_name])
+            return self.blocks[feature_name]
+
+        rows = np.flatnonzero(codes >= 0)
+        return scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, codes[rows])), shape=(len(codes), len(self.categories[feature_name])))
+
+
+    def get_dummies(self, feature_name, index):
+        """
+        Return the (cached) dummy features of the fitted data for the given feature as a pandas sparse DataFrame
+        → Arguments:
+            - feature_name
+            - index       : index of the fitted data
+        """
+        if feature_name not in self.dummies:
+            categorical = pd.Categorical.from_codes(self.codes[feature_name], self.categories[feature_name])
+            self.dummies[feature_name] = pd.get_dummies(categorical, prefix=feature_name, sparse=True)
+            self.dummies[feature_name].index = index
+
+        return self.dummies[feature_name]
+
+
+def get_features_matrix(data, features, categorical_features, encoder, encode=True):
+    """
+    Return the scipy.sparse CSR features matrix of the given features (the other features first, then the dummy features of each
+    categorical feature, like Impact_Wrapper.get_X_and_y()) and its columns names
+    → Arguments:
+        - data                : DataFrame holding the raw features
+        - features            : list of features
+        - categorical_features: list of the categorical features among features, in the order of their dummy features
+        - encoder             : Categorical_Encoder fitted on the categorical features
+        - encode              : if False data is the data the encoder was fitted on and its cached blocks are used, otherwise data is
+                                encoded with the encoder
+    """
+    other_features = [f for f in features if f not in categorical_features]
+
+    other_matrix, other_names = get_sparse_matrix(data[other_features])
+    blocks = [encoder.get_sparse_block(f, encoder.transform(data[f], f) if encode else None) for f in categorical_features]
+
+    X = scipy.sparse.hstack([other_matrix] + blocks, format='csr')
+    feature_names = other_names.append(pd.Index(unlist([encoder.get_dummy_names(f) for f in categorical_features])))
+
+    return X, feature_names
+
+
+def get_sparse_matrix(data):
+    """
+    Return a scipy.sparse CSR float matrix holding the values of the DataFrame data and the pandas Index of its columns names
+    The pandas sparse columns (like the ones created by pd.get_dummies(..., sparse=True)) are copied without being densified
+    → Arguments:
+        - data: pandas DataFrame with numerical, boolean or sparse columns
+    """
+    rows, columns, values = [], [], []
+
+    for (column_number, column_name) in enumerate(data.columns):
+        column_values = data[column_name].values
+
+        if hasattr(column_values, 'sp_index') and column_values.fill_value == 0:
+            # pandas sparse column: only the stored values are read
+            column_rows   = column_values.sp_index.to_int_index().indices
+            column_values = np.asarray(column_values.sp_values, dtype=float)
+        else:
+            column_values = np.asarray(column_values, dtype=float)
+            column_rows   = np.flatnonzero(column_values)
+            column_values = column_values[column_rows]
+
+        rows.append(column_rows)
+        columns.append(np.full(len(column_rows), column_number, dtype=np.int32))
+        values.append(column_values)
+
+    matrix = scipy.sparse.coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape=data.shape)
+
+    return matrix.tocsr(), data.columns
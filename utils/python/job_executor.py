@@ -0,0 +1,569 @@
+import os
+import re
+import sys
+import stat
+import shlex
+import shutil
+import hashlib
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+# This module implements the executors used by Selene_Job to run a job directory (script.ipy and its data) somewhere, they share one
+# interface so that a notebook can switch from the cluster to the local computer (or to the fake cluster of the tests) by changing the
+# executor only:
+#   - Lsf_Executor     : jobs submitted with bsub on an LSF cluster (like selene) through ssh and scp
+#   - Fake_Lsf_Executor: the Lsf_Executor commands run on the local computer, with fake bsub and bjobs commands
+#   - Local_Executor   : jobs run as processes of the local computer, at most max_workers at the same time
+# A job can be an array job: its command is run array_size times, with the LSB_JOBINDEX environment variable set to 1, ..., array_size
+# like in a LSF job array, so that independent work units (like the folds of a cross-validation, see fold_units.py) spread over the
+# cluster slots
+# The data files of a job (X.pkl, y.pkl, groups.pkl, split_plan.npz) are uploaded once to
+# <jobs_path>/datasets/<sha1 of the file>.<extension> and linked in the job directory, so that the jobs sharing the same data never
+# ship it again
+# The statuses of any number of jobs are read with one command (ie one ssh round-trip), see Job_Executor.get_statuses()
+
+# the setup of the selene environment: LSF environment variables and python virtualenv
+selene_setup_command = 'source ~/.bash_profile; \
+                        export LSF_ENVDIR=/common/lsf/conf; export LSF_SERVERDIR=/common/lsf/9.1/linux2.6-glibc2.3-x86_64/etc; \
+                        workon imp-ann_env'
+
+# files of a job directory never copied with the job: the data files are linked to the datasets directory and the results are removed
+default_data_files   = ('X.pkl', 'y.pkl', 'groups.pkl', 'split_plan.npz')
+default_result_files = ('metrics.pkl', 'job_output.txt')
+
+# line separating the scheduler output from the list of the jobs having a result file in the output of get_statuses()
+status_separator = '__RESULTS__'
+
+
+def get_file_hash(path, block_size=2 ** 20):
+    """
+    Return the sha1 hexadecimal string of the content of a file
+    → Arguments:
+        - path
+        - block_size: number of bytes read at once
+    """
+    hash_object = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            hash_object.update(block)
+
+    return hash_object.hexdigest()
+
+
+def copy_files(paths, directory):
+    """
+    Copy files to a local directory, the files which are already in the directory (job run in place) being skipped
+    """
+    for path in paths:
+        destination = os.path.join(directory, os.path.basename(path))
+        if not os.path.exists(destination) or not os.path.samefile(path, destination):
+            shutil.copy(path, destination)
+
+
+class Job_Executor():
+    """
+    This class is the interface shared by the executors: a job is a local directory holding script.ipy and its data files, it is
+    staged in the directory <jobs_path>/job_<job_name> of the machine running it and launched there
+    The subclasses implement the commands of their machine (run_remote(), copy_to_remote(), copy_from_remote()) and of their scheduler
+    (launch(), get_status_command(), parse_statuses())
+    → Static members:
+        - is_local: True if the jobs run on the local computer, a local job directory which is already the job path then runs in place
+    → Members:
+      - jobs_path: path to the directory holding the job directories and the datasets/ directory on the machine running the jobs
+      - hashes   : dictionary {(path, size, modification time): sha1} of the data files hashed so far
+    """
+
+    is_local = False
+
+    def __init__(self, jobs_path):
+        self.jobs_path = jobs_path
+        self.hashes    = {}
+
+
+    def get_job_path(self, job_name):
+        """
+        Return the path to the job directory on the machine running the jobs
+        """
+        return '{}/job_{}'.format(self.jobs_path, job_name)
+
+
+    def get_dataset_name(self, path):
+        """
+        Return the name of a data file in the datasets directory: the sha1 of its content and its extension, the hash being computed once
+        per version of the file
+        → Arguments:
+            - path: local path to the data file
+        """
+        file_stat = os.stat(path)
+        key = (os.path.abspath(path), file_stat.st_size, file_stat.st_mtime_ns)
+        if key not in self.hashes:
+            self.hashes[key] = get_file_hash(path)
+
+        return self.hashes[key] + os.path.splitext(path)[1]
+
+
+    def upload_data(self, paths):
+        """
+        Upload the data files not in the datasets directory yet and return the dictionary {path: dataset name}
+        → Arguments:
+            - paths: local paths to the data files
+        """
+        dataset_names = {path: self.get_dataset_name(path) for path in paths}
+        if not dataset_names:
+            return dataset_names
+
+        # one command to find the missing datasets, one copy per missing dataset and one command to publish them
+        datasets_path = self.jobs_path + '/datasets'
+        command = 'mkdir -p {0} && cd {0} && for name in {1}; do [ -e $name ] || echo $name; done'.format(
+                      shlex.quote(datasets_path), ' '.join(shlex.quote(name) for name in dataset_names.values()))
+        missing_names = set(self.run_remote(command).split())
+
+        uploaded_names = []
+        for (path, name) in dataset_names.items():
+            if name in missing_names and name not in uploaded_names:
+                print('➞ upload {} to datasets/{}'.format(path, name))
+                # the file is uploaded under a temporary name so that an interrupted upload is never taken for the dataset
+                self.copy_to_remote(path, '{}/{}.tmp'.format(datasets_path, name))
+                uploaded_names.append(name)
+
+        if uploaded_names:
+            self.run_remote('cd {} && {}'.format(shlex.quote(datasets_path),
+                                                 ' && '.join('mv {0}.tmp {0}'.format(shlex.quote(name)) for name in uploaded_names)))
+
+        return dataset_names
+
+
+    def stage(self, job_name, local_job_directory, data_files=default_data_files):
+        """
+        Copy the job directory (without its data files and results) to the job path, the data files being uploaded once (see
+        upload_data()) and linked in the job directory
+        → Arguments:
+            - job_name
+            - local_job_directory: local path to the job directory
+            - data_files         : names of the data files of the job directory
+        """
+        job_path = self.get_job_path(job_name)
+        if self.is_local and os.path.exists(job_path) and os.path.samefile(local_job_directory, job_path):
+            # the job runs in place, only the results of a previous run are removed
+            for name in default_result_files:
+                if os.path.exists(os.path.join(local_job_directory, name)):
+                    os.remove(os.path.join(local_job_directory, name))
+            return
+
+        data_paths = [os.path.join(local_job_directory, name) for name in data_files
+                      if os.path.exists(os.path.join(local_job_directory, name))]
+        dataset_names = self.upload_data(data_paths)
+
+        command = 'mkdir -p {0} && cd {0} && rm -f {1} && tar -xf -'.format(
+                      shlex.quote(job_path), ' '.join(shlex.quote(name) for name in data_files + default_result_files))
+        for (path, name) in dataset_names.items():
+            command += ' && ln -s {} {}'.format(shlex.quote('../datasets/' + name), shlex.quote(os.path.basename(path)))
+
+        # the job directory is sent as a tar stream on the standard input of the command, so that it costs one round-trip
+        excludes = ['--exclude={}'.format(name) for name in data_files + default_result_files]
+        tar = subprocess.Popen(['tar', '-C', local_job_directory, '-cf', '-'] + excludes + ['.'], stdout=subprocess.PIPE)
+        self.run_remote(command, stdin=tar.stdout)
+        tar.stdout.close()
+        if tar.wait() != 0:
+            raise RuntimeError('tar failed on {}'.format(local_job_directory))
+
+
+    def submit(self, job_name, local_job_directory, command='ipython script.ipy', n_jobs=1, short_job=True, memory=None,
+               data_files=default_data_files, array_size=None):
+        """
+        Stage the job directory and launch the command in it, the output being written in job_output.txt (job_output_<index>.txt for
+        each element of an array job)
+        Return the scheduler job id
+        → Arguments:
+            - job_name
+            - local_job_directory: local path to the job directory
+            - command            : command run in the job directory
+            - n_jobs             : number of CPUs to use
+            - short_job          : if True the job is limited to 59 minutes (used by the LSF executors only)
+            - memory             : amount of memory in GB per CPU (used by the LSF executors only)
+            - data_files         : names of the data files of the job directory, see stage()
+            - array_size         : if specified, the command is run array_size times with LSB_JOBINDEX set to 1, ..., array_size
+                                   (n_jobs, short_job and memory being the resources of each element)
+        """
+        self.stage(job_name, local_job_directory, data_files)
+        return self.launch(job_name, command, n_jobs, short_job, memory, array_size)
+
+
+    def get_statuses(self, job_names, result_file='metrics.pkl'):
+        """
+        Return the dictionary {job_name: status} of the given jobs, read with one command whatever the number of jobs, the status being:
+            - 'PEND' or 'RUN': the job is waiting or running
+            - 'DONE'         : the job is finished and its result file exists
+            - 'EXIT'         : the job is finished without creating its result file (error, killed by the queue time limit...)
+            - 'UNKNOWN'      : the job is not known by the scheduler (never submitted or forgotten) and has no result file
+            the result file of a job forgotten by the scheduler (like a LSF job finished for more than an hour) makes it 'DONE', the
+            status of an array job is 'PEND' or 'RUN' while one of its elements is, 'EXIT' if one of its elements failed
+        → Arguments:
+            - job_names
+            - result_file: name of the file created by the job at its end, if None the status is the scheduler status only ('DONE' if
+                           the job exited without error)
+        """
+        command = '{}; echo {}; cd {} && for name in {}; do [ -e job_$name/{} ] && echo $name; done; true'.format(
+                      self.get_status_command(), status_separator, shlex.quote(self.jobs_path),
+                      ' '.join(shlex.quote(str(job_name)) for job_name in job_names), shlex.quote(result_file or '.'))
+        (scheduler_output, result_output) = self.run_remote(command).split(status_separator + '\n', 1)
+
+        scheduler_statuses = self.parse_statuses(scheduler_output)
+        finished_jobs = set(result_output.split())
+
+        statuses = {}
+        for job_name in job_names:
+            status = scheduler_statuses.get(str(job_name))
+            if status in ('PEND', 'RUN') or (result_file is None and status is not None):
+                statuses[job_name] = status
+            elif str(job_name) in finished_jobs:
+                statuses[job_name] = 'DONE'
+            else:
+                statuses[job_name] = 'UNKNOWN' if status is None else 'EXIT'
+
+        return statuses
+
+
+    def fetch(self, job_name, file_names, local_directory):
+        """
+        Copy files of the job directory to a local directory
+        → Arguments:
+            - job_name
+            - file_names     : names of the files in the job directory
+            - local_directory
+        """
+        self.copy_from_remote(['{}/{}'.format(self.get_job_path(job_name), name) for name in file_names], local_directory)
+
+
+    def get_existing_files(self, job_name, file_names):
+        """
+        Return the list of the given files which exist in the job directory, checked with one command
+        → Arguments:
+            - job_name
+            - file_names: names of the files in the job directory
+        """
+        command = 'cd {} && for name in {}; do [ -e $name ] && echo $name; done; true'.format(
+                      shlex.quote(self.get_job_path(job_name)), ' '.join(shlex.quote(name) for name in file_names))
+        existing_files = set(self.run_remote(command).split())
+
+        return [name for name in file_names if name in existing_files]
+
+
+    def remove(self, job_name):
+        """
+        Remove the job directory (the datasets are kept, they can be shared by other jobs)
+        """
+        self.run_remote('rm -f -r {}'.format(shlex.quote(self.get_job_path(job_name))))
+
+
+    def run_remote(self, command, stdin=None):
+        """
+        Run a bash command on the machine running the jobs and return its standard output
+        → Arguments:
+            - command
+            - stdin  : if specified, file object given as the standard input of the command
+        """
+        raise NotImplementedError
+
+
+    def copy_to_remote(self, local_path, remote_path):
+        raise NotImplementedError
+
+
+    def copy_from_remote(self, remote_paths, local_directory):
+        raise NotImplementedError
+
+
+    def launch(self, job_name, command, n_jobs, short_job, memory, array_size=None):
+        """
+        Launch the command (array_size times if specified) in the staged job directory and return the scheduler job id
+        """
+        raise NotImplementedError
+
+
+    def get_status_command(self):
+        """
+        Return the bash command printing the statuses of the jobs known by the scheduler
+        """
+        raise NotImplementedError
+
+
+    def parse_statuses(self, output):
+        """
+        Return the dictionary {job_name: status} read from the output of the command of get_status_command()
+        """
+        raise NotImplementedError
+
+
+def get_array_status(element_statuses):
+    """
+    Return the status of an array job from the statuses of its elements: 'RUN' or 'PEND' while an element runs or waits, then 'EXIT'
+    if an element failed, 'DONE' otherwise
+    """
+    for status in ('RUN', 'PEND', 'EXIT'):
+        if status in element_statuses:
+            return status
+
+    return 'DONE'
+
+
+class Lsf_Executor(Job_Executor):
+    """
+    This class runs the jobs on a LSF cluster through ssh and scp, the jobs being submitted with bsub
+    → Members:
+      - server_path  : ssh server like 'guilminp@selene.mskcc.org'
+      - jobs_path    : cluster path to the ssh_remote_jobs/ directory in the cloned impact-annotator_v2 repository
+      - setup_command: bash command setting up the LSF environment and the python virtualenv before bsub and bjobs
+      - hashes       : see Job_Executor
+    """
+
+    def __init__(self, server_path, jobs_path, setup_command=selene_setup_command):
+        super().__init__(jobs_path)
+        self.server_path   = server_path
+        self.setup_command = setup_command
+
+
+    def run_remote(self, command, stdin=None):
+        return subprocess.run(['ssh', self.server_path, command], stdin=stdin, stdout=subprocess.PIPE, check=True).stdout.decode()
+
+
+    def copy_to_remote(self, local_path, remote_path):
+        subprocess.run(['scp', local_path, '{}:{}'.format(self.server_path, remote_path)], check=True)
+
+
+    def copy_from_remote(self, remote_paths, local_directory):
+        subprocess.run(['scp'] + ['{}:{}'.format(self.server_path, path) for path in remote_paths] + [local_directory], check=True)
+
+
+    def get_bsub_command(self, job_name, command, n_jobs, short_job, memory, array_size=None):
+        """
+        Return the bsub command requesting n_jobs CPUs (5 per host) and memory GB per CPU, for each element of a job array of size
+        array_size if specified (like bsub -J "name[1-50]")
+        """
+        if array_size:
+            bsub_command = 'bsub -o job_output_%I.txt -J "{}[1-{}]"'.format(job_name, array_size)
+        else:
+            bsub_command = 'bsub -o job_output.txt -J {}'.format(job_name)
+        if short_job:
+            bsub_command += ' -We 59'
+        if n_jobs > 1:
+            if memory:
+                bsub_command += ' -n {} -R "span[ptile=5,mem={}]"'.format(n_jobs, memory)
+            else:
+                bsub_command += ' -n {} -R "span[ptile=5]"'.format(n_jobs)
+
+        # the command is quoted so that its variables (like $LSB_JOBINDEX) are expanded in the job, and not by the submitting shell
+        return bsub_command + ' ' + shlex.quote(command)
+
+
+    def launch(self, job_name, command, n_jobs, short_job, memory, array_size=None):
+        bsub_command = self.get_bsub_command(job_name, command, n_jobs, short_job, memory, array_size)
+        print('➞ bsub command used: $ ' + bsub_command)
+
+        output = self.run_remote('{}; cd {} && {}'.format(self.setup_command, shlex.quote(self.get_job_path(job_name)), bsub_command))
+        match = re.search(r'Job <(\d+)> is submitted', output)
+        if match is None:
+            raise RuntimeError('bsub failed: {}'.format(output))
+
+        return match.group(1)
+
+
+    def get_status_command(self):
+        # fixed columns separated by a delimiter, the whitespace-separated columns of bjobs -w shifting when EXEC_HOST is empty (like
+        # for a pending job)
+        return '{}; bjobs -a -noheader -o "jobid stat job_name delimiter=\'|\'" 2> /dev/null'.format(self.setup_command)
+
+
+    def parse_statuses(self, output):
+        # JOBID|STAT|JOB_NAME lines, the elements of an array job share its JOBID and are named name[index], the last submitted job of
+        # a name wins and the suspended jobs count as waiting or running
+        jobs = [fields for fields in (line.strip().split('|', 2) for line in output.splitlines()) if len(fields) == 3 and fields[0].isdigit()]
+        lsf_statuses = {'PSUSP': 'PEND', 'USUSP': 'RUN', 'SSUSP': 'RUN'}
+
+        element_statuses = {}
+        for fields in jobs:
+            job_name = re.sub(r'\[\d+\]$', '', fields[2])
+            element_statuses.setdefault((int(fields[0]), job_name), []).append(lsf_statuses.get(fields[1], fields[1]))
+
+        statuses = {}
+        for (job_id, job_name) in sorted(element_statuses):
+            statuses[job_name] = get_array_status(element_statuses[(job_id, job_name)])
+
+        return statuses
+
+
+# fake LSF commands of the Fake_Lsf_Executor, a job of the fake bsub is a background process and its state is kept in files
+fake_bsub_script = '''
+import os, re, sys, json, argparse, subprocess
+
+state_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'jobs')
+parser = argparse.ArgumentParser()
+for option in ('-o', '-J', '-We', '-n', '-R'):
+    parser.add_argument(option)
+parser.add_argument('command')
+args = parser.parse_args()
+
+# an array job name[1-n] has n elements named name[1], ..., name[n]
+match = re.match(r'(.*)\\[1-(\\d+)\\]$', args.J)
+(job_name, array_size) = (match.group(1), int(match.group(2))) if match else (args.J, None)
+
+job_id = len([name for name in os.listdir(state_path) if name.endswith('.json')]) + 1
+with open(os.path.join(state_path, '{}.json'.format(job_id)), 'w') as file:
+    json.dump({'job_id': job_id, 'job_name': job_name, 'array_size': array_size}, file)
+
+for index in (range(1, array_size + 1) if array_size else [0]):
+    exit_path = os.path.join(state_path, '{}_{}.exit'.format(job_id, index))
+    output_path = args.o.replace('%I', str(index))
+    # the job waits FAKE_LSF_PENDING_TIME seconds in the queue before running (its .start file telling that it runs)
+    start_path = os.path.join(state_path, '{}_{}.start'.format(job_id, index))
+    subprocess.Popen(['bash', '-c', 'sleep {}; touch {}; ({}) > {} 2>&1; echo $? > {}.tmp; mv {}.tmp {}'.format(
+                          os.environ.get('FAKE_LSF_PENDING_TIME', '0'), start_path, args.command, output_path, exit_path, exit_path, exit_path)],
+                     env=dict(os.environ, LSB_JOBINDEX=str(index)),
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+print('Job <{}> is submitted to queue <fake>.'.format(job_id))
+'''
+
+fake_bjobs_script = '''
+import os, re, json, argparse
+
+state_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'jobs')
+parser = argparse.ArgumentParser()
+for option in ('-a', '-w', '-noheader'):
+    parser.add_argument(option, action='store_true')
+parser.add_argument('-o')
+args = parser.parse_args()
+
+# -o "<columns> delimiter='<delimiter>'" prints the given columns, otherwise the bjobs -w layout is printed, in which a pending job has
+# an empty EXEC_HOST column
+if args.o:
+    match = re.match(r"(.*?)\\s*delimiter='(.*)'$", args.o)
+    (columns, delimiter) = (match.group(1).split(), match.group(2)) if match else (args.o.split(), ' ')
+else:
+    columns = ['jobid', 'user', 'stat', 'queue', 'from_host', 'exec_host', 'job_name', 'submit_time']
+    delimiter = ' '
+if not args.noheader:
+    print(delimiter.join(column.upper() for column in columns))
+
+for name in os.listdir(state_path):
+    if name.endswith('.json'):
+        with open(os.path.join(state_path, name)) as file:
+            job = json.load(file)
+        for index in (range(1, job['array_size'] + 1) if job['array_size'] else [0]):
+            exit_path = os.path.join(state_path, '{}_{}.exit'.format(job['job_id'], index))
+            if os.path.exists(exit_path):
+                with open(exit_path) as file:
+                    status = 'DONE' if file.read().strip() == '0' else 'EXIT'
+            elif os.path.exists(os.path.join(state_path, '{}_{}.start'.format(job['job_id'], index))):
+                status = 'RUN'
+            else:
+                status = 'PEND'
+            job_name = '{}[{}]'.format(job['job_name'], index) if job['array_size'] else job['job_name']
+            values = {'jobid': job['job_id'], 'user': 'user', 'stat': status, 'queue': 'fake', 'from_host': 'localhost',
+                      'exec_host': '' if status == 'PEND' else 'localhost', 'job_name': job_name, 'submit_time': 'Oct 18 16:36'}
+            print(delimiter.join(str(values[column]) for column in columns))
+'''
+
+
+class Fake_Lsf_Executor(Lsf_Executor):
+    """
+    This class is a stand-in of the Lsf_Executor for the tests: the same bash commands run on the local computer, the ssh and scp
+    commands being replaced by local copies and bsub and bjobs by fake commands running the jobs as background processes
+    → Members:
+      - jobs_path    : local directory standing for the cluster ssh_remote_jobs/ directory
+      - fake_lsf_path: directory holding the fake commands (bin/) and the states of their jobs (jobs/)
+      - pending_time : number of seconds each job waits in the fake queue (status 'PEND', empty EXEC_HOST) before running
+      - setup_command, hashes: see Lsf_Executor
+    """
+
+    is_local = True
+
+    def __init__(self, jobs_path, setup_command='true', pending_time=0):
+        super().__init__(None, os.path.abspath(jobs_path), setup_command)
+        self.fake_lsf_path = os.path.join(self.jobs_path, '.fake_lsf')
+        self.pending_time  = pending_time
+
+        for name in ('bin', 'jobs'):
+            os.makedirs(os.path.join(self.fake_lsf_path, name), exist_ok=True)
+        for (name, script) in (('bsub', fake_bsub_script), ('bjobs', fake_bjobs_script)):
+            path = os.path.join(self.fake_lsf_path, 'bin', name)
+            with open(path, 'w') as file:
+                file.write('#!{}\n'.format(sys.executable) + script)
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+
+    def run_remote(self, command, stdin=None):
+        environment = dict(os.environ, PATH=os.path.join(self.fake_lsf_path, 'bin') + os.pathsep + os.environ['PATH'],
+                           FAKE_LSF_PENDING_TIME=str(self.pending_time))
+        return subprocess.run(['bash', '-c', command], stdin=stdin, stdout=subprocess.PIPE, check=True, env=environment).stdout.decode()
+
+
+    def copy_to_remote(self, local_path, remote_path):
+        shutil.copyfile(local_path, remote_path)
+
+
+    def copy_from_remote(self, remote_paths, local_directory):
+        copy_files(remote_paths, local_directory)
+
+
+class Local_Executor(Job_Executor):
+    """
+    This class runs the jobs as processes of the local computer, at most max_workers jobs running at the same time, the others waiting
+    in a queue
+    A job whose local job directory is already <jobs_path>/job_<job_name> (jobs_path being the local ssh_remote_jobs/ directory) runs
+    in place, without any copy
+    → Members:
+      - jobs_path  : local path to the directory holding the job directories
+      - max_workers: maximum number of jobs running at the same time
+      - pool       : pool of threads, each one waiting for the process of a job
+      - futures    : dictionary {job_name: futures of the return codes of the job processes (one per array element)} of the jobs
+                     submitted by this executor
+      - hashes     : see Job_Executor
+    """
+
+    is_local = True
+
+    def __init__(self, jobs_path, max_workers=1):
+        super().__init__(os.path.abspath(jobs_path))
+        self.max_workers = max_workers
+        self.pool        = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures     = {}
+
+
+    def run_remote(self, command, stdin=None):
+        return subprocess.run(['bash', '-c', command], stdin=stdin, stdout=subprocess.PIPE, check=True).stdout.decode()
+
+
+    def copy_to_remote(self, local_path, remote_path):
+        shutil.copyfile(local_path, remote_path)
+
+
+    def copy_from_remote(self, remote_paths, local_directory):
+        copy_files(remote_paths, local_directory)
+
+
+    def launch(self, job_name, command, n_jobs, short_job, memory, array_size=None):
+        if job_name in self.futures and not all(future.done() for future in self.futures[job_name]):
+            raise RuntimeError('The job {} is already submitted'.format(job_name))
+
+        def run_process(index):
+            output_name = 'job_output_{}.txt'.format(index) if array_size else 'job_output.txt'
+            return subprocess.run(['bash', '-c', 'cd {} && ({}) > {} 2>&1'.format(shlex.quote(self.get_job_path(job_name)), command, output_name)],
+                                  env=dict(os.environ, LSB_JOBINDEX=str(index))).returncode
+
+        self.futures[job_name] = [self.pool.submit(run_process, index) for index in (range(1, array_size + 1) if array_size else [0])]
+
+        return job_name
+
+
+    def get_status_command(self):
+        return 'true'
+
+
+    def parse_statuses(self, output):
+        statuses = {}
+        for (job_name, futures) in self.futures.items():
+            statuses[str(job_name)] = get_array_status(['RUN' if future.running() else 'PEND' if not future.done() else
+                                                        'DONE' if future.result() == 0 else 'EXIT' for future in futures])
+
+        return statuses
@@ -0,0 +1,187 @@
+import time
+import numpy as np
+
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+
+from fold_engine import take_rows, proba_score_functions, class_score_functions, predict_proba_and_class, Parallel, delayed
+
+
+def get_absolute_train_sizes(train_sizes, n_max):
+    """
+    Return the sorted unique numbers of training examples of the learning curves, like sklearn.model_selection.learning_curve()
+    → Ex: get_absolute_train_sizes([0.1, 0.5, 1.0], 1000) ⟹ [100, 500, 1000]
+    → Arguments:
+        - train_sizes: fractions (floats in (0, 1]) of the smallest train fold or numbers of training examples (integers)
+        - n_max      : number of examples of the smallest train fold
+    """
+    train_sizes = np.asarray(train_sizes)
+    if np.issubdtype(train_sizes.dtype, np.floating):
+        train_sizes = np.maximum((train_sizes * n_max).astype(int), 1)
+
+    if train_sizes.max() > n_max:
+        raise ValueError('The train sizes can\'t be larger than the smallest train fold ({} examples)'.format(n_max))
+
+    return np.unique(train_sizes)
+
+
+def get_nested_subsets(train_index, train_sizes, random_state=None):
+    """
+    Return the list of the train subsets of the given sizes, each subset containing the previous one
+    → Arguments:
+        - train_index : positions of the train fold
+        - train_sizes : sorted numbers of training examples
+        - random_state: if None the subsets are the first positions of the train fold (like sklearn), otherwise the train fold is
+                        shuffled with this seed first
+    """
+    if random_state is not None:
+        train_index = np.random.RandomState(random_state).permutation(train_index)
+
+    return [train_index[:train_size] for train_size in train_sizes]
+
+
+def get_final_estimator(estimator, X):
+    """
+    Return the final estimator of a fitted (possibly nested) pipeline and X transformed by the previous steps, the samplers (like
+    RandomUnderSampler) being skipped as they are at prediction time, a fitted search (like GridSearchCV) is replaced by its best
+    estimator
+    → Arguments:
+        - estimator: fitted sklearn estimator, pipeline or search
+        - X
+    """
+    while hasattr(estimator, 'steps') or hasattr(estimator, 'best_estimator_'):
+        if hasattr(estimator, 'best_estimator_'):
+            estimator = estimator.best_estimator_
+            continue
+
+        for (_, step) in estimator.steps[:-1]:
+            if step is None or step == 'passthrough' or hasattr(step, 'fit_resample') or hasattr(step, 'fit_sample'):
+                continue
+            X = step.transform(X)
+        estimator = estimator.steps[-1][1]
+
+    return estimator, X
+
+
+def iter_staged_predictions(estimator, X, n_estimators_list):
+    """
+    Yield the (n_estimators, y_proba_pred, y_class_pred) predictions of the first n_estimators members of a fitted ensemble for each
+    n_estimators of n_estimators_list, from one fit:
+        - boosting models (staged_predict_proba()): the predictions after each boosting stage
+        - forests (estimators_): the probabilities of the trees added one by one (the first n trees of a forest are the trees a forest
+                                 of n trees with the same random_state would grow, like with warm_start)
+    → Arguments:
+        - estimator        : fitted estimator or pipeline (see get_final_estimator())
+        - X
+        - n_estimators_list: sorted list of ensemble sizes, the largest one being at most the fitted number of members
+    """
+    estimator, X = get_final_estimator(estimator, X)
+    n_estimators_list = sorted(n_estimators_list)
+
+    if hasattr(estimator, 'staged_predict_proba'):
+        stages = estimator.staged_predict_proba(X)
+    elif hasattr(estimator, 'estimators_'):
+        def get_stages():
+            probas_sum = 0
+            for tree in estimator.estimators_:
+                probas_sum = probas_sum + tree.predict_proba(X)
+                yield probas_sum
+        stages = get_stages()
+    else:
+        raise ValueError('{} has neither staged_predict_proba() nor estimators_'.format(type(estimator).__name__))
+
+    wanted = set(n_estimators_list)
+    for (n_estimators, probas) in enumerate(stages, 1):
+        if n_estimators in wanted:
+            # the sum of the tree probabilities has the argmax of their mean
+            yield n_estimators, probas[:, 1] / probas.sum(axis=1), estimator.classes_[np.argmax(probas, axis=1)]
+            if n_estimators == n_estimators_list[-1]:
+                return
+
+    raise ValueError('The ensemble has less than {} members'.format(n_estimators_list[-1]))
+
+
+def get_score(score_name, estimator, X, y, y_proba_pred, y_class_pred):
+    """
+    Return a single-value score computed from the predicted probability or class arrays if possible, with the sklearn scorer otherwise
+    """
+    if score_name in proba_score_functions:
+        return proba_score_functions[score_name](y, y_proba_pred)
+    elif score_name in class_score_functions:
+        return class_score_functions[score_name](y, y_class_pred)
+    elif estimator is not None:
+        return get_scorer(score_name)(estimator, X, y)
+    else:
+        raise ValueError('The score {} can\'t be computed from the staged predictions'.format(score_name))
+
+
+def fit_and_score_subset(model, X, y, train_index, test_index, scoring, n_estimators_list=None):
+    """
+    Fit a copy of the model on a train subset and return a dictionary holding the fit_time and the train_scores and test_scores arrays,
+    one score per n_estimators if n_estimators_list is given (see iter_staged_predictions()), a single one otherwise
+    → Arguments:
+        - model
+        - X
+        - y
+        - train_index      : positions of the train subset
+        - test_index       : positions of the test fold
+        - scoring          : name of the single-value score
+        - n_estimators_list: if specified, ensemble sizes scored from the one fit of the model
+    """
+    (X_train, X_test) = (take_rows(X, train_index), take_rows(X, test_index))
+    (y_train, y_test) = (np.asarray(take_rows(y, train_index)), np.asarray(take_rows(y, test_index)))
+
+    start = time.time()
+    estimator = clone(model).fit(X_train, y_train)
+    result = {'fit_time': time.time() - start}
+
+    for (set_name, X_set, y_set) in (('train', X_train, y_train), ('test', X_test, y_test)):
+        if n_estimators_list is None:
+            y_proba_pred, y_class_pred = predict_proba_and_class(estimator, X_set)
+            scores = [get_score(scoring, estimator, X_set, y_set, y_proba_pred, y_class_pred)]
+        else:
+            scores = [get_score(scoring, None, X_set, y_set, y_proba_pred, y_class_pred)
+                      for (_, y_proba_pred, y_class_pred) in iter_staged_predictions(estimator, X_set, n_estimators_list)]
+        result['{}_scores'.format(set_name)] = np.array(scores)
+
+    return result
+
+
+def run_learning_curves(model, X, y, splits, train_sizes, scoring='roc_auc', n_jobs=1, n_estimators_list=None, random_state=None):
+    """
+    Run the (train size, fold) grid of the learning curves in parallel, each fold train set being cut into nested subsets
+    Return the (absolute train sizes, train scores, test scores) tuple, the scores arrays being of size
+    n_train_sizes x n_folds, or n_train_sizes x n_estimators x n_folds if n_estimators_list is given
+    → Arguments:
+        - model
+        - X                : features matrix, can be a memory-mapped matrix shared by the workers (see shared_data.py)
+        - y
+        - splits           : list of the (train_index, test_index) cross-validation splits
+        - train_sizes      : see get_absolute_train_sizes()
+        - scoring          : name of the single-value score
+        - n_jobs           : number of jobs
+        - n_estimators_list: if specified, ensemble sizes scored from each fit (see iter_staged_predictions())
+        - random_state     : see get_nested_subsets()
+    """
+    if n_estimators_list is not None:
+        n_estimators_list = sorted(n_estimators_list)
+
+    train_sizes = get_absolute_train_sizes(train_sizes, min(len(train_index) for (train_index, _) in splits))
+    subsets = [get_nested_subsets(train_index, train_sizes, random_state) for (train_index, _) in splits]
+
+    units = [(size_number, fold_number) for size_number in range(len(train_sizes)) for fold_number in range(len(splits))]
+    results = Parallel(n_jobs=n_jobs)(delayed(fit_and_score_subset)(model, X, y, subsets[fold_number][size_number],
+                                                                    splits[fold_number][1], scoring, n_estimators_list)
+                                      for (size_number, fold_number) in units)
+
+    n_scores = 1 if n_estimators_list is None else len(n_estimators_list)
+    train_scores = np.zeros((len(train_sizes), n_scores, len(splits)))
+    test_scores  = np.zeros((len(train_sizes), n_scores, len(splits)))
+    for ((size_number, fold_number), result) in zip(units, results):
+        train_scores[size_number, :, fold_number] = result['train_scores']
+        test_scores[size_number, :, fold_number]  = result['test_scores']
+
+    if n_estimators_list is None:
+        (train_scores, test_scores) = (train_scores[:, 0, :], test_scores[:, 0, :])
+
+    return train_sizes, train_scores, test_scores
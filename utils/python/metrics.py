@@ -3,10 +3,18 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as seaborn
 
-from sklearn.metrics import roc_curve, precision_recall_curve, confusion_matrix
-from sklearn.model_selection import cross_validate, learning_curve
 import time
 from custom_tools import *
+from fold_engine import run_folds
+from fold_units import run_fold_units
+from fold_store import Fold_Store, get_fingerprint
+from split_plan import Split_Plan, get_splits_fingerprint
+from shared_data import shared_features_matrix
+from learning_curves import run_learning_curves
+from fold_importance import get_column_groups, run_fold_importances
+from columnar_metrics import save_columnar_metrics, read_metrics, read_metrics_attributes
+from curves import (get_roc_curve, get_precision_recall_curve, get_confusion_tensors, get_threshold_scores,
+                   get_interpolated_curves)
 
 class Metrics():
     """
@@ -16,44 +24,78 @@ class Metrics():
       - number_of_folds: number of fold of the cross-validation
       - metrics        : pandas DataFrame of size number_of_folds x number_of_metrics, holds all the relevant metrics for each fold, the columns are:
             - fit_time, score_time                 : time to fit/score in seconds
-            - estimator                            : model fitted on the train test
+            - estimator                            : model fitted on the train test, only kept if keep_estimators is True
             - train_<score_name>, test_<score_name>: train and test single-value scores
-            - gs_best_parameters, gs_cv_results    : holds grid-search metrics if one was performed, NA otherwise
+            - gs_best_parameters, gs_cv_results    : holds grid-search metrics if one was performed (GridSearchCV or
+                                                     Staged_Grid_Search_CV or Halving_Grid_Search_CV model), NA otherwise
             - y_test                               : the y array of the test test
             - y_proba_pred, y_class_pred           : the predicted probability and class for each entry of y_test
-            - test_fpr, test_tpr, roc_thresh       : metrics to plot roc curve
-            - precision, recall, pr_thresh         : metrics to plot precision-recall curve
+            the ROC and precision-recall curves are not stored, see get_curve()
       - model          : sklearn model
       - groups         : data groups array if they exist
-      - X              : features matrix of size n_samples x n_features
+      - X              : features matrix of size n_samples x n_features, can be a pandas DataFrame or a scipy.sparse matrix
+      - feature_names  : names of the columns of X, only needed if X is not a pandas DataFrame
       - y              : target array of size n_samples
-      - cv_strategy    : sklearn cross-validation strategy
+      - cv_strategy    : sklearn cross-validation strategy or Split_Plan
       - n_jobs         : number of jobs
+      - keep_estimators: if True the fitted estimators are kept in the 'estimator' column
+      - checkpoint_path: if not None, path to the directory where each fold is checkpointed as soon as it is done
+      - share_X        : if True and n_jobs > 1, X is dumped once to a memory-mapped file shared by all the workers (as a numpy
+                         array or a CSR matrix, so the model must not select the columns of a DataFrame by name)
+      - shared_X_path  : directory holding the memory-mapped X, by default the system temporary directory
+      - curve_grid_size: if None the curves have one point per distinct predicted probability, otherwise they are computed on
+                         curve_grid_size evenly spaced thresholds
+      - curves         : dictionary {(curve_name, fold_number or threshold): curve} of the curves and confusion matrices computed so far
+      - splits         : list of the (train_index, test_index) cross-validation splits, see get_splits()
+      - split_fingerprint: fingerprint of the cross-validation splits (see get_splits_fingerprint()) set when the model is run, so that
+                           two Metrics can be checked to be evaluated on the same folds; only saved by save() in the columnar format,
+                           None if unknown
+      the metrics DataFrame also holds a permutation_importance_<score_name>_<random_state> column once get_permutation_importance() is called
       - lc_train_sizes, lc_train_scores, lc_test_scores: only if get_learning_curves_metrics() is called, stores the learning curves metrics
+      - lc_n_estimators, lc_staged_train_scores, lc_staged_test_scores: only if get_learning_curves_metrics() is called with n_estimators_list
     """
 
     default_scoring_metrics = ['average_precision', 'roc_auc', 'precision', 'recall', 'f1', 'accuracy']
 
     def __init__(self, model=None, X=None, y=None, cv_strategy=None, groups=None, scoring=default_scoring_metrics, n_jobs=1,
-                 run_model=True, read_from_pkl=False, path=None):
+                 run_model=True, read_from_pkl=False, path=None, keep_estimators=False, checkpoint_path=None, feature_names=None,
+                 share_X=False, shared_X_path=None, curve_grid_size=None):
         """
         Create the Metrics object
         → Arguments:
-            - model        : can be a pipeline object
+            - model          : can be a pipeline object
             - X
             - y
-            - cv_strategy
-            - groups       : can be left to None if cv_strategy doesn't implement GroupFold or similar
+            - cv_strategy    : sklearn cross-validation strategy, or Split_Plan (or path to a split plan file, see split_plan.py) so that
+                               the splits are computed once and shared by every Metrics and job
+            - groups         : can be left to None if cv_strategy doesn't implement GroupFold or similar
             - scoring
             - n_jobs
-            - run_model    : if set to False, doesn't run the model
-            - read_from_pkl: if set to True, read the metrics from a .pkl
-            - path         : path to the .pkl if read_from_pkl is True
-        """
-
-        self.scoring = scoring
+            - run_model      : if set to False, doesn't run the model
+            - read_from_pkl  : if set to True, read the metrics from a .pkl (columnar file written by save() or pickled DataFrame)
+            - path           : path to the .pkl if read_from_pkl is True
+            - keep_estimators: if True keep the fitted estimators in the 'estimator' column (they can be quite memory-expensive)
+            - checkpoint_path: if specified, each fold is saved in this directory as soon as it is done, running again the same
+                               model on the same data and cross-validation splits only computes the folds not saved yet
+            - feature_names  : if X is a scipy.sparse matrix, names of its columns (see Impact_Wrapper.feature_names)
+            - share_X        : if True and n_jobs > 1, X is dumped once to a memory-mapped file (dense .npy or CSR data/indices/indptr
+                               arrays) and the workers select their folds from zero-copy views, instead of each worker unpickling
+                               its own copy of X; the workers then receive a numpy array or a CSR matrix instead of a DataFrame,
+                               so it can't be used with a model selecting the columns by name (like a ColumnTransformer on
+                               string columns)
+            - shared_X_path  : directory where X is dumped, by default the system temporary directory (a node-local disk or /dev/shm
+                               is best)
+            - curve_grid_size: if specified, the ROC and precision-recall curves are downsampled to this number of thresholds (1001 keeps
+                               the plots accurate for a fraction of the memory of the full-resolution curves of large test folds)
+        """
+
+        self.scoring         = scoring
+        self.curve_grid_size = curve_grid_size
+        self.curves          = {}
 
         if not read_from_pkl:
+            if isinstance(cv_strategy, str):
+                cv_strategy = Split_Plan(cv_strategy)
             self.number_of_folds = cv_strategy.get_n_splits()
 
             # create the metrics DataFrame
@@ -62,23 +104,29 @@ class Metrics():
                                                 ['train_{}'.format(score_name) for score_name in self.scoring] +
                                                 ['test_{}'.format(score_name)  for score_name in self.scoring] +
                                                 ['gs_best_parameters', 'gs_cv_results'] + 
-                                                ['y_test', 'y_proba_pred', 'y_class_pred',
-                                                 'test_fpr', 'test_tpr', 'roc_thresh',
-                                                 'precision', 'recall', 'pr_thresh'])
+                                                ['y_test', 'y_proba_pred', 'y_class_pred'])
             self.metrics.index.name = 'fold_number'
 
-            self.model       = model
-            self.X           = X
-            self.y           = y
-            self.cv_strategy = cv_strategy
-            self.groups      = groups
-            self.n_jobs      = n_jobs
+            self.model           = model
+            self.X               = X
+            self.y               = y
+            self.cv_strategy     = cv_strategy
+            self.groups          = groups
+            self.n_jobs          = n_jobs
+            self.keep_estimators = keep_estimators
+            self.checkpoint_path = checkpoint_path
+            self.share_X         = share_X
+            self.shared_X_path   = shared_X_path
+            self.splits          = None
+            self.split_fingerprint = None
+            self.feature_names   = feature_names if feature_names is not None else getattr(X, 'columns', None)
 
             if run_model:
                 self.run_model()
         else:
-            self.metrics = pd.read_pickle(path)
+            self.metrics = read_metrics(path)
             self.number_of_folds = self.metrics.shape[0]
+            self.split_fingerprint = read_metrics_attributes(path).get('split_fingerprint')
 
 
     def display(self):
@@ -95,13 +143,20 @@ class Metrics():
         return self.metrics
 
 
-    def save(self, path='metrics.pkl'):
+    def save(self, path='metrics.pkl', columnar=False):
         """
         Save self.metrics to a .pkl
         → Arguments:
-            - path: string specifying the path to the .pkl file
-        """
-        self.metrics.to_pickle(path)
+            - path    : string specifying the path to the .pkl file
+            - columnar: if True, the fold arrays (y_test, y_proba_pred, curves...) are stored as flat float32 or bool buffers which are
+                        memory-mapped when read back (see columnar_metrics.py), otherwise self.metrics is pickled; a columnar file can
+                        only be read with read_from_pkl=True (not with pd.read_pickle()), so it is better given its own extension
+                        (like 'metrics.columnar')
+        """
+        if columnar:
+            save_columnar_metrics(self.metrics, path, {'split_fingerprint': self.split_fingerprint})
+        else:
+            self.metrics.to_pickle(path)
 
 
     def run_model(self):
@@ -111,53 +166,105 @@ class Metrics():
         print('Run model...', end='')
         start = time.time()
 
-        # get cross validation metrics
-        results = cross_validate(self.model, self.X, self.y, groups=self.groups, cv=self.cv_strategy, scoring=self.scoring,
-                                 return_train_score=True, return_estimator=True, n_jobs=self.n_jobs, error_score='raise')
-        self.metrics.update(pd.DataFrame(results))
+        # fit, predict and score every fold in the same worker, the estimators are only sent back if self.keep_estimators is True
+        splits = self.get_splits()
 
-        # get grid search metrics if the model have performed a grid search
-        if hasattr(self.metrics.iloc[0]['estimator'], 'best_params_'):
-            self.metrics['gs_best_parameters'] = self.metrics['estimator'].apply(lambda x: x.best_params_)
-            self.metrics['gs_cv_results']      = self.metrics['estimator'].apply(lambda x: x.cv_results_)
+        # the fold store is identified by the model, the data and the cross-validation splits so that only the same experiment is resumed
+        if self.checkpoint_path:
+            fold_store = Fold_Store(self.checkpoint_path, get_fingerprint(self.model, self.X, self.y, splits, self.scoring))
+        else:
+            fold_store = None
 
-        # get ROC curve, PR curve and confusion matrix metrics
-        # WARNING: this implies re-testing the fitted model on the test folds
-        self._get_other_metrics()
+        with shared_features_matrix(self.X, self.n_jobs if self.share_X else 1, self.shared_X_path) as X:
+            results = run_folds(self.model, X, self.y, splits, self.scoring, n_jobs=self.n_jobs, return_estimator=self.keep_estimators,
+                                fold_store=fold_store)
+        self.set_fold_results(results)
 
-        # we remove the estimators from the metrics because they can be quite memory-expensive (for random forest with a lot of trees for example)
-        self.metrics.drop('estimator', axis=1, inplace=True)
+        print(' done! ({:.2f}s)'.format(time.time() - start))
+
+
+    def run_model_units(self, split_grid=True, runner=None):
+        """
+        Run the model like run_model(), the cross-validation being split in independent work units (see fold_units.py): one unit per
+        fold, or one per (fold, candidate) cell of the grid search if the model is a GridSearchCV (the cells of each fold are then
+        merged and the best candidate refitted on the train fold, like GridSearchCV does)
+        The units run on a local pool of n_jobs processes, or as array jobs with a runner, so that a large cross-validation uses the
+        cores of many cluster nodes; the self.metrics DataFrame is the one of run_model() (with split cells, the 'estimator' column
+        holds the refitted best estimator instead of the fitted GridSearchCV)
+        → Ex: runner = Array_Job_Runner(Lsf_Executor('guilminp@selene.mskcc.org', '/home/guilminp/impact-annotator_v2/analysis/prediction/artefact_classification/ssh_remote_jobs'),
+                                        job_name='GradientBoosting', local_jobs_path='../ssh_remote_jobs', memory=8)
+              metrics = Metrics(model, X, y, cv_strategy, run_model=False)
+              metrics.run_model_units(runner=runner)
+        → Arguments:
+            - split_grid: if True and the model is a GridSearchCV, its grid search is split in (fold, candidate) cells
+            - runner    : if specified, Array_Job_Runner object submitting the units of each phase as an array job, and waiting for it
+        """
+        print('Run model units...', end='')
+        start = time.time()
+
+        splits = self.get_splits()
+        fingerprint = get_fingerprint(self.model, self.X, self.y, splits, self.scoring) if runner is not None else None
+
+        # the array jobs load their own X, the local pool shares a memory-mapped X if share_X, like run_model()
+        with shared_features_matrix(self.X, self.n_jobs if (self.share_X and runner is None) else 1, self.shared_X_path) as X:
+            results = run_fold_units(self.model, X, self.y, splits, self.scoring, split_grid=split_grid,
+                                     return_estimator=self.keep_estimators, n_jobs=self.n_jobs, runner=runner, fingerprint=fingerprint)
+        self.set_fold_results(results)
 
         print(' done! ({:.2f}s)'.format(time.time() - start))
-    
 
-    def _get_other_metrics(self):
+
+    def get_splits(self):
         """
-        Compute the ROC curve, PR curve as well as the predicted probability and class arrays
+        Return the list of the (train_index, test_index) cross-validation splits, computed once so that every experiment run on this
+        Metrics object (folds, learning curves...) uses the same splits (read from the plan if cv_strategy is a Split_Plan, which checks
+        that y and groups are the ones the plan was made for)
         """
-        # for each fold
-        for i, (train_index, test_index) in enumerate(self.cv_strategy.split(self.X, self.y, groups=self.groups)):
-            (X_train, X_test) = (self.X.iloc[train_index], self.X.iloc[test_index])
-            (y_train, y_test) = (self.y.iloc[train_index], self.y.iloc[test_index])
+        if getattr(self, 'splits', None) is None:
+            self.splits = list(self.cv_strategy.split(self.X, self.y, groups=self.groups))
+
+        return self.splits
 
-            fold_metrics = self.metrics.iloc[i].copy(deep=False)
-            
-            # prediction metrics
-            fold_metrics['y_test']       = y_test.values
-            fold_metrics['y_proba_pred'] = fold_metrics['estimator'].predict_proba(X_test)[:,1]
-            fold_metrics['y_class_pred'] = fold_metrics['estimator'].predict(X_test)
 
-            # ROC metrics
-            fpr, tpr, roc_thresholds = roc_curve(fold_metrics['y_test'], fold_metrics['y_proba_pred'])
-            fold_metrics['test_fpr']   = fpr
-            fold_metrics['test_tpr']   = tpr
-            fold_metrics['roc_thresh'] = roc_thresholds
+    def set_fold_results(self, results):
+        """
+        Fill the self.metrics DataFrame from the fold metrics dictionaries computed outside of run_model() (see fold_engine.py)
+        → Arguments:
+            - results: list of the fold metrics dictionaries, in the fold order
+        """
+        self.metrics = pd.DataFrame(results, columns=self.metrics.columns)
+        self.metrics.index.name = 'fold_number'
+        self.split_fingerprint = get_splits_fingerprint(self.get_splits())
+        self.curves = {}
 
-            # precision-recall metrics
-            precision, recall, pr_thresholds = precision_recall_curve(fold_metrics['y_test'], fold_metrics['y_proba_pred'])
-            fold_metrics['precision'] = precision
-            fold_metrics['recall']    = recall
-            fold_metrics['pr_thresh'] = pr_thresholds
+        # we remove the estimators from the metrics because they can be quite memory-expensive (for random forest with a lot of trees for example)
+        if not self.keep_estimators:
+            self.metrics.drop('estimator', axis=1, inplace=True, errors='ignore')
+
+
+    def get_curve(self, curve_name, fold_number):
+        """
+        Return the ROC curve (fpr, tpr, thresholds) or the precision-recall curve (precision, recall, thresholds) of a fold, computed from
+        y_test and y_proba_pred the first time it is asked for (the curves stored in the metrics files of the previous versions are used
+        if they exist)
+        → Arguments:
+            - curve_name : 'roc' or 'precision_recall'
+            - fold_number
+        """
+        if (curve_name, fold_number) not in self.curves:
+            fold_metrics = self.metrics.loc[fold_number]
+            stored_columns = {'roc': ['test_fpr', 'test_tpr', 'roc_thresh'], 'precision_recall': ['precision', 'recall', 'pr_thresh']}[curve_name]
+
+            if self.curve_grid_size is None and all(column in fold_metrics.index for column in stored_columns):
+                curve = tuple(fold_metrics[column] for column in stored_columns)
+            elif curve_name == 'roc':
+                curve = get_roc_curve(fold_metrics['y_test'], fold_metrics['y_proba_pred'], self.curve_grid_size)
+            else:
+                curve = get_precision_recall_curve(fold_metrics['y_test'], fold_metrics['y_proba_pred'], self.curve_grid_size)
+
+            self.curves[(curve_name, fold_number)] = curve
+
+        return self.curves[(curve_name, fold_number)]
 
 
     def print_mean(self):
@@ -206,9 +313,10 @@ class Metrics():
                 print('  → best hyperparameters: {}'.format(fold_metrics['gs_best_parameters']))
 
                 if detailed_grid_search_metrics:
-                    for mean, std, param in zip(fold_metrics.gs_cv_results['mean_test_score'],
-                                                fold_metrics.gs_cv_results['std_test_score'],
-                                                fold_metrics.gs_cv_results['params']):
+                    grid_search_results = self.get_grid_search_results(i)
+                    for mean, std, param in zip(grid_search_results['mean_test_score'],
+                                                grid_search_results['std_test_score'],
+                                                grid_search_results['params']):
                         print('     - {:.3f} ± {:.3f} for {}'.format(mean, std, param))
 
 
@@ -250,28 +358,27 @@ class Metrics():
         ax.set_ylim(-0.05, 1.05)
         
         mean_fpr = np.linspace(0, 1, 101) # [0, 0.01, 0.02, ..., 0.09, 1.0]
-        tprs = [] # true positive rate list for each fold
+        curves = [self.get_curve('roc', i) for i in self.metrics.index]
 
-        # for each fold
-        for i, fold_metrics in self.metrics.iterrows():
-            fpr, tpr, thresholds = fold_metrics['test_fpr'], fold_metrics['test_tpr'], fold_metrics['roc_thresh']
+        # because the length of fpr and tpr vary with the fold (size of thresholds  = nunique(y_pred[:, 1]) + 1), we can't just do
+        # fprs.append(fpr) and tprs.append(tpr)
+        # we use a linear interpolation to find the values of tpr for 101 chosen fpr values (mean_fpr), for all the folds at once
+        tprs = get_interpolated_curves([(fpr, tpr) for (fpr, tpr, _) in curves], mean_fpr)
+        tprs[:, 0] = 0.0 # threshold > 1 for the first point (ie the last tpr value, we correct the interpolation)
 
-            # because the length of fpr and tpr vary with the fold (size of thresholds  = nunique(y_pred[:, 1]) + 1), we can't just do
-            # fprs.append(fpr) and tprs.append(tpr)
-            # we use a linear interpolation to find the values of fpr for a 101 chosen tpr values (mean_fpr)
-            tprs.append(np.interp(mean_fpr, fpr, tpr))
-            tprs[-1][0] = 0.0 # threshold > 1 for the first point (ie the last tpr value, we correct the interpolation)
+        # for each fold
+        for i, (fpr, tpr, thresholds) in zip(self.metrics.index, curves):
 
             # plot ROC curve
             if show_folds_legend:
-                label = 'ROC fold %d (AUC = %0.3f)' % (i + 1, fold_metrics['test_roc_auc'])
+                label = 'ROC fold %d (AUC = %0.3f)' % (i + 1, self.metrics.loc[i, 'test_roc_auc'])
             else:
                 label = None
             plt = ax.plot(fpr, tpr, linewidth=0.6, alpha=0.4, label=label)
 
             # plot thresholds
             if plot_thresholds:
-                thresholds[0] = 1.001 # value is > 1, we set it just above one for the graphic style
+                thresholds = np.minimum(thresholds, 1.001) # the first value is > 1, we set it just above one for the graphic style
                 ax.plot(fpr, thresholds, linewidth=0.6, alpha=0.4, color=plt[0].get_color())
         
 
@@ -279,12 +386,12 @@ class Metrics():
         ax.plot([0, 1], [0, 1], '--r', linewidth=0.5, alpha=1, label='random')
 
         # plot mean ROC
-        mean_tpr = np.mean(tprs, axis=0)
+        mean_tpr = tprs.mean(axis=0)
         ax.plot(mean_fpr, mean_tpr, 'b', linewidth=2,
                 label='mean ROC (AUC = {:.3f} ± {:.3f})'.format(self.metrics['test_roc_auc'].mean(), self.metrics['test_roc_auc'].std()))
 
         # plot mean ROC std
-        std_tpr = np.std(tprs, axis=0)
+        std_tpr = tprs.std(axis=0)
         ax.fill_between(mean_fpr, mean_tpr - std_tpr, mean_tpr + std_tpr, color='blue', alpha=0.15,
                          label='mean ROC ± 1 std. dev.')
 
@@ -300,7 +407,7 @@ class Metrics():
         Plot Precision-Recall curve (PR) for each fold (and the associated threshold) and a mean PR curve
         Strongly inspired by self.plot_roc() method
         See https://classeval.wordpress.com/introduction/introduction-to-the-precision-recall-plot/
-        WARNING: for simplicity we use linear interpolation but this is wrong (cf. previous website)
+        The mean PR curve is the mean of the step-wise fold curves (no linear interpolation between the points, cf. previous website)
         → Arguments:
             - ax               : matplotlib axis object
             - fontsize         : size of the legend
@@ -321,29 +428,28 @@ class Metrics():
         ax.yaxis.set_tick_params(labelsize=fontsize)
         
         mean_recall = np.linspace(0, 1, 101) # [0, 0.01, 0.02, ..., 0.09, 1.0]
-        precisions = [] # precision value list for each fold
+        curves = []
+
+        # correct first point precision to make a horizontal line between first and second point
+        # from the sklearn documentation: "The last precision and recall values are 1. and 0. respectively and do not have a corresponding
+        # threshold. This ensures that the graph starts on the y axis."
+        # this methodology is advised by the website quoted in the main method comment
+        for i in self.metrics.index:
+            precision, recall, thresholds = self.get_curve('precision_recall', i)
+            curves.append((np.concatenate([precision[:-1], precision[-2:-1]]), recall, thresholds))
+
+        # because the length of precision and recall vary with the fold (size of thresholds  = nunique(y_pred[:, 1]) + 1), we can't just do
+        # precisions.append(precision) and recalls.append(recall)
+        # we take the step-wise precision of every fold at 101 chosen recall values, for all the folds at once
+        # the documentation for np.searchsorted asks the curves to be sorted, these explains the need to do [::-1] for both recall and precision
+        precisions = get_interpolated_curves([(recall[::-1], precision[::-1]) for (precision, recall, _) in curves], mean_recall, step=True)
 
         # for each fold
-        for i, fold_metrics in self.metrics.iterrows():
-            precision, recall, thresholds = fold_metrics['precision'], fold_metrics['recall'], fold_metrics['pr_thresh']
-            
-            # correct first point precision to make a horizontal line between first and second point
-            # from the sklearn documentation: "The last precision and recall values are 1. and 0. respectively and do not have a corresponding
-            # threshold. This ensures that the graph starts on the y axis."
-            # this methodology is advised by the website quoted in the main method comment
-            precision[-1] = precision[-2]
-
-            # because the length of precision and recall vary with the fold (size of thresholds  = nunique(y_pred[:, 1]) + 1), we can't just do
-            # precisions.append(precision) and recalls.append(recall)
-            # we use a linear interpolation to find the values of precision for a 101 chosen recall values
-            # WARNING: this is wrong, this choice has been made for simplicity
-            # Also, the documentation for np.interp asks the coordinates where we want to interpolate the values to be sorted, these explains the need to do [::-1]
-            # for both recall and precision
-            precisions.append(np.interp(mean_recall, recall[::-1], precision[::-1]))
+        for i, (precision, recall, thresholds) in zip(self.metrics.index, curves):
 
             # plot PR curve
             if show_folds_legend:
-                label = 'PR fold %d (AP = %0.3f)' % (i + 1, fold_metrics['test_average_precision'])
+                label = 'PR fold %d (AP = %0.3f)' % (i + 1, self.metrics.loc[i, 'test_average_precision'])
             else:
                 label = None
             plt = ax.plot(recall, precision, linewidth=0.6, alpha=0.4, label=label)
@@ -354,18 +460,17 @@ class Metrics():
                 ax.plot(recall[:-1], thresholds, linewidth=0.6, alpha=0.4, color=plt[0].get_color())
             
         # plot baseline (see website)
-        positive_number = self.metrics['y_test'].apply(lambda x: sum(x)).sum()
-        negative_number = self.metrics['y_test'].apply(lambda x: sum(~x)).sum()
+        positive_number, negative_number = (numbers.sum() for numbers in self.get_class_numbers())
         positive_proportion = positive_number / (positive_number + negative_number)
         ax.plot([0, 1], [positive_proportion, positive_proportion], '--r', linewidth=0.5, alpha=1, label='random')
  
         # plot mean PR
-        mean_precision = np.mean(precisions, axis=0)
+        mean_precision = precisions.mean(axis=0)
         ax.plot(mean_recall, mean_precision, 'b', linewidth=2,
                 label='mean PR (AP = {:.3f} ± {:.3f})'.format(self.metrics['test_average_precision'].mean(), self.metrics['test_average_precision'].std()))
 
         # plot mean PR std
-        std_precision = np.std(precisions, axis=0)
+        std_precision = precisions.std(axis=0)
         ax.fill_between(mean_recall, mean_precision - std_precision, mean_precision + std_precision, color='blue', alpha=0.15,
                          label='mean PR ± 1 std. dev.')
 
@@ -405,23 +510,79 @@ class Metrics():
 
     def get_confusion_matrix(self, threshold):
         """
-        Return a list of confusion matrix for each fold
+        Return a list of confusion matrix for each fold, computed the first time they are asked for at this threshold
         → Arguments:
             - threshold: the probability threshold at which we want to compute the confusion matrices 
         """
-        cms = []
+        if ('confusion_matrix', threshold) in self.curves:
+            return self.curves[('confusion_matrix', threshold)]
 
-        for i, fold_metrics in self.metrics.iterrows():
-            if threshold == 0.5:
-                y_pred = fold_metrics['y_class_pred']
-            else:
-                y_pred = (fold_metrics['y_proba_pred'] >= threshold)
-            # we use [::-1][:,::-1] to invert axes and plot the usual confusion matrix (not the sklearn one)
-            cms.append(confusion_matrix(fold_metrics['y_test'], y_pred)[::-1][:,::-1])
+        if threshold == 0.5:
+            # predicted classes of the model
+            (y_tests, y_class_preds) = ([np.asarray(y, dtype=bool) for y in self.metrics[column]] for column in ('y_test', 'y_class_pred'))
+            TP = np.array([[np.count_nonzero(y_test & y_class_pred)]  for (y_test, y_class_pred) in zip(y_tests, y_class_preds)])
+            FP = np.array([[np.count_nonzero(~y_test & y_class_pred)] for (y_test, y_class_pred) in zip(y_tests, y_class_preds)])
+            (positive_numbers, negative_numbers) = self.get_class_numbers()
+            (TN, FN) = (negative_numbers[:, np.newaxis] - FP, positive_numbers[:, np.newaxis] - TP)
+        else:
+            TP, FP, TN, FN = self.get_confusion_tensors([threshold])
 
+        # usual confusion matrix layout (not the sklearn one): [[TP, FN], [FP, TN]]
+        cms = [np.array([[TP[i, 0], FN[i, 0]], [FP[i, 0], TN[i, 0]]]) for i in range(self.number_of_folds)]
+
+        self.curves[('confusion_matrix', threshold)] = cms
         return cms
 
 
+    def get_class_numbers(self):
+        """
+        Return the (positive numbers, negative numbers) arrays of the test set of each fold, computed the first time they are asked for
+        """
+        if ('class_numbers', None) not in self.curves:
+            positive_numbers = np.array([np.count_nonzero(np.asarray(y_test, dtype=bool)) for y_test in self.metrics['y_test']])
+            self.curves[('class_numbers', None)] = (positive_numbers, self.metrics['y_test'].map(len).values - positive_numbers)
+
+        return self.curves[('class_numbers', None)]
+
+
+    def get_confusion_tensors(self, thresholds):
+        """
+        Return the (TP, FP, TN, FN) arrays of size number_of_folds x n_thresholds of the predictions y_proba_pred >= threshold for each
+        threshold (see curves.get_confusion_tensors())
+        → Arguments:
+            - thresholds: array of probability thresholds
+        """
+        return get_confusion_tensors(self.metrics['y_test'], self.metrics['y_proba_pred'], thresholds)
+
+
+    def get_threshold_scores(self, thresholds=np.linspace(0, 1, 101)):
+        """
+        Return a pandas DataFrame of the TP, FP, TN, FN, precision, recall and f1 of each fold (rows) at each threshold (columns)
+        → Ex: metrics.get_threshold_scores()['f1'].mean()  ⟹  mean f1 over the folds at each threshold
+        → Arguments:
+            - thresholds: array of probability thresholds
+        """
+        TP, FP, TN, FN = self.get_confusion_tensors(thresholds)
+        scores = dict({'TP': TP, 'FP': FP, 'TN': TN, 'FN': FN}, **get_threshold_scores(TP, FP, TN, FN))
+
+        return pd.concat({score_name: pd.DataFrame(values, index=self.metrics.index, columns=pd.Index(thresholds, name='threshold'))
+                          for (score_name, values) in scores.items()}, axis=1)
+
+
+    def get_best_threshold(self, score_name='f1', thresholds=np.linspace(0, 1, 101)):
+        """
+        Return the (threshold, mean score, std score) of the threshold maximizing the mean score over the folds
+        → Arguments:
+            - score_name: 'precision', 'recall' or 'f1'
+            - thresholds: array of probability thresholds
+        """
+        thresholds = np.asarray(thresholds)
+        scores = get_threshold_scores(*self.get_confusion_tensors(thresholds))[score_name]
+        best_index = np.argmax(scores.mean(axis=0))
+
+        return thresholds[best_index], scores[:, best_index].mean(), scores[:, best_index].std(ddof=1)
+
+
     def plot_confusion_matrix(self, figsize=(20, 3), fontsize=12, threshold=0.5):
         """
         Plot confusion matrix for each fold
@@ -491,6 +652,24 @@ class Metrics():
         plt.xlabel('Predicted', fontsize=fontsize)
 
 
+    def get_grid_search_results(self, fold_number):
+        """
+        Return the grid search results of a fold as a pandas DataFrame with one row per hyperparameters set, for a successive halving
+        search (Halving_Grid_Search_CV, whose results have one row per hyperparameters set and iteration) only the last iteration of
+        each hyperparameters set is kept
+        → Arguments:
+            - fold_number
+        """
+        grid_search_results = pd.DataFrame(self.metrics.iloc[fold_number]['gs_cv_results'])
+
+        # the rows are in the iterations order
+        if 'iter' in grid_search_results.columns:
+            params_keys = grid_search_results['params'].map(lambda params: str(sorted(params.items())))
+            grid_search_results = grid_search_results[~params_keys.duplicated(keep='last')].reset_index(drop=True)
+
+        return grid_search_results
+
+
     def plot_grid_search_results(self, plot_error_bar=True):
         """
         For each hyperparameter p, plot a subplot made of multiple scatter plots (one for each fold) with for each scatter plot:
@@ -509,7 +688,7 @@ class Metrics():
         # print the parameters grid
         max_param_name_length = max([len(p) for p in hyper_parameters])
         for p in hyper_parameters:
-            print('  → {}: {}'.format(p.ljust(max_param_name_length), np.unique(self.metrics.iloc[0].gs_cv_results['param_{}'.format(p)])))
+            print('  → {}: {}'.format(p.ljust(max_param_name_length), np.unique(self.get_grid_search_results(0)['param_{}'.format(p)])))
 
         # print the best parameters for each fold
         print('Best hyperparameters for each fold:')
@@ -533,7 +712,7 @@ class Metrics():
             # for each fold
             for fold_number in range(self.number_of_folds):
                 # get the grid search results for this fold
-                fold_metric = pd.DataFrame(self.metrics.iloc[fold_number]['gs_cv_results'])
+                fold_metric = self.get_grid_search_results(fold_number)
 
                 # only keep the best hyperparameters values for this fold
                 for p in fix_parameters:
@@ -555,21 +734,36 @@ class Metrics():
             plt.legend(loc='lower right', prop={'size': 15})
 
 
-    def get_learning_curves_metrics(self, train_sizes=np.linspace(0.1, 1, 10), scoring='roc_auc', n_jobs=1):
+    def get_learning_curves_metrics(self, train_sizes=np.linspace(0.1, 1, 10), scoring='roc_auc', n_jobs=1, n_estimators_list=None,
+                                    random_state=None):
         """
         Get learning curves metrics.
+        The folds are the cross-validation splits of the model (see get_splits()), each train set is cut into nested subsets and the
+        (train size, fold) grid is run on n_jobs workers (sharing one memory-mapped X if share_X, see learning_curves.py)
         → Arguments:
-            - train_sizes: sizes of the train set
-            - scoring    : scoring metric to evaluate
-            - n_jobs     : number of jobs
+            - train_sizes      : sizes of the train set
+            - scoring          : scoring metric to evaluate
+            - n_jobs           : number of jobs
+            - n_estimators_list: for boosting models and forests, if specified the model is fitted once per (train size, fold) and every
+                                 ensemble size of the list is scored from this fit, the scores are stored in lc_staged_train_scores and
+                                 lc_staged_test_scores (n_train_sizes x n_estimators x n_folds), lc_train_scores and lc_test_scores
+                                 holding the scores of the largest ensemble
+            - random_state     : if specified the train sets are shuffled with this seed before being cut into nested subsets
         """
         print('Run learning curves computation...', end='')
         start = time.time()
 
         # get learning curves
-        self.lc_train_sizes, self.lc_train_scores, self.lc_test_scores = learning_curve(self.model, self.X, self.y,
-                                                                                        train_sizes=train_sizes, cv=self.cv_strategy,
-                                                                                        n_jobs=n_jobs, error_score='raise')
+        with shared_features_matrix(self.X, n_jobs if self.share_X else 1, self.shared_X_path) as X:
+            self.lc_train_sizes, train_scores, test_scores = run_learning_curves(self.model, X, self.y, self.get_splits(), train_sizes,
+                                                                                 scoring, n_jobs, n_estimators_list, random_state)
+
+        if n_estimators_list is None:
+            self.lc_train_scores, self.lc_test_scores = train_scores, test_scores
+        else:
+            self.lc_n_estimators = sorted(n_estimators_list)
+            self.lc_staged_train_scores, self.lc_staged_test_scores = train_scores, test_scores
+            self.lc_train_scores, self.lc_test_scores = train_scores[:, -1, :], test_scores[:, -1, :]
 
         print(' done! ({:.2f}s)'.format(time.time() - start))
 
@@ -603,6 +797,73 @@ class Metrics():
         plt.legend(loc='best', prop={'size': figsize[0] * 1.5})
 
 
+    def get_permutation_importance(self, score_name='roc_auc', categorical_features=(), n_repeats=5, random_state=0, n_jobs=1,
+                                   recompute=False):
+        """
+        Return a pandas DataFrame (column groups x folds) of the mean decrease of the test score of each fold estimator when a group of
+        columns is permuted, the dummy columns of a categorical feature being permuted together
+        The folds are computed in parallel from the fold estimators (no refit) and the results are cached in the
+        permutation_importance_<score_name>_<random_state> column of self.metrics (one column groups x repeats DataFrame per fold), so
+        they are saved with the metrics
+        → Arguments:
+            - score_name          : name of the single-value score
+            - categorical_features: names of the one-hot encoded features (see fold_importance.get_column_groups())
+            - n_repeats           : number of permutations of each column group
+            - random_state        : seed of the permutations (the importances don't depend on n_jobs)
+            - n_jobs              : number of jobs
+            - recompute           : if True the cached importances are computed again
+        """
+        column_name = 'permutation_importance_{}_{}'.format(score_name, random_state)
+        column_groups = get_column_groups(self.feature_names, categorical_features)
+
+        is_cached = column_name in self.metrics.columns and \
+                    all(list(importances.index) == list(column_groups) and importances.shape[1] == n_repeats for importances in self.metrics[column_name])
+
+        if recompute or not is_cached:
+            if 'estimator' not in self.metrics.columns:
+                raise ValueError('The fold estimators are needed, run the model with keep_estimators=True')
+
+            print('Run permutation importance...', end='')
+            start = time.time()
+
+            with shared_features_matrix(self.X, n_jobs if self.share_X else 1, self.shared_X_path) as X:
+                fold_importances = run_fold_importances(list(self.metrics['estimator']), X, self.y, self.get_splits(), column_groups,
+                                                        score_name, n_repeats, random_state, n_jobs)
+
+            self.metrics[column_name] = pd.Series([None] * self.number_of_folds, index=self.metrics.index, dtype=object)
+            for (fold_number, importances) in zip(self.metrics.index, fold_importances):
+                self.metrics.at[fold_number, column_name] = importances
+
+            print(' done! ({:.2f}s)'.format(time.time() - start))
+
+        return pd.DataFrame({fold_number: importances.mean(axis=1) for (fold_number, importances) in self.metrics[column_name].items()})
+
+
+    def plot_permutation_importance(self, score_name='roc_auc', categorical_features=(), figsize=(20, 8), **kwargs):
+        """
+        Plot the permutation importance of each column group (mean over the folds and standard deviation across the folds), see
+        get_permutation_importance()
+        → Arguments:
+            - score_name          : name of the single-value score
+            - categorical_features: names of the one-hot encoded features
+            - figsize             : figure size
+            - kwargs              : other arguments of get_permutation_importance()
+        """
+        importances = self.get_permutation_importance(score_name, categorical_features, **kwargs)
+        feature_importance = pd.DataFrame({'value': importances.mean(axis=1), 'fold_variability': importances.std(axis=1)})
+        feature_importance.sort_values(by='value', axis=0, inplace=True)
+
+        plt.figure(figsize=figsize)
+
+        plt.subplot(1, 2, 1)
+        feature_importance.tail(15).value.plot.barh(width=0.85, xerr=feature_importance.tail(15)['fold_variability'], linewidth=0)
+
+        plt.subplot(1, 2, 2)
+        feature_importance.value.plot.barh(width=0.85, xerr=feature_importance['fold_variability'], linewidth=0)
+        plt.xlabel('mean decrease of the test {}'.format(score_name))
+        plt.tight_layout()
+
+
     def plot_features_importance(self, random_forest=False, figsize=(20, 8), pipeline_step_index=None):
         """
         Plot features importance by fitting the model on the whole dataset
@@ -620,9 +881,9 @@ class Metrics():
         
         # get features importance
         if not pipeline_step_index:
-            feature_importance = pd.DataFrame({'value': self.model.feature_importances_.tolist()}, index=self.X.columns.tolist())
+            feature_importance = pd.DataFrame({'value': self.model.feature_importances_.tolist()}, index=list(self.feature_names))
         else:
-            feature_importance = pd.DataFrame({'value': self.model.steps[pipeline_step_index][1].feature_importances_.tolist()}, index=self.X.columns.tolist())
+            feature_importance = pd.DataFrame({'value': self.model.steps[pipeline_step_index][1].feature_importances_.tolist()}, index=list(self.feature_names))
         feature_importance.sort_values(by='value', axis=0, inplace=True)
         
         # get inter tree variability of the feature importance score
@@ -0,0 +1,80 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from contextlib import contextmanager
+
+from impact_wrapper import get_sparse_matrix
+
+
+def dump_memmap(X, path):
+    """
+    Save the features matrix X in the directory path and return a memory-mapped version of it: a read-only numpy memmap if X is dense,
+    a scipy.sparse CSR matrix whose data, indices and indptr arrays are memmaps otherwise
+    The joblib workers receive the memmaps as references to their file, so that all the workers of a node share one copy of X in the
+    page cache instead of unpickling their own copy
+    → Arguments:
+        - X   : pandas DataFrame (with dense or pandas sparse columns), numpy array or scipy sparse matrix
+        - path: path to an existing directory
+    """
+    if isinstance(X, pd.DataFrame) and any(hasattr(X.iloc[:, i].values, 'sp_index') for i in range(X.shape[1])):
+        # the pandas sparse columns (dummy features) are not densified, they are detected like in get_sparse_matrix() since
+        # pd.SparseDtype doesn't exist in pandas 0.23
+        X, _ = get_sparse_matrix(X)
+
+    if scipy.sparse.issparse(X):
+        X = X.tocsr()
+        for name in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(path, 'X_{}.npy'.format(name)), getattr(X, name))
+        description = {'format': 'csr', 'shape': list(X.shape)}
+    else:
+        np.save(os.path.join(path, 'X.npy'), np.ascontiguousarray(np.asarray(X, dtype=float)))
+        description = {'format': 'dense'}
+
+    with open(os.path.join(path, 'X.json'), 'w') as file:
+        json.dump(description, file)
+
+    return load_memmap(path)
+
+
+def load_memmap(path):
+    """
+    Return the memory-mapped features matrix saved by dump_memmap() in the directory path
+    → Arguments:
+        - path: path to the directory
+    """
+    with open(os.path.join(path, 'X.json')) as file:
+        description = json.load(file)
+
+    if description['format'] == 'csr':
+        arrays = [np.load(os.path.join(path, 'X_{}.npy'.format(name)), mmap_mode='r') for name in ('data', 'indices', 'indptr')]
+        return scipy.sparse.csr_matrix(tuple(arrays), shape=tuple(description['shape']), copy=False)
+    else:
+        return np.load(os.path.join(path, 'X.npy'), mmap_mode='r')
+
+
+@contextmanager
+def shared_features_matrix(X, n_jobs, directory=None):
+    """
+    Context manager giving the features matrix to send to the joblib workers: X dumped in a temporary directory and memory-mapped if
+    several jobs are used (see dump_memmap()), X itself otherwise, the temporary directory is removed when leaving the context
+    → Ex: with shared_features_matrix(X, n_jobs=25) as shared_X:
+              Parallel(n_jobs=25)(delayed(f)(shared_X, ...) for ...)
+    → Arguments:
+        - X
+        - n_jobs   : number of jobs
+        - directory: directory where the temporary directory is created, by default the system temporary directory
+    """
+    if n_jobs == 1:
+        yield X
+        return
+
+    path = tempfile.mkdtemp(prefix='shared_X_', dir=directory)
+    try:
+        yield dump_memmap(X, path)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
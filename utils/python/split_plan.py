@@ -0,0 +1,134 @@
+import hashlib
+import numpy as np
+
+from fold_store import update_hash_with_data
+
+
+def get_splits_fingerprint(splits):
+    """
+    Return a sha1 hexadecimal string identifying the cross-validation splits, two experiments with the same fingerprint are evaluated
+    on exactly the same folds (so that their fold scores can be compared with a paired test)
+    → Arguments:
+        - splits: list of (train_index, test_index) tuples
+    """
+    hash_object = hashlib.sha1()
+    for (train_index, test_index) in splits:
+        for index in (train_index, test_index):
+            update_hash_with_data(hash_object, np.asarray(index, dtype=np.int32))
+
+    return hash_object.hexdigest()
+
+
+def get_data_fingerprint(data):
+    """
+    Return a sha1 hexadecimal string identifying the values of y or groups (the index of a pandas Serie is ignored)
+    """
+    hash_object = hashlib.sha1()
+    update_hash_with_data(hash_object, np.asarray(data))
+
+    return hash_object.hexdigest()
+
+
+def save_split_plan(cv_strategy, X, y, groups=None, path='split_plan.npz'):
+    """
+    Compute the splits of a cross-validation strategy once and save them as a split plan file, return the Split_Plan
+    → Ex: save_split_plan(GroupKFold(n_splits=5), X, y, groups, 'split_plans/GroupKFold_5.npz')
+    → Arguments:
+        - cv_strategy: sklearn cross-validation strategy
+        - X
+        - y
+        - groups     : can be left to None if cv_strategy doesn't implement GroupFold or similar
+        - path       : path to the .npz file
+    """
+    splits = [(np.asarray(train_index, dtype=np.int32), np.asarray(test_index, dtype=np.int32))
+              for (train_index, test_index) in cv_strategy.split(X, y, groups=groups)]
+
+    # the indices of every split are concatenated in one int32 array per set, the offsets giving the bounds of each split
+    arrays = {}
+    for (i, set_name) in enumerate(('train', 'test')):
+        arrays['{}_indices'.format(set_name)] = np.concatenate([split[i] for split in splits])
+        arrays['{}_offsets'.format(set_name)] = np.cumsum([0] + [len(split[i]) for split in splits]).astype(np.int64)
+
+    with open(path, 'wb') as file:
+        np.savez(file, n_samples=len(y), y_fingerprint=get_data_fingerprint(y),
+                 groups_fingerprint=get_data_fingerprint(groups) if groups is not None else '',
+                 fingerprint=get_splits_fingerprint(splits), description=repr(cv_strategy), **arrays)
+
+    return Split_Plan(path)
+
+
+class Split_Plan():
+    """
+    This class implements a cross-validation split plan: the train and test indices of every split of a cross-validation strategy,
+    computed once by save_split_plan() and read from a compact .npz file (int32 indices) by every Metrics object and every job, so that
+    experiments run on the same plan are evaluated on exactly the same folds
+    It can be given to Metrics as cv_strategy, split() checking that y and groups are the ones the plan was made for
+    → Members:
+      - path            : path to the .npz file
+      - n_samples         : number of samples of y
+      - y_fingerprint     : fingerprint of y, see get_data_fingerprint()
+      - groups_fingerprint: fingerprint of the groups, '' if the plan was made without groups
+      - fingerprint       : fingerprint of the splits, see get_splits_fingerprint()
+      - description       : repr of the cross-validation strategy the plan was made with
+      - train_indices, test_indices, train_offsets, test_offsets: concatenated indices of the splits and bounds of each split
+    """
+
+    def __init__(self, path):
+        """
+        Read the split plan saved at the given path
+        → Arguments:
+            - path: path to the .npz file written by save_split_plan()
+        """
+        self.path = path
+
+        with np.load(path) as plan:
+            self.n_samples          = int(plan['n_samples'])
+            self.y_fingerprint      = str(plan['y_fingerprint'])
+            self.groups_fingerprint = str(plan['groups_fingerprint'])
+            self.fingerprint        = str(plan['fingerprint'])
+            self.description        = str(plan['description'])
+            self.train_indices      = plan['train_indices']
+            self.test_indices       = plan['test_indices']
+            self.train_offsets      = plan['train_offsets']
+            self.test_offsets       = plan['test_offsets']
+
+
+    def __repr__(self):
+        return 'Split_Plan({!r}: {})'.format(self.path, self.description)
+
+
+    def check_data(self, y, groups=None):
+        """
+        Raise a ValueError if y (and groups if given and the plan was made with groups) are not the ones the plan was made for
+        """
+        if len(y) != self.n_samples or get_data_fingerprint(y) != self.y_fingerprint:
+            raise ValueError('The split plan {} was made for another y'.format(self.path))
+        if groups is not None and self.groups_fingerprint and get_data_fingerprint(groups) != self.groups_fingerprint:
+            raise ValueError('The split plan {} was made for other groups'.format(self.path))
+
+
+    def get_split(self, split_number):
+        """
+        Return the (train_index, test_index) int32 arrays of a split
+        """
+        return (self.train_indices[self.train_offsets[split_number]:self.train_offsets[split_number + 1]],
+                self.test_indices[self.test_offsets[split_number]:self.test_offsets[split_number + 1]])
+
+
+    def split(self, X=None, y=None, groups=None):
+        """
+        Yield the (train_index, test_index) splits of the plan, like the split() method of the sklearn cross-validation strategies
+        → Arguments:
+            - X     : unused, kept for compatibility
+            - y     : if specified, checked against the plan (see check_data())
+            - groups: if specified and the plan was made with groups, checked against the plan (they are not needed to split)
+        """
+        if y is not None:
+            self.check_data(y, groups)
+
+        for split_number in range(self.get_n_splits()):
+            yield self.get_split(split_number)
+
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return len(self.test_offsets) - 1
@@ -0,0 +1,151 @@
+import time
+import numpy as np
+
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
+from sklearn.model_selection import ParameterGrid, check_cv
+
+from fold_engine import take_rows, Parallel, delayed
+from learning_curves import iter_staged_predictions, get_score
+
+
+def fit_and_score_staged(estimator, X, y, train_index, test_index, parameters, n_estimators_parameter, n_estimators_list, scoring,
+                         return_train_score):
+    """
+    Fit a copy of the estimator with the largest number of estimators on the train fold and return a dictionary holding the fit_time
+    and the test_scores (and train_scores) arrays of every number of estimators of n_estimators_list (see iter_staged_predictions())
+    → Arguments:
+        - estimator             : unfitted ensemble or pipeline whose final step is an ensemble
+        - X
+        - y
+        - train_index           : positions of the train fold
+        - test_index            : positions of the test fold
+        - parameters            : dictionary of the other hyperparameters
+        - n_estimators_parameter: name of the number of estimators hyperparameter, like 'gradientboostingclassifier__n_estimators'
+        - n_estimators_list     : sorted list of numbers of estimators
+        - scoring               : name of the single-value score
+        - return_train_score    : if True also score the train fold
+    """
+    (X_train, X_test) = (take_rows(X, train_index), take_rows(X, test_index))
+    (y_train, y_test) = (np.asarray(take_rows(y, train_index)), np.asarray(take_rows(y, test_index)))
+
+    start = time.time()
+    estimator = clone(estimator).set_params(**dict(parameters, **{n_estimators_parameter: n_estimators_list[-1]})).fit(X_train, y_train)
+    result = {'fit_time': time.time() - start}
+
+    for (set_name, X_set, y_set) in [('test', X_test, y_test)] + ([('train', X_train, y_train)] if return_train_score else []):
+        result['{}_scores'.format(set_name)] = np.array([get_score(scoring, None, X_set, y_set, y_proba_pred, y_class_pred) for
+                                                         (_, y_proba_pred, y_class_pred) in iter_staged_predictions(estimator, X_set, n_estimators_list)])
+
+    return result
+
+
+class Staged_Grid_Search_CV(BaseEstimator, ClassifierMixin):
+    """
+    This class implements a grid search over the hyperparameters of a boosting model or a forest (or a pipeline ending with one) in
+    which the number of estimators is not fitted separately: for each set of the other hyperparameters and each fold, the largest
+    ensemble is fitted once and every smaller number of estimators of the grid is scored from its staged predictions
+    It can be used as the model of a Metrics object like GridSearchCV: the best_params_ and cv_results_ (score versus number of
+    estimators for each set of the other hyperparameters) are stored in the gs_best_parameters and gs_cv_results columns and can be
+    plotted with Metrics.plot_grid_search_results()
+    → Members:
+      - estimator             : unfitted ensemble or pipeline
+      - param_grid            : dictionary or list of dictionaries {hyperparameter name: list of values}, like GridSearchCV
+      - n_estimators_parameter: name of the number of estimators hyperparameter, its values being in param_grid
+      - cv                    : cross-validation strategy or number of folds
+      - scoring               : name of the single-value score, computed from the predicted probabilities or classes
+      - refit                 : if True refit the best hyperparameters on the whole data
+      - n_jobs                : number of jobs
+      - return_train_score    : if True also score the train folds
+      - cv_results_, best_index_, best_params_, best_score_, best_estimator_: like GridSearchCV, set by fit()
+    """
+
+    def __init__(self, estimator, param_grid, n_estimators_parameter, cv=3, scoring='roc_auc', refit=True, n_jobs=1,
+                 return_train_score=False):
+        self.estimator              = estimator
+        self.param_grid             = param_grid
+        self.n_estimators_parameter = n_estimators_parameter
+        self.cv                     = cv
+        self.scoring                = scoring
+        self.refit                  = refit
+        self.n_jobs                 = n_jobs
+        self.return_train_score     = return_train_score
+
+
+    def get_staged_grid(self):
+        """
+        Return the list of the (other hyperparameters dictionary, sorted numbers of estimators list) tuples of the grid
+        """
+        staged_grid = []
+        for grid in ([self.param_grid] if isinstance(self.param_grid, dict) else self.param_grid):
+            if self.n_estimators_parameter not in grid:
+                raise ValueError('{} should be in every grid'.format(self.n_estimators_parameter))
+
+            other_grid = {name: values for (name, values) in grid.items() if name != self.n_estimators_parameter}
+            for parameters in ParameterGrid(other_grid):
+                staged_grid.append((parameters, sorted(set(grid[self.n_estimators_parameter]))))
+
+        return staged_grid
+
+
+    def fit(self, X, y, groups=None):
+        """
+        Run the staged grid search and refit the best hyperparameters
+        → Arguments:
+            - X
+            - y
+            - groups: can be left to None if cv doesn't implement GroupFold or similar
+        """
+        staged_grid = self.get_staged_grid()
+        splits = list(check_cv(self.cv, y, classifier=True).split(X, y, groups))
+
+        units = [(grid_number, fold_number) for grid_number in range(len(staged_grid)) for fold_number in range(len(splits))]
+        results = Parallel(n_jobs=self.n_jobs)(delayed(fit_and_score_staged)(self.estimator, X, y, splits[fold_number][0],
+                                                                             splits[fold_number][1], staged_grid[grid_number][0],
+                                                                             self.n_estimators_parameter, staged_grid[grid_number][1],
+                                                                             self.scoring, self.return_train_score)
+                                               for (grid_number, fold_number) in units)
+        results = {unit: result for (unit, result) in zip(units, results)}
+
+        # one candidate per (other hyperparameters, number of estimators), in the layout of GridSearchCV.cv_results_
+        params, test_scores, train_scores, fit_times = [], [], [], []
+        for (grid_number, (parameters, n_estimators_list)) in enumerate(staged_grid):
+            fold_results = [results[(grid_number, fold_number)] for fold_number in range(len(splits))]
+            for (i, n_estimators) in enumerate(n_estimators_list):
+                params.append(dict(parameters, **{self.n_estimators_parameter: n_estimators}))
+                test_scores.append([result['test_scores'][i] for result in fold_results])
+                if self.return_train_score:
+                    train_scores.append([result['train_scores'][i] for result in fold_results])
+                fit_times.append([result['fit_time'] for result in fold_results])
+
+        self.cv_results_ = {'params': params}
+        for name in sorted({name for parameters in params for name in parameters}):
+            self.cv_results_['param_{}'.format(name)] = np.ma.MaskedArray([parameters.get(name) for parameters in params],
+                                                                          mask=[name not in parameters for parameters in params],
+                                                                          dtype=object)
+        self.cv_results_['mean_fit_time'] = np.mean(fit_times, axis=1)
+        self.cv_results_['std_fit_time']  = np.std(fit_times, axis=1)
+
+        for (set_name, scores) in [('test', np.array(test_scores))] + ([('train', np.array(train_scores))] if self.return_train_score else []):
+            for fold_number in range(len(splits)):
+                self.cv_results_['split{}_{}_score'.format(fold_number, set_name)] = scores[:, fold_number]
+            self.cv_results_['mean_{}_score'.format(set_name)] = scores.mean(axis=1)
+            self.cv_results_['std_{}_score'.format(set_name)]  = scores.std(axis=1)
+        self.cv_results_['rank_test_score'] = np.argsort(np.argsort(-self.cv_results_['mean_test_score'], kind='stable'), kind='stable') + 1
+
+        self.best_index_  = int(np.argmax(self.cv_results_['mean_test_score']))
+        self.best_params_ = params[self.best_index_]
+        self.best_score_  = self.cv_results_['mean_test_score'][self.best_index_]
+
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+            self.classes_ = self.best_estimator_.classes_
+
+        return self
+
+
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)
+
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
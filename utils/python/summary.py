@@ -152,6 +152,14 @@ class Summary():
         if not scoring:
             scoring = self.scoring
 
+        # the paired t-test is only valid if both metrics were evaluated on the same folds (same Split_Plan or same splits), the
+        # metrics whose split fingerprint is unknown (pickled metrics, see Metrics.save()) can't be checked
+        split_fingerprints = [getattr(self.metrics_dict[name], 'split_fingerprint', None) for name in (metric_x_name, metric_y_name)]
+        if None not in split_fingerprints and split_fingerprints[0] != split_fingerprints[1]:
+            different_splits_warning = '\nWARNING: different cross-validation splits, the paired t-test is not valid'
+        else:
+            different_splits_warning = ''
+
         plt.figure(figsize=figsize)
 
         for i, score_name in enumerate(scoring):
@@ -181,6 +189,6 @@ class Summary():
 
 
             pvalue = ttest_rel(metric_x, metric_y).pvalue
-            title = plt.title(score_name + ' (p={:.2e})'.format(pvalue) + is_not_normal_warning)
+            title = plt.title(score_name + ' (p={:.2e})'.format(pvalue) + is_not_normal_warning + different_splits_warning)
             if pvalue < 0.05: # means significantly different with a 95% confidence
                 plt.setp(title, color='r', fontweight='bold', fontsize=14)